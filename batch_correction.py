@@ -0,0 +1,288 @@
+"""
+EECS 6692: Deep Learning on the Edge
+Headless pose correction over image folders and recorded videos
+
+python batch_correction.py recordings/ images/ --pose auto --output results.jsonl --workers 4
+"""
+import argparse
+import functools
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+from correction_algorithm.main import ANGLE_NAMES, compute_angles, landmarks_to_array
+from correction_algorithm.correction import POSE_NAMES, rule_violations, violations_feedback, format_feedback
+from correction_algorithm.classifier import PoseClassifier
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.webm')
+NUM_LANDMARKS = 33
+
+parser = argparse.ArgumentParser()
+parser.add_argument('inputs', nargs='+', help='image or video files, or directories to scan for them')
+parser.add_argument('--output', type=str, default='corrections.jsonl',
+                    help='.jsonl file, or a directory to get one .parquet file per input')
+parser.add_argument('--pose', type=str, default='auto',
+                    help='one of %s, or auto to classify the pose per frame' % ', '.join(POSE_NAMES))
+parser.add_argument('--model', type=str, default=os.path.join('models', 'pose_landmarker.task'))
+parser.add_argument('--workers', type=int, default=os.cpu_count())
+parser.add_argument('--frame_step', type=int, default=1, help='only process every n-th video frame')
+parser.add_argument('--no_resume', action='store_true', help='start over instead of skipping finished inputs')
+
+# Per process landmarkers, created by init_worker
+_model_path = None
+_image_landmarker = None
+
+
+# Function to collect the image and video files under the given paths
+def find_inputs(paths):
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                inputs += [os.path.join(root, f) for f in sorted(files)
+                           if f.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS)]
+        else:
+            inputs.append(path)
+    return inputs
+
+
+def _create_landmarker(running_mode):
+    from mediapipe.tasks import python
+    from mediapipe.tasks.python import vision
+
+    options = vision.PoseLandmarkerOptions(
+        num_poses=1,
+        min_pose_detection_confidence=0.5,
+        min_pose_presence_confidence=0.5,
+        min_tracking_confidence=0.5,
+        base_options=python.BaseOptions(model_asset_path=_model_path),
+        running_mode=running_mode,
+        output_segmentation_masks=False)
+    return vision.PoseLandmarker.create_from_options(options)
+
+
+def init_worker(model_path):
+    global _model_path
+    _model_path = model_path
+    # one landmarker per process is enough work per core, keep opencv from spawning its own threads
+    cv2.setNumThreads(1)
+
+
+def _mp_image(frame):
+    import mediapipe as mp
+    return mp.Image(image_format=mp.ImageFormat.SRGB, data=cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+
+# Function to run the landmarker over one input, returns the frame indices, timestamps and (T, 33, 3)
+# landmarks with NaN rows for frames without a person
+def detect_landmarks(path, frame_step=1):
+    global _image_landmarker
+    from mediapipe.tasks.python import vision
+
+    frames, timestamps, landmarks = [], [], []
+
+    def add(frame_id, timestamp, result):
+        frames.append(frame_id)
+        timestamps.append(timestamp)
+        if result.pose_landmarks:
+            landmarks.append(landmarks_to_array(result))
+        else:
+            landmarks.append(np.full((NUM_LANDMARKS, 3), np.nan))
+
+    if path.lower().endswith(IMAGE_EXTENSIONS):
+        if _image_landmarker is None:
+            _image_landmarker = _create_landmarker(vision.RunningMode.IMAGE)
+        image = cv2.imread(path)
+        if image is None:
+            raise IOError('Cannot read %s' % path)
+        add(0, 0, _image_landmarker.detect(_mp_image(image)))
+    else:
+        # VIDEO mode tracks across frames and needs increasing timestamps, so one landmarker per video
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise IOError('Cannot open %s' % path)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        with _create_landmarker(vision.RunningMode.VIDEO) as landmarker:
+            frame_id = 0
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if frame_id % frame_step == 0:
+                    timestamp = int(frame_id * 1000 / fps)
+                    add(frame_id, timestamp, landmarker.detect_for_video(_mp_image(frame), timestamp))
+                frame_id += 1
+        cap.release()
+
+    return frames, timestamps, np.array(landmarks).reshape(-1, NUM_LANDMARKS, 3)
+
+
+# Function to grade one input, runs in the worker processes
+def process_input(path, pose, frame_step=1):
+    frames, timestamps, landmarks = detect_landmarks(path, frame_step)
+    all_angles = compute_angles(landmarks)
+    if pose == "auto":
+        # all frames in one call, frames without a person get a meaningless pose that is not used
+        auto_poses, auto_confidences = PoseClassifier().classify(np.nan_to_num(all_angles))
+
+    records = []
+    for i, (frame_id, timestamp, angles) in enumerate(zip(frames, timestamps, all_angles)):
+        record = {"file": path, "frame": frame_id, "timestamp_ms": timestamp}
+        detected = not np.isnan(angles).any()
+        record["detected"] = detected
+        record.update({"angle_" + name: (float(a) if detected else None) for name, a in zip(ANGLE_NAMES, angles)})
+        if detected:
+            pose_name = auto_poses[i] if pose == "auto" else pose
+            violations = rule_violations(angles, pose_name)
+            record["pose"] = pose_name
+            record["pose_confidence"] = auto_confidences[i] if pose == "auto" else None
+            record["violations"] = [ANGLE_NAMES[j] for j in np.flatnonzero(violations)]
+            record["feedback"] = format_feedback(violations_feedback(violations, pose_name))
+        else:
+            record["pose"] = None
+            record["pose_confidence"] = None
+            record["violations"] = []
+            record["feedback"] = "No pose detected!"
+        records.append(record)
+    return records
+
+
+class JsonlWriter:
+    """
+    All records of one input are appended together, followed by a {"file": ..., "done": true} marker.
+    On resume, inputs with a marker are skipped and records of unfinished inputs are dropped.
+    """
+
+    def __init__(self, path, resume=True):
+        self.path = path
+        self.done = set()
+        if resume and os.path.exists(path):
+            self._recover()
+        else:
+            open(path, 'w').close()
+        self.file = open(path, 'a')
+
+    def _recover(self):
+        lines = []
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a line cut off by a crash
+                    continue
+                if record.get("done"):
+                    self.done.add(record["file"])
+                lines.append((record["file"], line if line.endswith('\n') else line + '\n'))
+        kept = [line for file, line in lines if file in self.done]
+        if len(kept) != len(lines):
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.writelines(kept)
+            os.replace(tmp_path, self.path)
+
+    def is_done(self, path):
+        return path in self.done
+
+    def write(self, path, records):
+        for record in records:
+            self.file.write(json.dumps(record) + '\n')
+        self.file.write(json.dumps({"file": path, "done": True, "frames": len(records)}) + '\n')
+        self.file.flush()
+        self.done.add(path)
+
+    def close(self):
+        self.file.close()
+
+
+# Function to build the schema every parquet part is written with, so parts of inputs where nobody was
+# detected (all null angles, empty violations) still read back as one dataset with the others
+@functools.lru_cache(maxsize=None)
+def parquet_schema():
+    import pyarrow as pa
+
+    return pa.schema(
+        [("file", pa.string()), ("frame", pa.int64()), ("timestamp_ms", pa.int64()), ("detected", pa.bool_())]
+        + [("angle_" + name, pa.float64()) for name in ANGLE_NAMES]
+        + [("pose", pa.string()), ("pose_confidence", pa.float64()), ("violations", pa.list_(pa.string())),
+           ("feedback", pa.string())])
+
+
+class ParquetWriter:
+    """
+    One parquet file per input in the output directory, named after a hash of the input path and
+    written through a temporary file, so an existing file always means a finished input.
+    """
+
+    def __init__(self, path, resume=True):
+        import pyarrow  # noqa: F401, fail early when parquet output is asked for without pyarrow
+
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.done = set()
+        if resume:
+            for name in os.listdir(path):
+                if name.endswith('.parquet'):
+                    self.done.add(name)
+
+    def _part_path(self, path):
+        return os.path.join(self.path, hashlib.sha1(path.encode()).hexdigest()[:16] + '.parquet')
+
+    def is_done(self, path):
+        return os.path.basename(self._part_path(path)) in self.done
+
+    def write(self, path, records):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        part_path = self._part_path(path)
+        pq.write_table(pa.Table.from_pylist(records, schema=parquet_schema()), part_path + '.tmp')
+        os.replace(part_path + '.tmp', part_path)
+        self.done.add(os.path.basename(part_path))
+
+    def close(self):
+        pass
+
+
+def main():
+    args = parser.parse_args()
+    if args.pose != "auto" and args.pose not in POSE_NAMES:
+        parser.error('--pose must be auto or one of %s' % ', '.join(POSE_NAMES))
+
+    if args.output.endswith('.jsonl'):
+        writer = JsonlWriter(args.output, resume=not args.no_resume)
+    else:
+        writer = ParquetWriter(args.output, resume=not args.no_resume)
+
+    inputs = find_inputs(args.inputs)
+    todo = [path for path in inputs if not writer.is_done(path)]
+    print('%d inputs, %d already done' % (len(inputs), len(inputs) - len(todo)))
+
+    failed = 0
+    with ProcessPoolExecutor(args.workers, initializer=init_worker, initargs=(args.model,)) as pool:
+        futures = {pool.submit(process_input, path, args.pose, args.frame_step): path for path in todo}
+        for i, future in enumerate(as_completed(futures)):
+            path = futures[future]
+            try:
+                records = future.result()
+            except Exception as e:
+                failed += 1
+                print('[%d/%d] %s failed: %s' % (i + 1, len(todo), path, e), file=sys.stderr)
+                continue
+            writer.write(path, records)
+            print('[%d/%d] %s: %d frames' % (i + 1, len(todo), path, len(records)))
+    writer.close()
+
+    if failed:
+        print('%d inputs failed, rerun to retry them' % failed, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
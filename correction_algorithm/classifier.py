@@ -0,0 +1,100 @@
+"""
+EECS 6692: Deep Learning on the Edge
+File contains the classifier picking the yoga pose from the joint angles
+"""
+import time
+import numpy as np
+
+from correction_algorithm.main import ANGLE_NAMES
+from correction_algorithm.correction import POSE_NAMES, RULE_TARGETS
+
+class PoseClassifier:
+    """
+    Scores angle vectors against every pose at once.
+
+    By default a pose's score is the weighted mean absolute difference to its ground truth
+    angles, over the joints the pose has a target for, and the confidence is a softmax over
+    those distances with `temperature` degrees. After fit() the classifier instead votes
+    among the k nearest recorded angle vectors, weighted by inverse distance.
+    """
+
+    def __init__(self, temperature=10.0, k=5):
+        self.temperature = temperature
+        self.k = k
+        self.targets = RULE_TARGETS
+        # joints without a ground truth (e.g. the ankles in chair pose) don't count for that pose
+        self.weights = (RULE_TARGETS > 0).astype(float)
+        self.weights /= self.weights.sum(axis=1, keepdims=True)
+        self.samples = None
+        self.labels = None
+
+    def fit(self, angles, labels):
+        # angles: (M, 10) recorded angle vectors, labels: their pose names
+        self.samples = np.asarray(angles, dtype=float)
+        self.labels = np.array([POSE_NAMES.index(label) for label in labels])
+        return self
+
+    def scores(self, angles):
+        """
+        angles: (10,) or (N, 10) angle vectors.
+        Returns (num_poses,) or (N, num_poses) probabilities, columns ordered as POSE_NAMES.
+        """
+        angles = np.asarray(angles, dtype=float)
+        if self.samples is not None:
+            return self._knn_scores(angles)
+        distances = (np.abs(angles[..., None, :] - self.targets) * self.weights).sum(axis=-1)
+        logits = -distances / self.temperature
+        logits -= logits.max(axis=-1, keepdims=True)
+        probabilities = np.exp(logits)
+        return probabilities / probabilities.sum(axis=-1, keepdims=True)
+
+    def _knn_scores(self, angles):
+        single = angles.ndim == 1
+        angles = angles.reshape(-1, len(ANGLE_NAMES))
+        distances = np.linalg.norm(angles[:, None, :] - self.samples[None, :, :], axis=2)
+        k = min(self.k, len(self.samples))
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        votes = 1.0 / np.maximum(np.take_along_axis(distances, nearest, axis=1), 1e-6)
+        scores = np.zeros((len(angles), len(POSE_NAMES)))
+        np.add.at(scores, (np.arange(len(angles))[:, None], self.labels[nearest]), votes)
+        scores /= scores.sum(axis=1, keepdims=True)
+        return scores[0] if single else scores
+
+    def classify(self, angles):
+        """
+        Returns (pose name, confidence) for a (10,) vector, or lists of both for (N, 10).
+        """
+        scores = self.scores(angles)
+        best = scores.argmax(axis=-1)
+        confidence = np.take_along_axis(scores, np.expand_dims(best, -1), axis=-1)[..., 0]
+        if np.ndim(best) == 0:
+            return POSE_NAMES[int(best)], float(confidence)
+        return [POSE_NAMES[b] for b in best], confidence.tolist()
+
+# Function to check the ground truths classify as their own pose and to time one classification
+def check_classifier(num_samples=1000, noise=10.0, seed=0):
+    rng = np.random.default_rng(seed)
+    classifier = PoseClassifier()
+
+    labels = rng.integers(0, len(POSE_NAMES), num_samples)
+    # joints without a target get random angles, the rest are jittered around the ground truth
+    angles = np.where(RULE_TARGETS[labels] > 0, RULE_TARGETS[labels], rng.uniform(0, 180, (num_samples, len(ANGLE_NAMES))))
+    angles = np.clip(angles + rng.normal(0, noise, angles.shape), 0, 180)
+
+    predicted, _ = classifier.classify(angles)
+    accuracy = np.mean([p == POSE_NAMES[l] for p, l in zip(predicted, labels)])
+    print("Weighted distance accuracy at %.0f degrees of noise: %.3f" % (noise, accuracy))
+
+    knn = PoseClassifier().fit(angles[:num_samples // 2], [POSE_NAMES[l] for l in labels[:num_samples // 2]])
+    predicted, _ = knn.classify(angles[num_samples // 2:])
+    accuracy = np.mean([p == POSE_NAMES[l] for p, l in zip(predicted, labels[num_samples // 2:])])
+    print("k-NN accuracy on held out vectors: %.3f" % accuracy)
+
+    for name, model in (("weighted distance", classifier), ("k-NN", knn)):
+        start = time.perf_counter()
+        for sample in angles[:200]:
+            model.classify(sample)
+        print("%s: %.1f us per frame" % (name, 1e6 * (time.perf_counter() - start) / 200))
+
+if __name__ == "__main__":
+    check_classifier()
@@ -4,7 +4,10 @@ Authors: Devika Gumaste, Harsh Benahalkar
 File contains functions for the correction algorithm
 """
 
+import numpy as np
+
 from utils.constants import *
+from correction_algorithm.main import ANGLE_NAMES
 
 # Function to define the error margin
 def error_margin(control, value):
@@ -53,4 +56,83 @@ def format_feedback(pose_feedback):
             if error_message not in formatted_feedback:
                 formatted_feedback += f"{error_message}"
                 formatted_feedback += " "
-    return formatted_feedback
\ No newline at end of file
+    return formatted_feedback
+
+# Compiled rule set, built once at import from GROUND_TRUTHS and PERSONALIZED_MESSAGES.
+# Rows follow POSE_NAMES and columns follow ANGLE_NAMES, the order compute_angles returns.
+# A joint only produces feedback when the pose has a target for it and a message to show,
+# the same joints check_pose_angle reports.
+ANGLE_TOLERANCE = 20
+
+POSE_NAMES = tuple(Constants.GROUND_TRUTHS.value.keys())
+POSE_INDEX = {name: i for i, name in enumerate(POSE_NAMES)}
+MESSAGES = tuple(sorted({
+    message for pose_messages in Constants.PERSONALIZED_MESSAGES.value.values() for message in pose_messages.values()
+}))
+
+def _compile_rules():
+    targets = np.zeros((len(POSE_NAMES), len(ANGLE_NAMES)))
+    tolerances = np.full((len(POSE_NAMES), len(ANGLE_NAMES)), ANGLE_TOLERANCE)
+    message_ids = np.full((len(POSE_NAMES), len(ANGLE_NAMES)), -1)
+    for p, pose_name in enumerate(POSE_NAMES):
+        pose_messages = Constants.PERSONALIZED_MESSAGES.value.get(pose_name, {})
+        for joint, target in Constants.GROUND_TRUTHS.value[pose_name].items():
+            j = ANGLE_NAMES.index(joint)
+            targets[p, j] = target
+            if pose_messages.get(joint):
+                message_ids[p, j] = MESSAGES.index(pose_messages[joint])
+    return targets, tolerances, message_ids
+
+RULE_TARGETS, RULE_TOLERANCES, RULE_MESSAGE_IDS = _compile_rules()
+
+# Function to find the joints outside the error margin for one or all poses
+def rule_violations(angles, pose_name=None):
+    """
+    angles: (10,) angle vector from compute_angles.
+    Returns a boolean (10,) mask for pose_name, or (num_poses, 10) for all poses.
+    """
+    rows = slice(None) if pose_name is None else POSE_INDEX[pose_name]
+    targets = RULE_TARGETS[rows]
+    tolerances = RULE_TOLERANCES[rows]
+    # error_margin compares int(angle), truncating the same way keeps the boundaries identical
+    values = np.trunc(angles)
+    outside = (values < targets - tolerances) | (values > targets + tolerances)
+    return outside & (RULE_MESSAGE_IDS[rows] >= 0)
+
+# Function to turn a (10,) violation mask of one pose into check_pose_angle style feedback
+def violations_feedback(pose_violations, pose_name):
+    if not pose_violations.any():
+        return "Correct"
+    message_ids = RULE_MESSAGE_IDS[POSE_INDEX[pose_name]]
+    return {ANGLE_NAMES[j]: MESSAGES[message_ids[j]] for j in np.flatnonzero(pose_violations)}
+
+# Function to check the angle vector against the compiled rules, same output as check_pose_angle
+def check_pose_rules(angles, pose_name=None):
+    violations = rule_violations(angles, pose_name)
+    if pose_name is not None:
+        return violations_feedback(violations, pose_name)
+    return {name: violations_feedback(violations[p], name) for p, name in enumerate(POSE_NAMES)}
+
+# Function to compare the compiled rules with check_pose_angle and format_feedback
+def check_rule_parity(num_samples=10000, seed=0):
+    rng = np.random.default_rng(seed)
+    angles = rng.uniform(0, 180, (num_samples, len(ANGLE_NAMES)))
+    # put some angles right on the margins, where truncation matters
+    targets = RULE_TARGETS[rng.integers(0, len(POSE_NAMES), num_samples)]
+    edges = targets + rng.choice([-21, -20, 20, 21], targets.shape) + rng.uniform(-0.5, 0.5, targets.shape)
+    angles = np.where(rng.random(angles.shape) < 0.5, np.clip(edges, 0, 180), angles)
+
+    for sample in angles:
+        expected = check_pose_angle(dict(zip(ANGLE_NAMES, sample)))
+        actual = check_pose_rules(sample)
+        if expected != actual:
+            raise AssertionError("compiled rules differ for angles %s: %s vs %s" % (sample, actual, expected))
+        for pose_name in POSE_NAMES:
+            if check_pose_rules(sample, pose_name) != expected[pose_name]:
+                raise AssertionError("compiled rules differ for %s at angles %s" % (pose_name, sample))
+            if format_feedback(actual[pose_name]) != format_feedback(expected[pose_name]):
+                raise AssertionError("formatted feedback differs for %s at angles %s" % (pose_name, sample))
+    print("Compiled rules match check_pose_angle on %d angle vectors" % num_samples)
+
+if __name__ == "__main__":
+    check_rule_parity()
@@ -6,9 +6,12 @@ File contains functions to create angles and landmarks dictionaries
 import os
 import cv2
 import numpy as np
-import pandas as pd
 from utils.constants import Constants
 
+# Column names of the flattened landmark rows built by create_landmarks_dict
+COL_NAMES = [name + axis for name in Constants.BODY_KP.value.keys() for axis in ("_x", "_y", "_z")]
+POSE_COLS = COL_NAMES + ["pose"]
+
 # Function to calculate angle between two points
 def angle(p1, p2, p3):
     a = np.array([p1[0], p1[1]])
@@ -134,95 +137,55 @@ def calculate_angles(landmarks_list):
     )
     return armpit_left, armpit_right, elbow_left, elbow_right, hip_left, hip_right, knee_left, knee_right, ankle_left, ankle_right
 
-# Function to create angles data structure
-def create_angles_dict(result, pose_cols):
-    pose_list = []
-    angles_dict = {}
-
-    pre_list = []
-
+# Joint angles computed by compute_angles, each one is the angle at the middle landmark
+ANGLE_JOINTS = (
+    ("armpit_left", ("left_elbow", "left_shoulder", "left_hip")),
+    ("armpit_right", ("right_elbow", "right_shoulder", "right_hip")),
+    ("elbow_left", ("left_shoulder", "left_elbow", "left_wrist")),
+    ("elbow_right", ("right_shoulder", "right_elbow", "right_wrist")),
+    ("hip_left", ("left_shoulder", "left_hip", "left_knee")),
+    ("hip_right", ("right_shoulder", "right_hip", "right_knee")),
+    ("knee_left", ("left_hip", "left_knee", "left_ankle")),
+    ("knee_right", ("right_hip", "right_knee", "right_ankle")),
+    ("ankle_left", ("left_knee", "left_ankle", "left_foot_index")),
+    ("ankle_right", ("right_knee", "right_ankle", "right_foot_index")),
+)
+ANGLE_NAMES = tuple(name for name, _ in ANGLE_JOINTS)
+ANGLE_INDEX = {name: i for i, name in enumerate(ANGLE_NAMES)}
+
+# (10, 3) mediapipe landmark indices of the (p1, vertex, p3) triplet of every joint angle
+JOINT_TRIPLETS = np.array([
+    [Constants.BODY_KP.value[kp] for kp in triplet] for _, triplet in ANGLE_JOINTS
+])
+
+# Function to copy the landmarks of one detected person into a (33, 3) array
+def landmarks_to_array(result, pose=0):
+    return np.array([(landmark.x, landmark.y, landmark.z) for landmark in result.pose_landmarks[pose]])
+
+# Function to copy the landmarks of every detected person into a (N, 33, 3) array
+def all_landmarks_to_array(result):
+    return np.array([
+        [(landmark.x, landmark.y, landmark.z) for landmark in pose_landmarks]
+        for pose_landmarks in result.pose_landmarks
+    ]).reshape(-1, 33, 3)
+
+# Function to calculate all joint angles at once, same formula as angle()
+def compute_angles(landmarks):
+    """
+    landmarks: (33, 3) or (T, 33, 3) array of mediapipe landmarks, only x and y are used.
+    Returns a (10,) or (T, 10) array of angles in degrees, columns ordered as ANGLE_NAMES.
+    """
+    points = np.asarray(landmarks)[..., JOINT_TRIPLETS, :2]
+    vectors = points - points[..., 1:2, :]
+    directions = np.arctan2(vectors[..., 1], vectors[..., 0])
+    angles = np.abs((directions[..., 2] - directions[..., 0]) * 180.0 / np.pi)
+    return np.where(angles > 180, 360 - angles, angles)
+
+# Function to create angles data structure, one entry per detected person
+def create_angles_dict(result, pose_cols=None):
     # if no person is detected
     if len(result.pose_landmarks) == 0:
         return None
-    
-    try:
-        # fetch the landmarks
-        for landmark in result.pose_landmarks[0]:
-            pre_list.append((landmark.x,
-                             landmark.y,
-                             landmark.z))
-
-        # list for shoulder, elbow, wrist
-        list_11_16 = np.array([
-            [
-                pre_list[m][0],
-                pre_list[m][1],
-                pre_list[m][2]
-            ] for m in range(11, 17)
-        ]).flatten().tolist()
-
-        # hip knee ankle
-        list_23_33 = np.array([
-            [
-                pre_list[m][0],
-                pre_list[m][1],
-                pre_list[m][2]
-            ] for m in range(23, 33)
-        ]).flatten().tolist()
-
-        list_11_16.extend(list_23_33)
-
-        all_list = [
-            pre_list[0][0],
-            pre_list[0][1],
-            pre_list[0][2],
-        ]
-
-        all_list.extend(list_11_16)
-        tpl = all_list.copy()
-        tpl.append(16)
-        pose_list.append(tpl)
 
-        data_pose = pd.DataFrame(pose_list, columns=pose_cols)
-
-        for i, row in data_pose.iterrows():
-            sl = []
-            landmarks_list = Constants.LANDMARKS_LIST.value
-            landmarks_list["left_shoulder"] = [row["left_shoulder_x"], row["left_shoulder_y"]]
-            landmarks_list["right_shoulder"] = [row["right_shoulder_x"], row["right_shoulder_y"]]
-            landmarks_list["left_elbow"] = [row["left_elbow_x"], row["left_elbow_y"]]
-            landmarks_list["right_elbow"] = [row["right_elbow_x"], row["right_elbow_y"]]
-            landmarks_list["left_wrist"] = [row["left_wrist_x"], row["left_wrist_y"]]
-            landmarks_list["right_wrist"] = [row["right_wrist_x"], row["right_wrist_y"]]
-            landmarks_list["left_hip"] = [row["left_hip_x"], row["left_hip_y"]]
-            landmarks_list["right_hip"] = [row["right_hip_x"], row["right_hip_y"]]
-            landmarks_list["left_knee"] = [row["left_knee_x"], row["left_knee_y"]]
-            landmarks_list["right_knee"] = [row["right_knee_x"], row["right_knee_y"]]
-            landmarks_list["left_ankle"] = [row["left_ankle_x"], row["left_ankle_y"]]
-            landmarks_list["right_ankle"] = [row["right_ankle_x"], row["right_ankle_y"]]
-            landmarks_list["left_heel"] = [row["left_heel_x"], row["left_heel_y"]]
-            landmarks_list["right_heel"] = [row["right_heel_x"], row["right_heel_y"]]
-            landmarks_list["left_foot_index"] = [row["left_foot_index_x"], row["left_foot_index_y"]]
-            landmarks_list["right_foot_index"] = [row["right_foot_index_x"], row["right_foot_index_y"]]
-
-            armpit_left, armpit_right, elbow_left, elbow_right, hip_left, hip_right, \
-            knee_left, knee_right, ankle_left, ankle_right = calculate_angles(landmarks_list)
-
-            angles_dict[i] = {
-                "armpit_left": armpit_left,
-                "armpit_right": armpit_right,
-                "elbow_left": elbow_left,
-                "elbow_right": elbow_right,
-                "hip_left": hip_left,
-                "hip_right": hip_right,
-                "knee_left": knee_left,
-                "knee_right": knee_right,
-                "ankle_left": ankle_left,
-                "ankle_right": ankle_right
-            }
-
-        return angles_dict
-
-    except Exception as e:
-        print(e)
-        return None
+    angles = compute_angles(all_landmarks_to_array(result))
+    return {i: dict(zip(ANGLE_NAMES, person_angles)) for i, person_angles in enumerate(angles.tolist())}
@@ -0,0 +1,135 @@
+"""
+EECS 6692: Deep Learning on the Edge
+File contains the streaming correction stage used by the live view
+"""
+import numpy as np
+
+from correction_algorithm.main import ANGLE_NAMES
+from correction_algorithm.correction import rule_violations, violations_feedback, format_feedback
+
+NO_POSE_MESSAGE = "No pose detected!"
+
+# Exponential moving average over the joint angles
+class EmaFilter:
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+        self.value = None
+
+    def reset(self):
+        self.value = None
+
+    def __call__(self, angles, timestamp):
+        if self.value is None:
+            self.value = angles.copy()
+        else:
+            self.value += self.alpha * (angles - self.value)
+        return self.value
+
+# One-Euro filter (Casiez et al.), smooths hard while a joint is still and follows quickly when it moves
+class OneEuroFilter:
+    def __init__(self, min_cutoff=1.0, beta=0.05, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self.derivative = None
+        self.timestamp = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        tau = 1.0 / (2 * np.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def __call__(self, angles, timestamp):
+        if self.value is None:
+            self.value = angles.copy()
+            self.derivative = np.zeros_like(angles)
+            self.timestamp = timestamp
+            return self.value
+
+        dt = max(timestamp - self.timestamp, 1e-3)
+        self.timestamp = timestamp
+
+        derivative = (angles - self.value) / dt
+        self.derivative += self._alpha(self.d_cutoff, dt) * (derivative - self.derivative)
+        cutoff = self.min_cutoff + self.beta * np.abs(self.derivative)
+        self.value += self._alpha(cutoff, dt) * (angles - self.value)
+        return self.value
+
+FILTERS = {
+    "ema": EmaFilter,
+    "one_euro": OneEuroFilter,
+}
+
+class StreamingCorrection:
+    """
+    Per frame feedback for one pose.
+
+    Every result goes through the smoothing filter and gets checked against the compiled rules of
+    the selected pose. A joint's message only appears or disappears after `hysteresis_frames`
+    consecutive frames agree, and "No pose detected!" only after that many frames without a person.
+    All of it is O(1) per frame.
+    """
+
+    def __init__(self, pose_name, smoothing="one_euro", hysteresis_frames=5, **filter_args):
+        self.pose_name = pose_name
+        self.hysteresis_frames = hysteresis_frames
+        self.filter = FILTERS[smoothing](**filter_args)
+        self.reset()
+
+    def reset(self):
+        self.filter.reset()
+        self.violations = np.zeros(len(ANGLE_NAMES), dtype=bool)
+        self.pending = np.zeros(len(ANGLE_NAMES), dtype=int)
+        self.missing = 0
+        self.detected = False
+        self.text = None
+
+    def set_pose(self, pose_name):
+        # the smoothed angles are still valid for the new pose, only the feedback starts over
+        self.pose_name = pose_name
+        self.violations[:] = False
+        self.pending[:] = 0
+        self.text = None
+
+    def update(self, angles, timestamp):
+        """
+        angles: (10,) vector from compute_angles, or None when no person was detected.
+        timestamp: in seconds.
+        Returns True when the feedback text changed.
+        """
+        if angles is None:
+            self.missing += 1
+            if self.missing >= self.hysteresis_frames and self.detected:
+                self.reset()
+            return self._set_text(NO_POSE_MESSAGE if not self.detected else self.text)
+
+        first_frame = not self.detected or self.text is None
+        self.missing = 0
+        self.detected = True
+        smoothed = self.filter(np.asarray(angles, dtype=float), timestamp)
+
+        violations = rule_violations(smoothed, self.pose_name)
+        if first_frame:
+            # nothing shown yet, start from the current frame instead of waiting for the hysteresis
+            self.violations = violations
+            return self._set_text(format_feedback(violations_feedback(self.violations, self.pose_name)))
+
+        # count consecutive frames that disagree with the shown state, flip once there are enough
+        disagree = violations != self.violations
+        self.pending = np.where(disagree, self.pending + 1, 0)
+        flip = self.pending >= self.hysteresis_frames
+        self.violations ^= flip
+        self.pending[flip] = 0
+
+        if flip.any():
+            return self._set_text(format_feedback(violations_feedback(self.violations, self.pose_name)))
+        return False
+
+    def _set_text(self, text):
+        changed = text != self.text
+        self.text = text
+        return changed
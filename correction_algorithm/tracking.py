@@ -0,0 +1,154 @@
+"""
+EECS 6692: Deep Learning on the Edge
+File contains the tracker keeping person identities across frames for multi-person correction
+"""
+import numpy as np
+
+from correction_algorithm.streaming import StreamingCorrection
+
+# Function to compute the (N, 4) x_min, y_min, x_max, y_max boxes around (N, 33, 3) landmarks
+def landmark_boxes(landmarks):
+    xy = landmarks[..., :2]
+    return np.concatenate([xy.min(axis=1), xy.max(axis=1)], axis=1)
+
+# Function to compute the (N, M) IoU matrix between two sets of boxes
+def box_iou(boxes_a, boxes_b):
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-9)
+
+class Track:
+    def __init__(self, track_id, box, corrector):
+        self.id = track_id
+        self.box = box
+        self.corrector = corrector
+        self.missed = 0
+        # pose classification, only used when the tracker has a classifier
+        self.confidence = None
+        self.candidate = None
+        self.candidate_count = 0
+
+class PoseTracker:
+    """
+    Greedy IoU matching of the detected people to the existing tracks, falling back to the
+    distance between box centers for people whose box moved too much to overlap. Every track
+    keeps its own StreamingCorrection, so feedback state follows the person and not the
+    detection order. Tracks unmatched for `max_missed` frames are dropped.
+
+    With a classifier, each person's pose is picked automatically. A track switches to another
+    pose once it has been the top pose with at least `min_confidence` for `hysteresis_frames`
+    consecutive results.
+    """
+
+    def __init__(self, pose_name, min_iou=0.3, max_center_distance=0.1, max_missed=15, classifier=None,
+                 min_confidence=0.6, **correction_args):
+        self.pose_name = pose_name
+        self.classifier = classifier
+        self.min_confidence = min_confidence
+        self.min_iou = min_iou
+        self.max_center_distance = max_center_distance
+        self.max_missed = max_missed
+        self.correction_args = correction_args
+        self.tracks = []
+        self.next_id = 1
+
+    def set_pose(self, pose_name, classifier=None):
+        self.pose_name = pose_name
+        self.classifier = classifier
+        for track in self.tracks:
+            track.corrector.set_pose(pose_name)
+            track.candidate_count = 0
+
+    def _classify(self, track, pose_name, confidence):
+        track.confidence = confidence
+        if pose_name == track.corrector.pose_name or confidence < self.min_confidence:
+            track.candidate_count = 0
+            return
+        if pose_name != track.candidate:
+            track.candidate = pose_name
+            track.candidate_count = 0
+        track.candidate_count += 1
+        if track.candidate_count >= track.corrector.hysteresis_frames:
+            track.corrector.set_pose(pose_name)
+            track.candidate_count = 0
+
+    def _match(self, boxes):
+        # returns (track index, detection index) pairs, best scores first
+        if not self.tracks or not len(boxes):
+            return []
+        track_boxes = np.array([track.box for track in self.tracks])
+        iou = box_iou(track_boxes, boxes)
+        centers = (track_boxes[:, None, :2] + track_boxes[:, None, 2:] - boxes[None, :, :2] - boxes[None, :, 2:]) / 2
+        distance = np.linalg.norm(centers, axis=2)
+        # IoU matches rank above any center distance match
+        score = np.where(iou >= self.min_iou, 1 + iou,
+                         np.where(distance <= self.max_center_distance, 1 - distance, -np.inf))
+
+        matches = []
+        order = np.argsort(score, axis=None)[::-1]
+        used_tracks, used_detections = set(), set()
+        for flat in order:
+            t, d = np.unravel_index(flat, score.shape)
+            if score[t, d] == -np.inf:
+                break
+            if t in used_tracks or d in used_detections:
+                continue
+            used_tracks.add(t)
+            used_detections.add(d)
+            matches.append((t, d))
+        return matches
+
+    def update(self, landmarks, angles, timestamp):
+        """
+        landmarks: (N, 33, 3) landmarks of the people detected in this frame, angles: their (N, 10) angles.
+        Returns the list of (track, detection index) for the people in this frame.
+        """
+        boxes = landmark_boxes(landmarks) if len(landmarks) else np.zeros((0, 4))
+        matches = self._match(boxes)
+        if self.classifier is not None and len(boxes):
+            # every person in one call, before the correction so a switch applies to this frame
+            pose_names, confidences = self.classifier.classify(angles)
+
+        matched_tracks = {t for t, _ in matches}
+        matched_detections = {d for _, d in matches}
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.missed += 1
+                track.corrector.update(None, timestamp)
+
+        people = []
+        for t, d in matches:
+            track = self.tracks[t]
+            track.box = boxes[d]
+            track.missed = 0
+            if self.classifier is not None:
+                self._classify(track, pose_names[d], confidences[d])
+            track.corrector.update(angles[d], timestamp)
+            people.append((track, d))
+
+        for d in range(len(boxes)):
+            if d not in matched_detections:
+                pose_name = self.pose_name
+                if self.classifier is not None:
+                    pose_name = pose_names[d]
+                track = Track(self.next_id, boxes[d], StreamingCorrection(pose_name, **self.correction_args))
+                if self.classifier is not None:
+                    track.confidence = confidences[d]
+                self.next_id += 1
+                track.corrector.update(angles[d], timestamp)
+                self.tracks.append(track)
+                people.append((track, d))
+
+        self.tracks = [track for track in self.tracks if track.missed <= self.max_missed]
+        return sorted(people, key=lambda person: person[0].id)
+
+    def recent_tracks(self):
+        """
+        Tracks missing from fewer than `hysteresis_frames` results, whose feedback still stands
+        through a dropped detection. Empty once everyone has been gone that long.
+        """
+        return [track for track in sorted(self.tracks, key=lambda track: track.id)
+                if 0 < track.missed < track.corrector.hysteresis_frames]
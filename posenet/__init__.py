@@ -1,6 +1,7 @@
 from posenet.constants import *
 # from posenet.decode_multi import decode_multiple_poses
 from posenet import decode
-from posenet.models.model_factory import load_model
+from posenet.models.model_factory import load_model, load_backend, add_device_args, select_device, inference_context, to_input_tensor
 from posenet.models import MobileNetV1, MOBILENET_V1_CHECKPOINTS
+from posenet.models.backends import BACKENDS
 from posenet.utils import *
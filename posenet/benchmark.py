@@ -2,22 +2,71 @@ import torch
 import time
 import argparse
 import os
+import numpy as np
 
 import posenet
+import posenet.decode_multi
 
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--model', type=int, default=101)
 parser.add_argument('--image_dir', type=str, default='./images')
 parser.add_argument('--num_images', type=int, default=1000)
+parser.add_argument('--backend', type=str, default='eager', choices=posenet.BACKENDS)
+parser.add_argument('--quantize', type=str, default=None)
+parser.add_argument('--optimize', action='store_true')
+parser.add_argument('--calibration_dir', type=str, default=None)
+posenet.add_device_args(parser)
 args = parser.parse_args()
+if args.optimize and args.backend != 'eager':
+    parser.error('--optimize compares against the eager model, it needs --backend eager')
+
+
+def decode(model, input_image):
+    heatmaps, offsets, displacement_fwd, displacement_bwd = model(input_image)
+    return posenet.decode_multi.decode_multiple_poses(
+        heatmaps.squeeze(0),
+        offsets.squeeze(0),
+        displacement_fwd.squeeze(0),
+        displacement_bwd.squeeze(0),
+        output_stride=model.output_stride,
+        max_pose_detections=10,
+        min_pose_score=0.25)
+
+
+def run(model, images, filenames, device, num_images):
+    start = time.time()
+    for i in range(num_images):
+        input_image = posenet.to_input_tensor(images[filenames[i % len(filenames)]], device, args.channels_last)
+        decode(model, input_image)
+    return num_images / (time.time() - start)
+
+
+def keypoint_error(model, reference_model, images, device, min_pose_score=0.25):
+    # match every reference pose to the closest pose of the other model and measure how far
+    # its keypoints moved, in input image pixels
+    errors = []
+    missed = 0
+    for input_image in images.values():
+        input_image = posenet.to_input_tensor(input_image, device)
+        ref_scores, _, ref_coords, _ = decode(reference_model, input_image)
+        pose_scores, _, keypoint_coords, _ = decode(model, input_image)
+        keypoint_coords = keypoint_coords[pose_scores >= min_pose_score]
+        for ref_pose in ref_coords[ref_scores >= min_pose_score]:
+            if not len(keypoint_coords):
+                missed += 1
+                continue
+            distances = np.linalg.norm(keypoint_coords - ref_pose, axis=2)
+            errors.append(distances[np.argmin(distances.mean(axis=1))])
+    return np.array(errors).reshape(-1, posenet.NUM_KEYPOINTS), missed
 
 
 def main():
 
-    with torch.no_grad():
-        model = posenet.load_model(args.model)
-        model = model.cuda()
+    device = posenet.select_device(args.device, args.num_threads, args.num_interop_threads)
+
+    with posenet.inference_context(args.inference_mode):
+        model = posenet.load_backend(args.backend, args.model, device=device, channels_last=args.channels_last)
         output_stride = model.output_stride
         num_images = args.num_images
 
@@ -28,22 +77,46 @@ def main():
 
         images = {f: posenet.read_imgfile(f, 1.0, output_stride)[0] for f in filenames}
 
-        start = time.time()
-        for i in range(num_images):
-            input_image = torch.Tensor(images[filenames[i % len(filenames)]]).cuda()
-
-            results = model(input_image)
-            heatmaps, offsets, displacement_fwd, displacement_bwd = results
-            output = posenet.decode_multiple_poses(
-                heatmaps.squeeze(0),
-                offsets.squeeze(0),
-                displacement_fwd.squeeze(0),
-                displacement_bwd.squeeze(0),
-                output_stride=output_stride,
-                max_pose_detections=10,
-                min_pose_score=0.25)
-
-        print('Average FPS:', num_images / (time.time() - start))
+        fps = run(model, images, filenames, device, num_images)
+        print('Average FPS (%s):' % args.backend, fps)
+
+        if args.optimize:
+            optimized_model = posenet.load_model(
+                args.model, device=device, channels_last=args.channels_last, optimize=True)
+            optimized_fps = run(optimized_model, images, filenames, device, num_images)
+            print('Average FPS (optimized):', optimized_fps)
+            print('Speedup: %.2fx' % (optimized_fps / fps))
+
+            # the rewrite is exact up to float summation order
+            max_diff = 0.
+            for input_image in images.values():
+                input_image = posenet.to_input_tensor(input_image, device, args.channels_last)
+                for e, a in zip(model(input_image), optimized_model(input_image)):
+                    max_diff = max(max_diff, (e - a).abs().max().item())
+            print('Max abs output difference vs eager: %g' % max_diff)
+
+        if args.quantize:
+            # quantized kernels only exist for CPU, so the int8 model is compared with an fp32 model on CPU too
+            cpu = torch.device('cpu')
+            if device.type == 'cpu' and args.backend == 'eager':
+                reference_model, reference_fps = model, fps
+            else:
+                reference_model = posenet.load_model(args.model, device=cpu, channels_last=args.channels_last)
+                reference_fps = run(reference_model, images, filenames, cpu, num_images)
+                print('Average FPS (eager, cpu):', reference_fps)
+            quantized_model = posenet.load_model(
+                args.model, device=cpu, quantize=args.quantize, calibration_dir=args.calibration_dir or args.image_dir)
+            quantized_fps = run(quantized_model, images, filenames, cpu, num_images)
+            print('Average FPS (%s, cpu):' % args.quantize, quantized_fps)
+            print('Speedup vs fp32 on cpu: %.2fx' % (quantized_fps / reference_fps))
+
+            errors, missed = keypoint_error(quantized_model, reference_model, images, cpu)
+            if len(errors):
+                print('Keypoint error vs fp32 over %d poses: mean %.2f px, median %.2f px, max %.2f px' % (
+                    len(errors), errors.mean(), np.median(errors), errors.max()))
+                for name, error in zip(posenet.PART_NAMES, errors.mean(axis=0)):
+                    print('  %-15s %.2f px' % (name, error))
+            print('fp32 poses without an %s match: %d' % (args.quantize, missed))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,222 @@
+import torch
+import time
+import argparse
+import numpy as np
+
+import posenet
+from posenet.decode_multi import decode_multiple_poses, decode_multiple_poses_torch
+from posenet.decode_batch import decode_multiple_poses_batch
+from posenet.decode import decode_single_pose
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--num_images', type=int, default=16)
+parser.add_argument('--num_people', type=int, default=5)
+parser.add_argument('--resolution', type=int, default=513)
+parser.add_argument('--output_stride', type=int, default=16)
+parser.add_argument('--repeats', type=int, default=10)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--crowd', action='store_true')
+parser.add_argument('--single_pose', action='store_true')
+parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+args = parser.parse_args()
+
+
+def synthetic_outputs(num_images, num_people, resolution, output_stride, seed=0):
+    # fake model outputs with one gaussian peak per keypoint per person, so decoding
+    # sees realistic numbers of local maxima without needing the model weights
+    rng = np.random.default_rng(seed)
+    size = (resolution - 1) // output_stride + 1
+    yy, xx = np.mgrid[0:size, 0:size]
+
+    num_edges = len(posenet.PARENT_CHILD_TUPLES)
+    heatmaps = rng.uniform(0., 0.2, (num_images, posenet.NUM_KEYPOINTS, size, size))
+    offsets = rng.uniform(-1., 1., (num_images, 2, posenet.NUM_KEYPOINTS, size, size))
+    displacements_fwd = rng.normal(0., output_stride, (num_images, 2, num_edges, size, size))
+    displacements_bwd = rng.normal(0., output_stride, (num_images, 2, num_edges, size, size))
+
+    for n in range(num_images):
+        for _ in range(num_people):
+            center = rng.uniform(2, size - 3, 2)
+            keypoints = np.clip(center + rng.normal(0., 2., (posenet.NUM_KEYPOINTS, 2)), 0, size - 1)
+            for k, (y, x) in enumerate(keypoints):
+                peak = np.exp(-((yy - y) ** 2 + (xx - x) ** 2) / 2.) * rng.uniform(0.6, 1.)
+                heatmaps[n, k] = np.maximum(heatmaps[n, k], peak)
+
+            # point the displacement fields around each keypoint at its neighbours in the pose chain
+            for edge, (parent, child) in enumerate(posenet.PARENT_CHILD_TUPLES):
+                near_parent = (yy - keypoints[parent, 0]) ** 2 + (xx - keypoints[parent, 1]) ** 2 <= 2.
+                near_child = (yy - keypoints[child, 0]) ** 2 + (xx - keypoints[child, 1]) ** 2 <= 2.
+                # between the peak cells, so traversal lands on the child's heatmap maximum
+                step = (np.round(keypoints[child]) - np.round(keypoints[parent])) * output_stride
+                displacements_fwd[n, :, edge, near_parent] = step
+                displacements_bwd[n, :, edge, near_child] = -step
+
+    offsets = offsets.reshape(num_images, -1, size, size)
+    displacements_fwd = displacements_fwd.reshape(num_images, -1, size, size)
+    displacements_bwd = displacements_bwd.reshape(num_images, -1, size, size)
+
+    return tuple(torch.Tensor(x) for x in (heatmaps, offsets, displacements_fwd, displacements_bwd))
+
+
+def check_parity(expected, actual):
+    for name, e, a in zip(('pose_scores', 'keypoint_scores', 'keypoint_coords', 'pose_offsets'), expected, actual):
+        if not np.allclose(e, a, atol=1e-4):
+            raise AssertionError('%s differs, max abs diff %f' % (name, np.max(np.abs(e - a))))
+
+
+def crowd_candidates(num_people, rng, image_size=2000):
+    # every keypoint of every person ends up as a root candidate, and decoding it gives back a
+    # slightly jittered copy of that person's pose
+    num_keypoints = posenet.NUM_KEYPOINTS
+    poses = rng.uniform(0, image_size, (num_people, 1, 2)) + rng.normal(0., 40., (num_people, num_keypoints, 2))
+    keypoint_coords = np.repeat(poses, num_keypoints, axis=0) + rng.normal(
+        0., 2., (num_people * num_keypoints, num_keypoints, 2))
+    keypoint_scores = rng.uniform(0.5, 1., (num_people * num_keypoints, num_keypoints))
+    root_ids = np.tile(np.arange(num_keypoints), num_people)
+    order = rng.permutation(num_people * num_keypoints)
+    return root_ids[order], keypoint_scores[order], keypoint_coords[order]
+
+
+def greedy_nms(root_ids, all_keypoint_scores, all_keypoint_coords, max_pose_detections, spatial_index,
+               nms_radius=20, min_pose_score=0.25):
+    # the pose acceptance loop of decode_multiple_poses on already decoded candidates
+    squared_nms_radius = nms_radius ** 2
+    pose_index = posenet.decode_multi.PoseGridIndex(nms_radius, args.output_stride)
+    pose_count = 0
+    pose_keypoint_coords = np.zeros((max_pose_detections, posenet.NUM_KEYPOINTS, 2))
+    for root_id, keypoint_scores, keypoint_coords in zip(root_ids, all_keypoint_scores, all_keypoint_coords):
+        root_image_coords = keypoint_coords[root_id]
+        if spatial_index:
+            if pose_index.within_nms_radius(root_id, root_image_coords):
+                continue
+            pose_score = pose_index.get_instance_score(keypoint_scores, keypoint_coords)
+        else:
+            if posenet.decode_multi.within_nms_radius_fast(
+                    pose_keypoint_coords[:pose_count, root_id, :], squared_nms_radius, root_image_coords):
+                continue
+            pose_score = posenet.decode_multi.get_instance_score_fast(
+                pose_keypoint_coords[:pose_count, :, :], squared_nms_radius, keypoint_scores, keypoint_coords)
+
+        if pose_score >= min_pose_score:
+            pose_keypoint_coords[pose_count, :, :] = keypoint_coords
+            pose_count += 1
+            if spatial_index:
+                pose_index.add(keypoint_coords)
+
+        if pose_count >= max_pose_detections:
+            break
+    return pose_keypoint_coords[:pose_count]
+
+
+def crowd_scaling():
+    # brute force vs grid indexed NMS as the number of people in the frame grows
+    rng = np.random.default_rng(args.seed)
+    print('%8s %8s %16s %16s %8s' % ('people', 'poses', 'brute force ms', 'grid index ms', 'speedup'))
+    for num_people in (1, 5, 10, 25, 50, 100):
+        candidates = crowd_candidates(num_people, rng)
+
+        timings = []
+        results = []
+        for spatial_index in (False, True):
+            start = time.time()
+            for _ in range(args.repeats):
+                accepted = greedy_nms(*candidates, max_pose_detections=num_people, spatial_index=spatial_index)
+            timings.append(1000. * (time.time() - start) / args.repeats)
+            results.append(accepted)
+
+        if not np.array_equal(*results):
+            raise AssertionError('grid index accepted different poses for %d people' % num_people)
+        print('%8d %8d %16.2f %16.2f %7.1fx' % (
+            num_people, len(results[1]), timings[0], timings[1], timings[0] / timings[1]))
+
+
+def single_pose():
+    # decode_single_pose against the multi-pose decoder limited to one detection
+    output_stride = args.output_stride
+    outputs = synthetic_outputs(args.num_images, 1, args.resolution, output_stride, args.seed)
+
+    start = time.time()
+    for _ in range(args.repeats):
+        expected = [decode_multiple_poses(
+            *(x[i] for x in outputs), output_stride=output_stride, max_pose_detections=1, min_pose_score=0.)
+            for i in range(args.num_images)]
+    multi_time = time.time() - start
+
+    start = time.time()
+    for _ in range(args.repeats):
+        actual = [decode_single_pose(outputs[0][i], outputs[1][i], output_stride=output_stride, min_pose_score=0.)
+                  for i in range(args.num_images)]
+    single_time = time.time() - start
+
+    for e, a in zip(expected, actual):
+        # decode_pose never fills in the root keypoint's offset, compare the others only
+        root = e[3][0].any(axis=1)
+        e, a = e[:3] + (e[3][:, root],), a[:3] + (a[3][:, root],)
+        check_parity(e, a)
+
+    # a frame with nobody in it, the background noise scores far below the default min_pose_score
+    empty = synthetic_outputs(1, 0, args.resolution, output_stride, args.seed)
+    pose_scores, keypoint_scores, keypoint_coords, _ = decode_single_pose(empty[0][0], empty[1][0], output_stride)
+    if pose_scores[0] != 0. or keypoint_scores.any() or keypoint_coords.any():
+        raise AssertionError('decode_single_pose returned a pose for an empty frame')
+
+    num_decoded = args.num_images * args.repeats
+    print('decode_multiple_poses (max 1) : %.3f ms/image' % (1000. * multi_time / num_decoded))
+    print('decode_single_pose            : %.3f ms/image' % (1000. * single_time / num_decoded))
+    print('Speedup: %.1fx' % (multi_time / single_time))
+
+
+def main():
+    if args.crowd:
+        crowd_scaling()
+        return
+    if args.single_pose:
+        single_pose()
+        return
+
+    output_stride = args.output_stride
+    heatmaps, offsets, displacement_fwd, displacement_bwd = synthetic_outputs(
+        args.num_images, args.num_people, args.resolution, output_stride, args.seed)
+    decode_args = dict(output_stride=output_stride, max_pose_detections=10, min_pose_score=0.25)
+
+    with torch.no_grad():
+        start = time.time()
+        for _ in range(args.repeats):
+            expected = [decode_multiple_poses(
+                heatmaps[i], offsets[i], displacement_fwd[i], displacement_bwd[i], **decode_args)
+                for i in range(args.num_images)]
+        loop_time = time.time() - start
+
+        start = time.time()
+        for _ in range(args.repeats):
+            actual = decode_multiple_poses_batch(heatmaps, offsets, displacement_fwd, displacement_bwd, **decode_args)
+        batch_time = time.time() - start
+
+        # always timed on CPU as well, it is slower than the numpy decoder there
+        torch_times = {}
+        for device in dict.fromkeys(('cpu', args.device)):
+            device_outputs = [x.to(device) for x in (heatmaps, offsets, displacement_fwd, displacement_bwd)]
+            start = time.time()
+            for _ in range(args.repeats):
+                actual_torch = [decode_multiple_poses_torch(*(x[i] for x in device_outputs), **decode_args)
+                                for i in range(args.num_images)]
+            torch_times[device] = time.time() - start
+            for e, t in zip(expected, actual_torch):
+                check_parity(e, t)
+
+    for e, a in zip(expected, actual):
+        check_parity(e, a)
+    print('Parity check passed for %d images' % args.num_images)
+
+    num_decoded = args.num_images * args.repeats
+    print('decode_multiple_poses       : %.2f ms/image' % (1000. * loop_time / num_decoded))
+    print('decode_multiple_poses_batch : %.2f ms/image' % (1000. * batch_time / num_decoded))
+    for device, torch_time in torch_times.items():
+        print('decode_multiple_poses_torch : %.2f ms/image (%s), %.2fx the numpy decoder' % (
+            1000. * torch_time / num_decoded, device, loop_time / torch_time))
+    print('Batch speedup: %.1fx' % (loop_time / batch_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import time
+import argparse
+import numpy as np
+import torch
+from scipy.optimize import linear_sum_assignment
+
+from posenet.evaluation import PoseEvaluator, match_poses, average_precision, KEYPOINT_SIGMAS, DEFAULT_THRESHOLDS
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--num_images', type=int, default=20)
+parser.add_argument('--num_people', type=int, default=5)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+args = parser.parse_args()
+
+
+# The loop based metrics train.py computed per item before PoseEvaluator, kept here as the reference
+# (prints removed, behaviour unchanged)
+
+def reference_match_poses(preds, gts):
+    preds_cpu = preds.cpu().numpy()
+    gts_cpu = gts.cpu().numpy()
+
+    # Compute pairwise distance between all preds and gts
+    cost_matrix = np.zeros((len(preds_cpu), len(gts_cpu)))
+    for i, pred in enumerate(preds_cpu):
+        for j, gt in enumerate(gts_cpu):
+            cost_matrix[i, j] = np.linalg.norm(pred - gt)
+
+    # Use Hungarian Algorithm to find optimal match
+    row_ind, col_ind = linear_sum_assignment(cost_matrix)
+    return list(zip(row_ind, col_ind))
+
+
+def reference_oks(matched_pairs, preds, gts, sigmas, variances, image_size):
+    oks = 0
+    preds_cpu = preds.cpu().numpy().astype(np.float64)
+    gts_cpu = gts.cpu().numpy().astype(np.float64)
+
+    for i, j in matched_pairs:
+        d = np.linalg.norm(preds_cpu[i] - gts_cpu[j])
+        exp = np.exp(-d**2 / (2 * variances * (sigmas**2)))
+        oks += np.sum(exp / len(preds_cpu[i]))
+
+    # train.py overwrote the sum with the number of matched pairs
+    oks = len(matched_pairs) if len(matched_pairs) > 0 else 0
+    return oks
+
+
+def reference_normalize_keypoints(keypoints):
+    keypoints = keypoints.float()
+    mean = keypoints.mean(dim=0, keepdim=True)
+    std = keypoints.std(dim=0, keepdim=True)
+    return (keypoints - mean) / std
+
+
+def reference_precision(preds, gts, threshold=2):
+    num_true_positives = 0
+    num_false_positives = 0
+
+    for pred_idx, gt_idx in reference_match_poses(preds, gts):
+        pred_pose = reference_normalize_keypoints(preds[pred_idx]).cpu().numpy()
+        gt_pose = reference_normalize_keypoints(gts[gt_idx]).cpu().numpy()
+
+        for pred_keypoint, gt_keypoint in zip(pred_pose, gt_pose):
+            # Skip keypoints with values (0,0) or (-1,-1) in ground truth keypoints
+            if np.all(gt_keypoint == [0, 0]) or np.all(gt_keypoint == [-1, -1]):
+                if np.all(pred_keypoint != [0, 0]) and np.all(pred_keypoint != [-1, -1]):
+                    num_false_positives += 1
+                continue
+
+            if np.linalg.norm(pred_keypoint - gt_keypoint) <= threshold:
+                num_true_positives += 1
+            else:
+                num_false_positives += 1
+
+    # train.py returned 0 when there was no false positive
+    return num_true_positives / (num_true_positives + num_false_positives) if num_false_positives + num_false_positives > 0 else 0
+
+
+def reference_recall(preds, gts, threshold=2.0):
+    num_true_positives = 0
+    num_false_negatives = 0
+
+    for pred_index, gt_index in reference_match_poses(preds, gts):
+        pred_pose = reference_normalize_keypoints(preds[pred_index]).cpu().numpy()
+        gt_pose = reference_normalize_keypoints(gts[gt_index]).cpu().numpy()
+
+        for pred_keypoint, gt_keypoint in zip(pred_pose, gt_pose):
+            if (gt_keypoint == np.array([-1, -1])).all() or (gt_keypoint == np.array([0, 0])).all():
+                continue
+            elif (pred_keypoint == np.array([-1, -1])).all() or (pred_keypoint == np.array([0, 0])).all():
+                num_false_negatives += 1
+            elif np.linalg.norm(pred_keypoint - gt_keypoint) <= threshold:
+                num_true_positives += 1
+            else:
+                num_false_negatives += 1
+
+    return num_true_positives / (num_true_positives + num_false_negatives)
+
+
+def reference_mAP(precisions, recalls):
+    # Sort by recall
+    sorted_indices = np.argsort(recalls)
+    sorted_precisions = precisions[sorted_indices]
+    sorted_recalls = recalls[sorted_indices]
+
+    # Append sentinel values at the end
+    sorted_precisions = np.concatenate(([0], sorted_precisions, [0]))
+    sorted_recalls = np.concatenate(([0], sorted_recalls, [1]))
+
+    # Compute the precision envelope
+    for i in range(sorted_precisions.size - 1, 0, -1):
+        sorted_precisions[i - 1] = max(sorted_precisions[i - 1], sorted_precisions[i])
+
+    # Compute Average Precision (AP)
+    recall_change = np.diff(sorted_recalls)
+    precision_change = sorted_precisions[:-1]
+    return np.sum(recall_change * precision_change)
+
+
+def synthetic_keypoints(num_images, num_people, seed=0, missed=0.1, spurious=1):
+    # ground truths padded to 15 poses with -1, predictions jittered around them in shuffled order
+    # with a fraction of missed keypoints and a few spurious poses per image
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(num_images):
+        gts = np.full((15, 17, 2), -1.)
+        gts[:num_people] = rng.uniform(0, 513, (num_people, 1, 2)) + rng.normal(0, 40, (num_people, 17, 2))
+        preds = gts[:num_people] + rng.normal(0, 4, (num_people, 17, 2))
+        preds[rng.random((num_people, 17)) < missed] = 0
+        preds = np.concatenate([preds[rng.permutation(num_people)], rng.uniform(0, 513, (spurious, 17, 2))])
+        images.append((torch.tensor(preds), torch.tensor(gts)))
+    return images
+
+
+def old_path(preds, gts):
+    matched_pairs = reference_match_poses(preds, gts)
+    oks = reference_oks(matched_pairs, preds, gts, KEYPOINT_SIGMAS, KEYPOINT_SIGMAS ** 2, 513)
+    precisions, recalls = [], []
+    for threshold in DEFAULT_THRESHOLDS:
+        precisions.append(reference_precision(preds, gts, threshold))
+        recalls.append(reference_recall(preds, gts, threshold))
+    return np.array(precisions), np.array(recalls), reference_mAP(np.array(precisions), np.array(recalls)), oks
+
+
+def check_parity(images):
+    # same matching as the reference, once the padding poses are left out
+    for preds, gts in images:
+        old_pairs = reference_match_poses(preds, gts[:args.num_people])
+        pred_indices, gt_indices = match_poses(preds, gts[:args.num_people])
+        assert sorted(old_pairs) == sorted(zip(pred_indices.tolist(), gt_indices.tolist()))
+    rng = np.random.default_rng(args.seed)
+    for _ in range(100):
+        precisions, recalls = rng.random(50), rng.random(50)
+        assert np.isclose(reference_mAP(precisions.copy(), recalls.copy()), average_precision(precisions, recalls))
+
+    # The reference only agrees on precision / recall when every pose is matched and no keypoint is
+    # missing: it drops unmatched poses, tests missing keypoints after normalizing them (so never
+    # finds one) and returns a precision of 0 when there is no false positive.
+    compared = 0
+    for preds, gts in synthetic_keypoints(args.num_images, args.num_people, args.seed + 1, missed=0, spurious=0):
+        old_precision, old_recall, _, _ = old_path(preds, gts[:args.num_people])
+        new = PoseEvaluator(normalize=True).update(preds, gts)
+        assert np.allclose(old_recall, new["recall"])
+        has_false_positive = new["precision"] < 1
+        assert np.allclose(old_precision[has_false_positive], new["precision"][has_false_positive])
+        compared += has_false_positive.sum()
+    print("matching and mAP agree with the reference, precision / recall (normalize=True) agree on %d image thresholds "
+          "with every pose matched and no missing keypoint, OKS is not compared (the reference returns the number of matches)" % compared)
+
+
+def main():
+    images = synthetic_keypoints(args.num_images, args.num_people, args.seed)
+    check_parity(images)
+
+    start = time.perf_counter()
+    for preds, gts in images:
+        old_path(preds, gts[:args.num_people])
+    old_time = (time.perf_counter() - start) / len(images)
+
+    evaluator = PoseEvaluator()
+    images = [(preds.to(args.device), gts.to(args.device)) for preds, gts in images]
+    start = time.perf_counter()
+    for preds, gts in images:
+        evaluator.update(preds, gts)
+    new_time = (time.perf_counter() - start) / len(images)
+    result = evaluator.compute()
+
+    print("reference metrics, 50 thresholds: %8.2f ms per image" % (old_time * 1000))
+    print("PoseEvaluator (%s):             %8.2f ms per image, %.0fx faster" % (args.device, new_time * 1000, old_time / new_time))
+    print("dataset mAP %.3f, OKS %.3f, precision / recall at threshold %.2f: %.3f / %.3f" % (
+        result["mAP"], result["oks"], DEFAULT_THRESHOLDS[10], result["precision"][10], result["recall"][10]))
+
+
+if __name__ == "__main__":
+    main()
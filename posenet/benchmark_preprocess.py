@@ -0,0 +1,73 @@
+import time
+import argparse
+import tracemalloc
+import numpy as np
+import torch
+
+import posenet
+from posenet.utils import _process_input, InputPreprocessor
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--width', type=int, default=1280)
+parser.add_argument('--height', type=int, default=720)
+parser.add_argument('--scale_factor', type=float, default=0.7125)
+parser.add_argument('--output_stride', type=int, default=16)
+parser.add_argument('--num_frames', type=int, default=200)
+parser.add_argument('--seed', type=int, default=0)
+args = parser.parse_args()
+
+
+def old_path(frame):
+    # what every demo did per frame before, including the copy into a tensor
+    input_image, _, scale = _process_input(frame, args.scale_factor, args.output_stride)
+    return torch.Tensor(input_image)
+
+
+def new_path(frame, preprocessor):
+    input_image, _, scale = preprocessor(frame)
+    return torch.as_tensor(input_image)
+
+
+def measure(frames, fn):
+    fn(frames[0])
+
+    tracemalloc.start()
+    peaks = []
+    for frame in frames:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        fn(frame)
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+
+    start = time.time()
+    for frame in frames:
+        fn(frame)
+    elapsed = time.time() - start
+    return 1000. * elapsed / len(frames), np.mean(peaks)
+
+
+def main():
+    rng = np.random.default_rng(args.seed)
+    frames = [rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8) for _ in range(args.num_frames)]
+    preprocessor = InputPreprocessor(args.scale_factor, args.output_stride)
+
+    expected = old_path(frames[0])
+    actual = new_path(frames[0], preprocessor)
+    if not torch.equal(expected, actual):
+        raise AssertionError('preprocessor output differs, max abs diff %f' % (expected - actual).abs().max())
+    print('Parity check passed, input %s' % (tuple(actual.shape),))
+
+    # peak bytes allocated while processing one frame, in units of one float32 input image. tracemalloc
+    # only sees numpy and cv2 buffers, the torch.Tensor copy of the old path is not counted
+    input_bytes = actual.numel() * 4
+    old_ms, old_bytes = measure(frames, old_path)
+    new_ms, new_bytes = measure(frames, lambda frame: new_path(frame, preprocessor))
+    print('%-16s %10s %22s' % ('', 'ms/frame', 'allocated/frame'))
+    print('%-16s %10.3f %12d (%.1f inputs)' % ('_process_input', old_ms, old_bytes, old_bytes / input_bytes))
+    print('%-16s %10.3f %12d (%.1f inputs)' % ('preprocessor', new_ms, new_bytes, new_bytes / input_bytes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import os
+import numpy as np
+import torch
+
+from posenet.models.mobilenet_v1 import MOBILENET_V1_CHECKPOINTS
+
+EXPORT_FORMATS = {
+    'torchscript': '.pt',
+    'onnx': '.onnx',
+}
+INPUT_NAME = 'image'
+OUTPUT_NAMES = ['heatmaps', 'offsets', 'displacement_fwd', 'displacement_bwd']
+
+
+def export_path(model_id, model_dir, export_format, output_stride=16, image_size=513):
+    checkpoint_name = MOBILENET_V1_CHECKPOINTS[model_id]
+    return os.path.join(
+        model_dir, '%s_os%d_%d%s' % (checkpoint_name, output_stride, image_size, EXPORT_FORMATS[export_format]))
+
+
+def export_torchscript(model, path):
+    scripted = torch.jit.script(model)
+    torch.jit.save(scripted, path)
+
+
+def export_onnx(model, path, image_size=513):
+    # the batch and the spatial size are left dynamic so one graph serves every batch size
+    # and every scale_factor the demos pick
+    dynamic_axes = {name: {0: 'batch', 2: 'height', 3: 'width'} for name in [INPUT_NAME] + OUTPUT_NAMES}
+    torch.onnx.export(
+        model, (torch.zeros(1, 3, image_size, image_size),), path,
+        input_names=[INPUT_NAME], output_names=OUTPUT_NAMES, dynamic_axes=dynamic_axes,
+        opset_version=17, dynamo=False)
+
+
+def check_parity(model, paths, image_size=513, batch_size=2, atol=1e-4):
+    # run a batch larger than the one used for tracing to make sure the batch axis really is dynamic
+    from posenet.models.backends import load_exported
+
+    input_image = torch.rand(batch_size, 3, image_size, image_size) * 2. - 1.
+    with torch.no_grad():
+        expected = [x.numpy() for x in model(input_image)]
+
+    for export_format, path in paths.items():
+        backend = load_exported(path, export_format, model.output_stride)
+        with torch.no_grad():
+            actual = [x.cpu().numpy() for x in backend(input_image)]
+        for name, e, a in zip(OUTPUT_NAMES, expected, actual):
+            if e.shape != a.shape:
+                raise AssertionError('%s %s shape %s, expected %s' % (export_format, name, a.shape, e.shape))
+            diff = np.max(np.abs(e - a))
+            if diff > atol:
+                raise AssertionError('%s %s differs from the eager model, max abs diff %f' % (export_format, name, diff))
+        print('%s parity check passed (batch %d, %dx%d)' % (export_format, batch_size, image_size, image_size))
+
+
+def export(model_id, model_dir, output_stride=16, image_size=513, formats=tuple(EXPORT_FORMATS), check=True):
+    from posenet.models.model_factory import load_model
+
+    model = load_model(model_id, output_stride=output_stride, model_dir=model_dir)
+    model.eval()
+
+    paths = {}
+    for export_format in formats:
+        path = export_path(model_id, model_dir, export_format, output_stride, image_size)
+        if export_format == 'torchscript':
+            export_torchscript(model, path)
+        elif export_format == 'onnx':
+            export_onnx(model, path, image_size)
+        else:
+            raise ValueError('Unknown export format %s, expected one of %s' % (export_format, list(EXPORT_FORMATS)))
+        print('Exported %s' % path)
+        paths[export_format] = path
+
+    if check:
+        check_parity(model, paths, image_size)
+
+    return paths
+
+
+def main():
+    from posenet.models.model_factory import MODEL_DIR
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', type=int, default=101)
+    parser.add_argument('--model_dir', type=str, default=MODEL_DIR)
+    parser.add_argument('--output_stride', type=int, default=16)
+    parser.add_argument('--image_size', type=int, default=513)
+    parser.add_argument('--formats', type=str, nargs='+', default=list(EXPORT_FORMATS))
+    parser.add_argument('--no_check', action='store_true')
+    args = parser.parse_args()
+
+    export(args.model, args.model_dir, args.output_stride, args.image_size, args.formats, check=not args.no_check)
+
+
+if __name__ == "__main__":
+    main()
@@ -69,19 +69,12 @@ def build_part_with_score_torch_single_pose(score_threshold, local_max_radius, s
     max_vals = F.max_pool2d(scores, lmd, stride=1, padding=1)
 
     max_loc = (scores == max_vals) & (scores >= score_threshold)
-    max_loc_idx = max_loc.nonzero()
-
-    # Initialize arrays to hold the highest score and corresponding index for each keypoint
-    highest_scores = torch.zeros(num_keypoints)
-    highest_score_indices = torch.zeros((num_keypoints, 2), dtype=torch.long)
-
-    # Iterate through max_loc_idx and update highest_scores and highest_score_indices
-    for idx in max_loc_idx:
-        keypoint_idx, y, x = idx
-        score = scores[keypoint_idx, y, x]
-        if score > highest_scores[keypoint_idx]:
-            highest_scores[keypoint_idx] = score
-            highest_score_indices[keypoint_idx] = torch.tensor([y, x])
+
+    # Keep only the local maxima and take the best one per keypoint in a single argmax
+    height, width = scores.shape[1], scores.shape[2]
+    masked_scores = torch.where(max_loc, scores, torch.zeros_like(scores)).view(num_keypoints, -1)
+    highest_scores, flat_indices = masked_scores.max(dim=1)
+    highest_score_indices = torch.stack((flat_indices // width, flat_indices % width), dim=1)
                                       
     return highest_scores, highest_score_indices
 
@@ -180,3 +173,31 @@ def decode_pose(
     
 
     return instance_keypoint_scores, instance_keypoint_coords, instance_offsets
+
+
+def decode_single_pose(scores, offsets, output_stride, min_pose_score=0.5):
+    """
+    Fast path for frames with a single person: takes the per-keypoint argmax of the flattened heatmap
+    and refines it with the offsets, no part extraction, chain traversal or NMS.
+
+    Returns the same (pose_scores, keypoint_scores, keypoint_coords, pose_offsets) arrays as
+    decode_multi.decode_multiple_poses with max_pose_detections=1, all zeros when the pose score is
+    below min_pose_score (set it to 0. to always return the pose).
+    """
+    num_parts, height, width = scores.shape
+    keypoint_scores, flat_indices = scores.view(num_parts, -1).max(dim=1)
+    keypoint_indices = torch.stack((flat_indices // width, flat_indices % width), dim=1)
+
+    parts = torch.arange(num_parts, device=scores.device)
+    keypoint_offsets = offsets.view(2, num_parts, height, width)[
+        :, parts, keypoint_indices[:, 0], keypoint_indices[:, 1]].t()
+    keypoint_coords = keypoint_indices * output_stride + keypoint_offsets
+    pose_score = keypoint_scores.mean()
+
+    if min_pose_score != 0. and pose_score.item() < min_pose_score:
+        return np.zeros(1), np.zeros((1, num_parts)), np.zeros((1, num_parts, 2)), np.zeros((1, num_parts, 2))
+
+    return (pose_score.view(1).double().cpu().numpy(),
+            keypoint_scores.view(1, num_parts).double().cpu().numpy(),
+            keypoint_coords.view(1, num_parts, 2).double().cpu().numpy(),
+            keypoint_offsets.view(1, num_parts, 2).double().cpu().numpy())
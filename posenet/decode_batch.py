@@ -0,0 +1,192 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from posenet.constants import *
+from posenet.decode_multi import PoseGridIndex, SPATIAL_INDEX_MIN_POSES, within_nms_radius_fast, get_instance_score_fast
+
+
+def build_part_with_score_batch(score_threshold, local_max_radius, scores):
+    # scores is the full (N, 17, H, W) heatmap batch, parts come back as (image, keypoint, y, x)
+    lmd = 2 * local_max_radius + 1
+    max_vals = F.max_pool2d(scores, lmd, stride=1, padding=local_max_radius)
+    max_loc = (scores == max_vals) & (scores >= score_threshold)
+    max_loc_idx = max_loc.nonzero()
+    scores_vec = scores[max_loc]
+    return scores_vec, max_loc_idx
+
+
+def traverse_to_targ_keypoints(
+        edge_id, source_keypoints, target_keypoint_id, image_ids, scores, offsets, output_stride, displacements
+):
+    # same as decode.traverse_to_targ_keypoint but for a whole vector of poses at once,
+    # image_ids selects the batch item each source keypoint belongs to
+    height = scores.shape[2]
+    width = scores.shape[3]
+    max_indices = [height - 1, width - 1]
+
+    source_keypoint_indices = np.clip(
+        np.round(source_keypoints / output_stride), a_min=0, a_max=max_indices).astype(np.int32)
+
+    displacement_vectors = displacements[
+        image_ids, edge_id, source_keypoint_indices[:, 0], source_keypoint_indices[:, 1]]
+    displaced_points = source_keypoints + displacement_vectors
+
+    displaced_point_indices = np.clip(
+        np.round(displaced_points / output_stride), a_min=0, a_max=max_indices).astype(np.int32)
+
+    score = scores[image_ids, target_keypoint_id, displaced_point_indices[:, 0], displaced_point_indices[:, 1]]
+    offset = offsets[image_ids, target_keypoint_id, displaced_point_indices[:, 0], displaced_point_indices[:, 1]]
+    image_coords = displaced_point_indices * output_stride + offset
+
+    return score, image_coords, displacement_vectors, offset
+
+
+def decode_poses_batch(
+        root_scores, root_ids, root_image_coords, image_ids,
+        scores,
+        offsets,
+        output_stride,
+        displacements_fwd,
+        displacements_bwd
+):
+    # decode every root candidate at once, walking the pose chain one edge at a time
+    num_roots = root_scores.shape[0]
+    num_parts = scores.shape[1]
+    num_edges = len(PARENT_CHILD_TUPLES)
+    roots = np.arange(num_roots)
+
+    instance_keypoint_scores = np.zeros((num_roots, num_parts))
+    instance_keypoint_coords = np.zeros((num_roots, num_parts, 2))
+    instance_keypoint_scores[roots, root_ids] = root_scores
+    instance_keypoint_coords[roots, root_ids] = root_image_coords
+
+    instance_offsets = np.zeros((num_roots, num_parts, 2))
+
+    for edge in reversed(range(num_edges)):
+        target_keypoint_id, source_keypoint_id = PARENT_CHILD_TUPLES[edge]
+        active = ((instance_keypoint_scores[:, source_keypoint_id] > 0.0) &
+                  (instance_keypoint_scores[:, target_keypoint_id] == 0.0))
+        if not active.any():
+            continue
+        score, coords, _, offset = traverse_to_targ_keypoints(
+            edge,
+            instance_keypoint_coords[active, source_keypoint_id],
+            target_keypoint_id,
+            image_ids[active],
+            scores, offsets, output_stride, displacements_bwd)
+        instance_keypoint_scores[active, target_keypoint_id] = score
+        instance_keypoint_coords[active, target_keypoint_id] = coords
+        instance_offsets[active, target_keypoint_id] = offset
+
+    for edge in range(num_edges):
+        source_keypoint_id, target_keypoint_id = PARENT_CHILD_TUPLES[edge]
+        active = ((instance_keypoint_scores[:, source_keypoint_id] > 0.0) &
+                  (instance_keypoint_scores[:, target_keypoint_id] == 0.0))
+        if not active.any():
+            continue
+        score, coords, _, offset = traverse_to_targ_keypoints(
+            edge,
+            instance_keypoint_coords[active, source_keypoint_id],
+            target_keypoint_id,
+            image_ids[active],
+            scores, offsets, output_stride, displacements_fwd)
+        instance_keypoint_scores[active, target_keypoint_id] = score
+        instance_keypoint_coords[active, target_keypoint_id] = coords
+        instance_offsets[active, target_keypoint_id] = offset
+
+    return instance_keypoint_scores, instance_keypoint_coords, instance_offsets
+
+
+def decode_multiple_poses_batch(
+        scores, offsets, displacements_fwd, displacements_bwd, output_stride,
+        max_pose_detections=10, score_threshold=0.5, nms_radius=20, min_pose_score=0.5, spatial_index=None):
+    """
+    Batched version of decode_multi.decode_multiple_poses.
+
+    Takes the raw (N, C, H, W) model outputs for a whole batch, decodes every root candidate of
+    every image with array ops and then runs the usual greedy NMS per image.
+
+    Returns:
+        A list with one (pose_scores, keypoint_scores, keypoint_coords, pose_offsets) tuple per image,
+        identical to what decode_multiple_poses returns for that image.
+    """
+    num_images = scores.shape[0]
+    height = scores.shape[2]
+    width = scores.shape[3]
+
+    part_scores, part_idx = build_part_with_score_batch(score_threshold, LOCAL_MAXIMUM_RADIUS, scores)
+    part_scores = part_scores.cpu().numpy()
+    part_idx = part_idx.cpu().numpy()
+
+    # group candidates by image, highest part score first
+    order = np.lexsort((-part_scores, part_idx[:, 0]))
+    part_scores = part_scores[order]
+    part_idx = part_idx[order]
+
+    scores = scores.cpu().numpy()
+    overall_offsets = offsets.cpu().numpy().reshape(num_images, 2, -1, height, width).transpose((0, 2, 3, 4, 1))
+    displacements_fwd = displacements_fwd.cpu().numpy().reshape(
+        num_images, 2, -1, height, width).transpose((0, 2, 3, 4, 1))
+    displacements_bwd = displacements_bwd.cpu().numpy().reshape(
+        num_images, 2, -1, height, width).transpose((0, 2, 3, 4, 1))
+
+    image_ids = part_idx[:, 0]
+    root_ids = part_idx[:, 1]
+    root_coords = part_idx[:, 2:]
+    root_image_coords = root_coords * output_stride + overall_offsets[
+        image_ids, root_ids, root_coords[:, 0], root_coords[:, 1]]
+
+    all_keypoint_scores, all_keypoint_coords, all_offsets = decode_poses_batch(
+        part_scores, root_ids, root_image_coords, image_ids,
+        scores, overall_offsets, output_stride,
+        displacements_fwd, displacements_bwd)
+
+    image_starts = np.searchsorted(image_ids, np.arange(num_images + 1))
+
+    # same switch as decode_multiple_poses, the grid index is slower than brute force for a few poses
+    squared_nms_radius = nms_radius ** 2
+    if spatial_index is None:
+        spatial_index = max_pose_detections >= SPATIAL_INDEX_MIN_POSES
+
+    results = []
+    for image_id in range(num_images):
+        pose_index = PoseGridIndex(nms_radius, output_stride) if spatial_index else None
+        pose_count = 0
+        pose_scores = np.zeros(max_pose_detections)
+        pose_keypoint_scores = np.zeros((max_pose_detections, NUM_KEYPOINTS))
+        pose_keypoint_coords = np.zeros((max_pose_detections, NUM_KEYPOINTS, 2))
+        pose_offsets = np.zeros((max_pose_detections, NUM_KEYPOINTS, 2))
+
+        for candidate in range(image_starts[image_id], image_starts[image_id + 1]):
+            root_id = root_ids[candidate]
+            if spatial_index:
+                if pose_index.within_nms_radius(root_id, root_image_coords[candidate]):
+                    continue
+            elif within_nms_radius_fast(
+                    pose_keypoint_coords[:pose_count, root_id, :], squared_nms_radius, root_image_coords[candidate]):
+                continue
+
+            keypoint_scores = all_keypoint_scores[candidate]
+            keypoint_coords = all_keypoint_coords[candidate]
+            if spatial_index:
+                pose_score = pose_index.get_instance_score(keypoint_scores, keypoint_coords)
+            else:
+                pose_score = get_instance_score_fast(
+                    pose_keypoint_coords[:pose_count, :, :], squared_nms_radius, keypoint_scores, keypoint_coords)
+
+            if min_pose_score == 0. or pose_score >= min_pose_score:
+                pose_scores[pose_count] = pose_score
+                pose_keypoint_scores[pose_count, :] = keypoint_scores
+                pose_keypoint_coords[pose_count, :, :] = keypoint_coords
+                pose_offsets[pose_count, :, :] = all_offsets[candidate]
+                pose_count += 1
+                if spatial_index:
+                    pose_index.add(keypoint_coords)
+
+            if pose_count >= max_pose_detections:
+                break
+
+        results.append((pose_scores, pose_keypoint_scores, pose_keypoint_coords, pose_offsets))
+
+    return results
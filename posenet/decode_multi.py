@@ -4,6 +4,10 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+# The grid index only pays off for crowds. In benchmark_decode.py --crowd it runs at 0.7x of the
+# brute force NMS for 1 person, 1.0-1.1x for 5-10 (the default max_pose_detections), 1.2x for 25,
+# 1.5x for 50 and 2.0x for 100 people, so it is used from this many pose slots on.
+SPATIAL_INDEX_MIN_POSES = 25
 
 def within_nms_radius_fast(pose_coords, squared_nms_radius, point):
     if not pose_coords.shape[0]:
@@ -24,6 +28,57 @@ def get_instance_score_fast(
     return not_overlapped_scores / len(keypoint_scores)
 
 
+class PoseGridIndex(object):
+    """
+    Spatial hash of the keypoints of already accepted poses, bucketed per keypoint id into cells
+    aligned to the output stride. Cells are at least twice the NMS radius wide, so the disc around
+    a query point touches at most 2x2 cells and root rejection / instance scoring only compare
+    against poses that are actually nearby instead of every accepted pose.
+
+    The lookups are Python loops, so for a few poses the numpy brute force is as fast or faster,
+    see SPATIAL_INDEX_MIN_POSES for the measured crossover.
+    """
+
+    def __init__(self, nms_radius, output_stride):
+        self.nms_radius = nms_radius
+        self.squared_nms_radius = nms_radius ** 2
+        self.cell_size = output_stride * max(1, int(np.ceil(2. * nms_radius / output_stride)))
+        self.cells = {}
+
+    def add(self, keypoint_coords):
+        for keypoint_id, (y, x) in enumerate(keypoint_coords.tolist()):
+            cell = (keypoint_id, int(y // self.cell_size), int(x // self.cell_size))
+            self.cells.setdefault(cell, []).append((y, x))
+
+    def _overlaps(self, keypoint_id, y, x, cell_y, cell_x):
+        # (cell_y, cell_x) is the top left cell of the 2x2 block covering the disc around (y, x)
+        for cell in ((keypoint_id, cell_y, cell_x), (keypoint_id, cell_y, cell_x + 1),
+                     (keypoint_id, cell_y + 1, cell_x), (keypoint_id, cell_y + 1, cell_x + 1)):
+            for pose_y, pose_x in self.cells.get(cell, ()):
+                if (pose_y - y) ** 2 + (pose_x - x) ** 2 <= self.squared_nms_radius:
+                    return True
+        return False
+
+    def within_nms_radius(self, keypoint_id, point):
+        if not self.cells:
+            return False
+        y, x = float(point[0]), float(point[1])
+        return self._overlaps(
+            int(keypoint_id), y, x,
+            int((y - self.nms_radius) // self.cell_size), int((x - self.nms_radius) // self.cell_size))
+
+    def get_instance_score(self, keypoint_scores, keypoint_coords):
+        if not self.cells:
+            return np.sum(keypoint_scores) / len(keypoint_scores)
+        top_left_cells = np.floor_divide(keypoint_coords - self.nms_radius, self.cell_size).astype(np.int64)
+        not_overlapped_scores = 0.
+        for keypoint_id, (score, (y, x), (cell_y, cell_x)) in enumerate(
+                zip(keypoint_scores.tolist(), keypoint_coords.tolist(), top_left_cells.tolist())):
+            if not self._overlaps(keypoint_id, y, x, cell_y, cell_x):
+                not_overlapped_scores += score
+        return not_overlapped_scores / len(keypoint_scores)
+
+
 def build_part_with_score_torch(score_threshold, local_max_radius, scores):
     lmd = 2 * local_max_radius + 1
     max_vals = F.max_pool2d(scores, lmd, stride=1, padding=1)
@@ -34,6 +89,72 @@ def build_part_with_score_torch(score_threshold, local_max_radius, scores):
     return scores_vec[sort_idx], max_loc_idx[sort_idx]
 
 
+def traverse_to_targ_keypoints_torch(
+        edge_id, source_keypoints, target_keypoint_id, scores, offsets, output_stride, displacements, max_indices):
+    # torch counterpart of decode.traverse_to_targ_keypoint for a (K, 2) batch of source keypoints,
+    # offsets and displacements stay in their (2, C, H, W) layout so no transposed copy is made
+    source_keypoint_indices = torch.minimum(
+        torch.round(source_keypoints / output_stride).clamp(min=0), max_indices).long()
+
+    displacement_vectors = displacements[:, edge_id, source_keypoint_indices[:, 0], source_keypoint_indices[:, 1]].t()
+    displaced_points = source_keypoints + displacement_vectors
+
+    displaced_point_indices = torch.minimum(
+        torch.round(displaced_points / output_stride).clamp(min=0), max_indices).long()
+
+    score = scores[target_keypoint_id, displaced_point_indices[:, 0], displaced_point_indices[:, 1]]
+    offset = offsets[:, target_keypoint_id, displaced_point_indices[:, 0], displaced_point_indices[:, 1]].t()
+    image_coords = displaced_point_indices * output_stride + offset
+
+    return score, image_coords, displacement_vectors, offset
+
+
+def decode_poses_torch(
+        root_scores, root_ids, root_image_coords,
+        scores,
+        offsets,
+        output_stride,
+        displacements_fwd,
+        displacements_bwd
+):
+    # decode all root candidates at once, keypoints that are not reached on an edge keep their value
+    # through torch.where so the whole traversal runs without a host sync
+    num_roots = root_scores.shape[0]
+    num_parts = scores.shape[0]
+    num_edges = len(PARENT_CHILD_TUPLES)
+    roots = torch.arange(num_roots, device=scores.device)
+    max_indices = torch.tensor([scores.shape[1] - 1, scores.shape[2] - 1], device=scores.device)
+
+    instance_keypoint_scores = torch.zeros((num_roots, num_parts), device=scores.device)
+    instance_keypoint_coords = torch.zeros((num_roots, num_parts, 2), device=scores.device)
+    instance_keypoint_scores[roots, root_ids] = root_scores
+    instance_keypoint_coords[roots, root_ids] = root_image_coords
+
+    instance_offsets = torch.zeros((num_roots, num_parts, 2), device=scores.device)
+
+    edges = [(edge, PARENT_CHILD_TUPLES[edge][1], PARENT_CHILD_TUPLES[edge][0], displacements_bwd)
+             for edge in reversed(range(num_edges))]
+    edges += [(edge, PARENT_CHILD_TUPLES[edge][0], PARENT_CHILD_TUPLES[edge][1], displacements_fwd)
+              for edge in range(num_edges)]
+
+    for edge, source_keypoint_id, target_keypoint_id, displacements in edges:
+        active = ((instance_keypoint_scores[:, source_keypoint_id] > 0.0) &
+                  (instance_keypoint_scores[:, target_keypoint_id] == 0.0))
+        score, coords, _, offset = traverse_to_targ_keypoints_torch(
+            edge,
+            instance_keypoint_coords[:, source_keypoint_id],
+            target_keypoint_id,
+            scores, offsets, output_stride, displacements, max_indices)
+        instance_keypoint_scores[:, target_keypoint_id] = torch.where(
+            active, score, instance_keypoint_scores[:, target_keypoint_id])
+        instance_keypoint_coords[:, target_keypoint_id] = torch.where(
+            active[:, None], coords, instance_keypoint_coords[:, target_keypoint_id])
+        instance_offsets[:, target_keypoint_id] = torch.where(
+            active[:, None], offset, instance_offsets[:, target_keypoint_id])
+
+    return instance_keypoint_scores, instance_keypoint_coords, instance_offsets
+
+
 # FIXME leaving here as reference for now
 # def build_part_with_score_fast(score_threshold, local_max_radius, scores):
 #     parts = []
@@ -60,7 +181,8 @@ def build_part_with_score_torch(score_threshold, local_max_radius, scores):
 
 def decode_multiple_poses(
         scores, offsets, displacements_fwd, displacements_bwd, output_stride,
-        max_pose_detections=10, score_threshold=0.5, nms_radius=20, min_pose_score=0.5):
+        max_pose_detections=10, score_threshold=0.5, nms_radius=20, min_pose_score=0.5, spatial_index=None):
+    # spatial_index: None picks the grid index only when max_pose_detections >= SPATIAL_INDEX_MIN_POSES
 
     # print("---inside decode multi pose ---")
     
@@ -90,6 +212,9 @@ def decode_multiple_poses(
     displacements_bwd = displacements_bwd.cpu().numpy().reshape(2, -1, height, width).transpose((1, 2, 3, 0))
 
     squared_nms_radius = nms_radius ** 2
+    if spatial_index is None:
+        spatial_index = max_pose_detections >= SPATIAL_INDEX_MIN_POSES
+    pose_index = PoseGridIndex(nms_radius, output_stride) if spatial_index else None
     pose_count = 0
     pose_scores = np.zeros(max_pose_detections)
     pose_keypoint_scores = np.zeros((max_pose_detections, NUM_KEYPOINTS))
@@ -108,7 +233,10 @@ def decode_multiple_poses(
 
         root_image_coords = root_coord * output_stride + overall_offsets[root_id, root_coord_y, root_coord_x]
 
-        if within_nms_radius_fast(
+        if spatial_index:
+            if pose_index.within_nms_radius(root_id, root_image_coords):
+                continue
+        elif within_nms_radius_fast(
                 pose_keypoint_coords[:pose_count, root_id, :], squared_nms_radius, root_image_coords):
             continue
 
@@ -118,8 +246,11 @@ def decode_multiple_poses(
             displacements_fwd, displacements_bwd)
         
         
-        pose_score = get_instance_score_fast(
-            pose_keypoint_coords[:pose_count, :, :], squared_nms_radius, keypoint_scores, keypoint_coords)
+        if spatial_index:
+            pose_score = pose_index.get_instance_score(keypoint_scores, keypoint_coords)
+        else:
+            pose_score = get_instance_score_fast(
+                pose_keypoint_coords[:pose_count, :, :], squared_nms_radius, keypoint_scores, keypoint_coords)
 
         # NOTE this isn't in the original implementation, but it appears that by initially ordering by
         # part scores, and having a max # of detections, we can end up populating the returned poses with
@@ -132,6 +263,8 @@ def decode_multiple_poses(
             pose_offsets[pose_count, :, :] = offsets
             # print("offsets: ", offsets)
             pose_count += 1
+            if spatial_index:
+                pose_index.add(keypoint_coords)
             
         
 
@@ -146,3 +279,88 @@ def decode_multiple_poses(
         # print("pose_count: ", pose_count)
 
     return pose_scores, pose_keypoint_scores, pose_keypoint_coords, pose_offsets
+
+
+def decode_multiple_poses_torch(
+        scores, offsets, displacements_fwd, displacements_bwd, output_stride,
+        max_pose_detections=10, score_threshold=0.5, nms_radius=20, min_pose_score=0.5, chunk_size=32):
+    """
+    Same as decode_multiple_poses, but part extraction, traversal and the NMS distance tests run as
+    torch ops on the device of the model outputs.
+
+    The NMS goes through the root candidates `chunk_size` at a time: the distances of a chunk to the
+    accepted poses and to each other are computed at once, then the greedy acceptance within the chunk
+    runs on one host copy of those tests. Decoding stops at the first chunk that fills the last slot.
+    """
+    height = scores.shape[1]
+    width = scores.shape[2]
+
+    part_scores, part_idx = build_part_with_score_torch(score_threshold, LOCAL_MAXIMUM_RADIUS, scores)
+
+    # (2, C, H, W) views of the raw outputs, indexed directly instead of transposing
+    offsets = offsets.view(2, -1, height, width)
+    displacements_fwd = displacements_fwd.view(2, -1, height, width)
+    displacements_bwd = displacements_bwd.view(2, -1, height, width)
+
+    root_ids = part_idx[:, 0]
+    root_coords = part_idx[:, 1:]
+    root_image_coords = root_coords * output_stride + offsets[:, root_ids, root_coords[:, 0], root_coords[:, 1]].t()
+
+    all_keypoint_scores, all_keypoint_coords, all_offsets = decode_poses_torch(
+        part_scores, root_ids, root_image_coords,
+        scores, offsets, output_stride,
+        displacements_fwd, displacements_bwd)
+
+    squared_nms_radius = nms_radius ** 2
+    accepted = []
+    accepted_scores = []
+    accepted_coords = all_keypoint_coords[:0]
+
+    for start in range(0, part_scores.shape[0], chunk_size):
+        keypoint_coords = all_keypoint_coords[start:start + chunk_size]
+        chunk_root_ids = root_ids[start:start + chunk_size]
+        chunk_roots = root_image_coords[start:start + chunk_size]
+
+        # against the poses accepted in earlier chunks: (C,) root rejections and (C, K) overlapping keypoints
+        root_blocked = torch.any(torch.sum(
+            (accepted_coords[:, chunk_root_ids] - chunk_roots) ** 2, dim=2) <= squared_nms_radius, dim=0)
+        overlapped = torch.any(torch.sum(
+            (accepted_coords[:, None] - keypoint_coords) ** 2, dim=3) <= squared_nms_radius, dim=0)
+        # within the chunk, [i, j] is candidate j tested against an accepted candidate i
+        chunk_root_blocked = torch.sum(
+            (keypoint_coords[:, chunk_root_ids] - chunk_roots) ** 2, dim=2) <= squared_nms_radius
+        chunk_overlapped = torch.sum(
+            (keypoint_coords[:, None] - keypoint_coords) ** 2, dim=3) <= squared_nms_radius
+
+        root_blocked, overlapped, chunk_root_blocked, chunk_overlapped, keypoint_scores = (
+            x.cpu().numpy() for x in (root_blocked, overlapped, chunk_root_blocked, chunk_overlapped,
+                                      all_keypoint_scores[start:start + chunk_size]))
+        chunk_accepted = []
+        for candidate in range(len(keypoint_scores)):
+            if root_blocked[candidate] or chunk_root_blocked[chunk_accepted, candidate].any():
+                continue
+            not_overlapped = ~(overlapped[candidate] | chunk_overlapped[chunk_accepted, candidate].any(axis=0))
+            pose_score = np.sum(keypoint_scores[candidate] * not_overlapped) / NUM_KEYPOINTS
+            if min_pose_score == 0. or pose_score >= min_pose_score:
+                chunk_accepted.append(candidate)
+                accepted_scores.append(pose_score)
+                if len(accepted) + len(chunk_accepted) >= max_pose_detections:
+                    break
+
+        accepted += [start + candidate for candidate in chunk_accepted]
+        if len(accepted) >= max_pose_detections:
+            break
+        accepted_coords = all_keypoint_coords[accepted]
+
+    pose_scores = np.zeros(max_pose_detections)
+    pose_keypoint_scores = np.zeros((max_pose_detections, NUM_KEYPOINTS))
+    pose_keypoint_coords = np.zeros((max_pose_detections, NUM_KEYPOINTS, 2))
+    pose_offsets = np.zeros((max_pose_detections, NUM_KEYPOINTS, 2))
+    if accepted:
+        accepted = torch.as_tensor(accepted, device=scores.device)
+        pose_scores[:len(accepted)] = accepted_scores
+        pose_keypoint_scores[:len(accepted)] = all_keypoint_scores[accepted].double().cpu().numpy()
+        pose_keypoint_coords[:len(accepted)] = all_keypoint_coords[accepted].double().cpu().numpy()
+        pose_offsets[:len(accepted)] = all_offsets[accepted].double().cpu().numpy()
+
+    return pose_scores, pose_keypoint_scores, pose_keypoint_coords, pose_offsets
@@ -0,0 +1,201 @@
+"""
+Keypoint evaluation for training: poses are matched once per image, then OKS and the precision /
+recall at every distance threshold all come from the same matched keypoint distances.
+
+Works on CPU or GPU tensors, only the (P, G) cost matrix goes to the host for the Hungarian matching.
+"""
+import numpy as np
+import torch
+from scipy.optimize import linear_sum_assignment
+
+# Per keypoint sigmas as the old train.py metrics used them, the COCO keypoint sigmas times 10
+KEYPOINT_SIGMAS = np.array([.26, .25, .25, .35, .35, .79, .79, .72, .72, .62, .62, 1.07, 1.07, .87, .87, .89, .89])
+DEFAULT_THRESHOLDS = np.linspace(0.0, 10.0, num=50)
+
+
+def missing_keypoints(keypoints):
+    # (0, 0) and (-1, -1) mark keypoints that are not annotated or not detected
+    return ((keypoints == 0) | (keypoints == -1)).all(dim=-1)
+
+
+def normalize_poses(keypoints):
+    # (N, K, 2) poses normalized by their own mean and std, the old per pose normalize_keypoints for all poses at once
+    keypoints = keypoints.float()
+    if not len(keypoints):
+        return keypoints
+    return (keypoints - keypoints.mean(dim=1, keepdim=True)) / keypoints.std(dim=1, keepdim=True)
+
+
+def match_poses(preds, gts):
+    """
+    Match predicted to ground truth poses on the Euclidean distance between all their keypoints.
+
+    Args:
+        preds: Predicted keypoints, a tensor of size (P, K, 2)
+        gts: Ground truth keypoints, a tensor of size (G, K, 2)
+
+    Returns:
+        pred_indices, gt_indices: Index tensors of the min(P, G) matched pairs
+    """
+    if not len(preds) or not len(gts):
+        empty = torch.zeros(0, dtype=torch.long, device=preds.device)
+        return empty, empty
+    cost = torch.cdist(preds.flatten(1).double(), gts.flatten(1).double())
+    pred_indices, gt_indices = linear_sum_assignment(cost.cpu().numpy())
+    return (torch.as_tensor(pred_indices, device=preds.device),
+            torch.as_tensor(gt_indices, device=preds.device))
+
+
+def keypoint_oks(preds, gts, sigmas=KEYPOINT_SIGMAS):
+    """
+    COCO object keypoint similarity of matched pose pairs, over the annotated ground truth keypoints.
+    The object scale is the area of the box around those keypoints.
+
+    Args:
+        preds, gts: Matched poses, tensors of size (M, K, 2)
+        sigmas: Per keypoint sigmas, in the 10x scale of KEYPOINT_SIGMAS
+
+    Returns:
+        oks: A tensor of size (M,)
+    """
+    visible = ~missing_keypoints(gts)
+    gts = gts.double()
+    big = torch.finfo(gts.dtype).max
+    low = torch.where(visible[..., None], gts, torch.full_like(gts, big)).amin(dim=1)
+    high = torch.where(visible[..., None], gts, torch.full_like(gts, -big)).amax(dim=1)
+    area = (high - low).clamp(min=0).prod(dim=1).clamp(min=1.0)
+
+    kappa = 2 * torch.as_tensor(sigmas, dtype=gts.dtype, device=gts.device) / 10.0
+    squared_distances = ((preds.double() - gts) ** 2).sum(dim=-1)
+    similarity = torch.exp(-squared_distances / (2 * area[:, None] * kappa ** 2))
+    return (similarity * visible).sum(dim=1) / visible.sum(dim=1).clamp(min=1)
+
+
+def average_precision(precisions, recalls):
+    """
+    Area under the precision envelope, the old calculate_mAP (see benchmark_evaluation.py) without the Python loop.
+    """
+    order = np.argsort(recalls, kind='stable')
+    precisions = np.concatenate(([0], np.asarray(precisions, dtype=float)[order], [0]))
+    recalls = np.concatenate(([0], np.asarray(recalls, dtype=float)[order], [1]))
+    envelope = np.maximum.accumulate(precisions[::-1])[::-1]
+    return float(np.sum(np.diff(recalls) * envelope[:-1]))
+
+
+class PoseEvaluator:
+    """
+    Accumulates keypoint true positives, false positives and false negatives at every threshold,
+    and the OKS of the matched poses, one image at a time.
+
+    After matching, a detected keypoint is a true positive when its ground truth is annotated and
+    within the threshold, a false positive otherwise. An annotated keypoint that is not detected
+    within the threshold is a false negative. Keypoints of unmatched poses count as false positives
+    (predictions) or false negatives (ground truths). With `normalize`, distances are measured
+    between poses normalized by their own mean and std, as the old train.py metrics did.
+    """
+
+    def __init__(self, thresholds=DEFAULT_THRESHOLDS, sigmas=KEYPOINT_SIGMAS, normalize=True):
+        self.thresholds = np.asarray(thresholds, dtype=float)
+        self.sigmas = sigmas
+        self.normalize = normalize
+        self.reset()
+
+    def reset(self):
+        self.true_positives = 0
+        self.false_positives = 0
+        self.false_negatives = 0
+        self.oks_sum = 0.0
+        self.num_matched = 0
+        self.num_images = 0
+
+    def _counts(self, preds, gts):
+        device = gts.device
+        thresholds = torch.as_tensor(self.thresholds, dtype=torch.float32, device=device)
+        pred_indices, gt_indices = match_poses(preds, gts)
+        matched_preds, matched_gts = preds[pred_indices], gts[gt_indices]
+
+        pred_missing = missing_keypoints(matched_preds)
+        gt_missing = missing_keypoints(matched_gts)
+        if self.normalize:
+            distances = torch.linalg.norm(normalize_poses(matched_preds) - normalize_poses(matched_gts), dim=-1)
+        else:
+            distances = torch.linalg.norm(matched_preds.float() - matched_gts.float(), dim=-1)
+        hit = (distances[..., None] <= thresholds).flatten(0, 1)
+
+        detected = ~pred_missing.flatten()
+        annotated = ~gt_missing.flatten()
+        true_positives = (hit & (detected & annotated)[:, None]).sum(dim=0)
+
+        # keypoints of the poses left out of the matching
+        unmatched_preds = torch.ones(len(preds), dtype=torch.bool, device=device)
+        unmatched_preds[pred_indices] = False
+        unmatched_gts = torch.ones(len(gts), dtype=torch.bool, device=device)
+        unmatched_gts[gt_indices] = False
+        extra_detected = (~missing_keypoints(preds[unmatched_preds])).sum()
+        extra_annotated = (~missing_keypoints(gts[unmatched_gts])).sum()
+
+        false_positives = detected.sum() - true_positives + extra_detected
+        false_negatives = annotated.sum() - true_positives + extra_annotated
+        oks = keypoint_oks(matched_preds, matched_gts, self.sigmas)
+        return true_positives, false_positives, false_negatives, oks
+
+    def update(self, preds, gts):
+        """
+        Args:
+            preds: Predicted keypoints of one image, a tensor of size (P, K, 2)
+            gts: Ground truth keypoints of the same image, (G, K, 2), padding poses of -1 are ignored
+
+        Returns:
+            A dict with this image's "precision" and "recall" arrays over the thresholds, "mAP", "oks",
+            and the raw "counts" another evaluator can merge()
+        """
+        preds = torch.as_tensor(preds)
+        gts = torch.as_tensor(gts, device=preds.device)
+        preds = preds[~missing_keypoints(preds).all(dim=1)]
+        gts = gts[~missing_keypoints(gts).all(dim=1)]
+
+        true_positives, false_positives, false_negatives, oks = self._counts(preds, gts)
+        counts = {"true_positives": true_positives.cpu().numpy(), "false_positives": false_positives.cpu().numpy(),
+                  "false_negatives": false_negatives.cpu().numpy(), "oks_sum": float(oks.sum()),
+                  "num_matched": len(oks), "num_images": 1}
+        self.merge(counts)
+
+        precision, recall = self._rates(true_positives, false_positives, false_negatives)
+        return {"precision": precision, "recall": recall, "mAP": average_precision(precision, recall),
+                "oks": float(oks.mean()) if len(oks) else 0.0, "counts": counts}
+
+    def merge(self, counts):
+        # counts of images evaluated elsewhere, e.g. by the training callbacks' worker
+        self.true_positives = self.true_positives + counts["true_positives"]
+        self.false_positives = self.false_positives + counts["false_positives"]
+        self.false_negatives = self.false_negatives + counts["false_negatives"]
+        self.oks_sum += counts["oks_sum"]
+        self.num_matched += counts["num_matched"]
+        self.num_images += counts["num_images"]
+
+    def _rates(self, true_positives, false_positives, false_negatives):
+        true_positives = torch.as_tensor(true_positives).double().cpu().numpy()
+        detected = true_positives + torch.as_tensor(false_positives).double().cpu().numpy()
+        annotated = true_positives + torch.as_tensor(false_negatives).double().cpu().numpy()
+        precision = np.divide(true_positives, detected, out=np.zeros_like(true_positives), where=detected > 0)
+        recall = np.divide(true_positives, annotated, out=np.zeros_like(true_positives), where=annotated > 0)
+        precision = np.broadcast_to(precision, self.thresholds.shape).copy()
+        recall = np.broadcast_to(recall, self.thresholds.shape).copy()
+        return precision, recall
+
+    def compute(self):
+        """
+        Returns the dataset level "precision" and "recall" arrays over the thresholds, "mAP" and mean "oks".
+        """
+        precision, recall = self._rates(self.true_positives, self.false_positives, self.false_negatives)
+        return {"precision": precision, "recall": recall, "mAP": average_precision(precision, recall),
+                "oks": self.oks_sum / self.num_matched if self.num_matched else 0.0}
+
+
+def evaluate_keypoints(keypoint_coords, ground_truth_keypoints, image_size):
+    """
+    Metrics of one decoded training item, the metrics_fn train.py gives DecodeCallback. It lives here so
+    the callbacks' worker process can unpickle it without running train.py.
+    """
+    metrics = PoseEvaluator().update(keypoint_coords, ground_truth_keypoints)
+    return {"mAP": metrics["mAP"], "oks": metrics["oks"], "counts": metrics["counts"]}
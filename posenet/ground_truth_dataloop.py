@@ -7,6 +7,7 @@ from scipy.stats import multivariate_normal
 from skimage.morphology import dilation, disk
 from posenet import constants as constants
 import torch
+import torch.nn.functional as F
 import json
 import re
 
@@ -326,14 +327,85 @@ def add_space_before_capital(s):
 #     return index_map
 
 
-def load_ground_truth_data(image_file_names, keypoints_updated_dir):
+def create_binary_target_heatmaps(keypoints, height, width, radius=3):
+    """
+    Draw a disk of `radius` around every keypoint, for any number of images and poses at once.
+
+    Args:
+        keypoints: Keypoints on the heatmap grid, a tensor of size (..., num_keypoints, 2) holding x, y,
+            with (0, 0) or (-1, -1) for missing keypoints
+        height, width: The heatmap size
+        radius: The disk radius
+
+    Returns:
+        binary_target_heatmaps: A boolean tensor of size (..., num_keypoints, height, width)
+    """
+    device = keypoints.device
+
+    x, y = keypoints[..., 0], keypoints[..., 1]
+    valid = ((x != 0) & (x != -1)) | ((y != 0) & (y != -1))
+    # truncated like int(), the disk is centered on the grid cell
+    x, y = x.long(), y.long()
+
+    # squared distance of every row and column to the keypoint, clamped just past the radius so int16 holds it
+    dy = (torch.arange(height, device=device) - y[..., None]).clamp(-radius - 1, radius + 1).to(torch.int16)
+    dx = (torch.arange(width, device=device) - x[..., None]).clamp(-radius - 1, radius + 1).to(torch.int16)
+    inside = (dy * dy)[..., :, None] + (dx * dx)[..., None, :] <= radius * radius
+
+    return inside & valid[..., None, None]
+
+
+def create_offset_masks(heatmaps, radius=3, threshold=0.1):
+    """
+    Threshold the ground truth heatmaps and dilate them by `radius`, for any number of images and poses at once.
+    Same result as a (2 * radius + 1) max_pool2d, done as a row then a column pass of shifted ORs.
+
+    Args:
+        heatmaps: Ground truth heatmaps, a tensor of size (..., height, width)
+
+    Returns:
+        masks: A boolean tensor of the same size
+    """
+    height, width = heatmaps.shape[-2:]
+    mask = (heatmaps > threshold).to(torch.uint8)
+
+    padded = F.pad(mask, (0, 0, radius, radius))
+    rows = padded[..., :height, :].clone()
+    for shift in range(1, 2 * radius + 1):
+        rows |= padded[..., shift:shift + height, :]
+
+    padded = F.pad(rows, (radius, radius))
+    mask = padded[..., :width].clone()
+    for shift in range(1, 2 * radius + 1):
+        mask |= padded[..., shift:shift + width]
+    return mask.bool()
+
+
+# pad the ground truth of one image to max_poses poses, with -1 like load_ground_truth_data always did
+# input: keypoints and offset vectors of shape [num_poses, 17, 2], scaled to heatmap size
+# output: keypoints [15, 17, 2], heatmaps [15, 17, 33, 33] and offset vectors [15, 17, 2], integer arrays
+def pad_ground_truth(keypoints, offset_vectors, num_keypoints=17, heatmap_shape=(33, 33), max_poses=15, heatmaps=None):
+    # heatmaps: the poses' heatmaps if already built, e.g. read from a pack, otherwise generated here
+    num_poses = keypoints.shape[0]
+    keypoints_padded = np.full((max_poses, num_keypoints, 2), -1)
+    heatmaps_padded = np.full((max_poses, num_keypoints, heatmap_shape[0], heatmap_shape[1]), -1)
+    offset_vectors_padded = np.full((max_poses, num_keypoints, 2), -1)
+
+    if num_poses:
+        keypoints_padded[:num_poses] = keypoints
+        heatmaps_padded[:num_poses] = heatmaps if heatmaps is not None else load_keypoints(keypoints, num_keypoints, heatmap_shape)
+        offset_vectors_padded[:num_poses] = offset_vectors
+
+    return keypoints_padded, heatmaps_padded, offset_vectors_padded
+
+
+def load_ground_truth_data(image_file_names, keypoints_updated_dir, device=None):
     keypoints_list = []
     heatmaps_list = []
     offset_vectors_list = []
 
     for image_file_name in image_file_names:
         image_file_dir = os.path.join(keypoints_updated_dir, image_file_name)
-        pose_keypoints_list = []
               
         keypoints_file = os.path.join(image_file_dir, image_file_name + "_keypoints.txt")
         print("load ground truth keypoints_file", keypoints_file)
@@ -351,39 +423,16 @@ def load_ground_truth_data(image_file_names, keypoints_updated_dir):
         keypoints = keypoints_flat.reshape(num_poses, 17, 2)
         generated_keypoints = generated_keypoints_flat.reshape(num_poses, 17, 2)
 
-        # Generate the heatmaps from the keypoints
-        heatmaps = load_keypoints(keypoints, num_keypoints=17, heatmap_shape=(33, 33))
+        # Pad the poses and generate the heatmaps from the keypoints
+        keypoints, heatmaps, offset_vectors = pad_ground_truth(keypoints, generate_offset_vectors(keypoints, generated_keypoints))
 
         keypoints_list.append(keypoints)
         heatmaps_list.append(heatmaps)
-        offset_vectors_list.append(generate_offset_vectors(keypoints, generated_keypoints))
-    
-    print("--type--")
-    print("heatmaps list len: ", len(heatmaps_list))
-    print("heatmaps list [0] shape: ", heatmaps_list[0].shape)
-    print("offset vectors list shape: ", offset_vectors_list[0].shape)
-    
-    # keypoints_list = [np.array(keypoints, dtype=np.float32) for keypoints in keypoints_list]
-    # heatmaps_list = [np.array(heatmaps, dtype=np.float32) for heatmaps in heatmaps_list]
-    # offset_vectors_list = [np.array(offset_vectors, dtype=np.float32) for offset_vectors in offset_vectors_list]
-    
-    num_images = len(keypoints_list)
-    keypoints_padded = np.full((num_images, 15, 17, 2), -1)
-    heatmaps_padded = np.full((num_images, 15, 17, 33, 33), -1)
-    offset_vectors_padded = np.full((num_images, 15, 17, 2), -1)
-    
-    for image in range(num_images): 
-        num_poses = keypoints_list[image].shape[0]
-        keypoints_padded[image, :num_poses, :, :] = keypoints_list[image]
-        heatmaps_padded[image, :num_poses, :, :] = heatmaps_list[image]
-        offset_vectors_padded[image, :num_poses, :, :] = offset_vectors_list[image]
-        
-    
-    keypoints_padded = torch.from_numpy(keypoints_padded).cuda()
-    
-    heatmaps_padded = torch.from_numpy(heatmaps_padded).cuda()
-    offset_vectors_padded = torch.from_numpy(offset_vectors_padded).cuda()
+        offset_vectors_list.append(offset_vectors)
     
+    keypoints_padded = torch.from_numpy(np.stack(keypoints_list)).to(device)
+    heatmaps_padded = torch.from_numpy(np.stack(heatmaps_list)).to(device)
+    offset_vectors_padded = torch.from_numpy(np.stack(offset_vectors_list)).to(device)
     
     print("keypoints_list shape: ", keypoints_padded.shape)
     print("heatmaps_list shape: ", heatmaps_padded.shape)
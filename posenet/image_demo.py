@@ -14,12 +14,14 @@ parser.add_argument('--scale_factor', type=float, default=1.0)
 parser.add_argument('--notxt', action='store_true')
 parser.add_argument('--image_dir', type=str, default='./images_train')
 parser.add_argument('--output_dir', type=str, default='./output')
+parser.add_argument('--single_pose', action='store_true')
+posenet.add_device_args(parser)
 args = parser.parse_args()
 
 
 def main():
-    model = posenet.load_model(args.model)
-    model = model.cuda()
+    device = posenet.select_device(args.device, args.num_threads, args.num_interop_threads)
+    model = posenet.load_model(args.model, device=device, channels_last=args.channels_last)
     output_stride = model.output_stride
 
     if args.output_dir:
@@ -34,18 +36,25 @@ def main():
         input_image, draw_image, output_scale = posenet.read_imgfile(
             f, scale_factor=args.scale_factor, output_stride=output_stride)
 
-        with torch.no_grad():
-            input_image = torch.Tensor(input_image).cuda()
+        with posenet.inference_context(args.inference_mode):
+            input_image = posenet.to_input_tensor(input_image, device, args.channels_last)
 
             heatmaps_result, offsets_result, displacement_fwd_result, displacement_bwd_result = model(input_image)
-            pose_scores, keypoint_scores, keypoint_coords, pose_offsets = posenet.decode_multi.decode_multiple_poses(
-                heatmaps_result.squeeze(0),
-                offsets_result.squeeze(0),
-                displacement_fwd_result.squeeze(0),
-                displacement_bwd_result.squeeze(0),
-                output_stride=output_stride,
-                max_pose_detections=10,
-                min_pose_score=0.25)
+            if args.single_pose:
+                pose_scores, keypoint_scores, keypoint_coords, pose_offsets = posenet.decode.decode_single_pose(
+                    heatmaps_result.squeeze(0),
+                    offsets_result.squeeze(0),
+                    output_stride=output_stride,
+                    min_pose_score=0.25)
+            else:
+                pose_scores, keypoint_scores, keypoint_coords, pose_offsets = posenet.decode_multi.decode_multiple_poses(
+                    heatmaps_result.squeeze(0),
+                    offsets_result.squeeze(0),
+                    displacement_fwd_result.squeeze(0),
+                    displacement_bwd_result.squeeze(0),
+                    output_stride=output_stride,
+                    max_pose_detections=10,
+                    min_pose_score=0.25)
 
         keypoint_coords *= output_scale
 
@@ -0,0 +1,44 @@
+import torch
+
+from posenet.converter.export import INPUT_NAME, OUTPUT_NAMES
+
+BACKENDS = ('eager', 'torchscript', 'onnx')
+
+
+class TorchScriptSession(object):
+    # a scripted MobileNetV1, called exactly like the eager model
+    def __init__(self, path, output_stride, device=None):
+        self.device = torch.device(device or 'cpu')
+        self.output_stride = output_stride
+        self.model = torch.jit.load(path, map_location=self.device)
+        self.model.eval()
+
+    def __call__(self, input_image):
+        return self.model(input_image)
+
+
+class OnnxSession(object):
+    # runs the exported graph with onnxruntime, outputs come back as torch tensors on `device`
+    # so the decoders don't need to know which backend produced them
+    def __init__(self, path, output_stride, device=None):
+        import onnxruntime
+
+        self.device = torch.device(device or 'cpu')
+        self.output_stride = output_stride
+        providers = ['CPUExecutionProvider']
+        if self.device.type == 'cuda':
+            providers.insert(0, 'CUDAExecutionProvider')
+        self.session = onnxruntime.InferenceSession(path, providers=providers)
+
+    def __call__(self, input_image):
+        input_image = input_image.detach().cpu().contiguous().numpy()
+        outputs = self.session.run(OUTPUT_NAMES, {INPUT_NAME: input_image})
+        return tuple(torch.from_numpy(x).to(self.device) for x in outputs)
+
+
+def load_exported(path, backend, output_stride, device=None):
+    if backend == 'torchscript':
+        return TorchScriptSession(path, output_stride, device)
+    elif backend == 'onnx':
+        return OnnxSession(path, output_stride, device)
+    raise ValueError('Unknown backend %s, expected one of %s' % (backend, BACKENDS[1:]))
@@ -1,6 +1,7 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.ao.quantization import QuantStub, DeQuantStub
 
 from collections import OrderedDict
 
@@ -49,9 +50,10 @@ class InputConv(nn.Module):
         super(InputConv, self).__init__()
         self.conv = nn.Conv2d(
             inp, outp, k, stride, padding=_get_padding(k, stride, dilation), dilation=dilation)
+        self.relu = nn.ReLU6()
 
     def forward(self, x):
-        return F.relu6(self.conv(x))
+        return self.relu(self.conv(x))
 
 
 class SeperableConv(nn.Module):
@@ -60,11 +62,13 @@ class SeperableConv(nn.Module):
         self.depthwise = nn.Conv2d(
             inp, inp, k, stride,
             padding=_get_padding(k, stride, dilation), dilation=dilation, groups=inp)
+        self.depthwise_relu = nn.ReLU6()
         self.pointwise = nn.Conv2d(inp, outp, 1, 1)
+        self.pointwise_relu = nn.ReLU6()
 
     def forward(self, x):
-        x = F.relu6(self.depthwise(x))
-        x = F.relu6(self.pointwise(x))
+        x = self.depthwise_relu(self.depthwise(x))
+        x = self.pointwise_relu(self.pointwise(x))
         return x
 
 
@@ -147,14 +151,19 @@ class MobileNetV1(nn.Module):
             for c in conv_def]
         last_depth = conv_def[-1]['outp']
 
+        # the stubs are identities in fp32 and mark the int8 region when quantized (see models/quantization.py)
+        self.quant = QuantStub()
         self.features = nn.Sequential(OrderedDict(conv_list))
+        self.dequant = DeQuantStub()
         self.heatmap = nn.Conv2d(last_depth, 17, 1, 1)
         self.offset = nn.Conv2d(last_depth, 34, 1, 1)
         self.displacement_fwd = nn.Conv2d(last_depth, 32, 1, 1)
         self.displacement_bwd = nn.Conv2d(last_depth, 32, 1, 1)
 
     def forward(self, x):
+        x = self.quant(x)
         x = self.features(x)
+        x = self.dequant(x)
         heatmap = torch.sigmoid(self.heatmap(x))
         offset = self.offset(x)
         displacement_fwd = self.displacement_fwd(x)
@@ -6,9 +6,53 @@ from posenet.models.mobilenet_v1 import MobileNetV1, MOBILENET_V1_CHECKPOINTS
 
 MODEL_DIR = './_models'
 DEBUG_OUTPUT = False
+CALIBRATION_DIR = './images'
 
 
-def load_model(model_id, output_stride=16, model_dir=MODEL_DIR):
+def add_device_args(parser):
+    # shared command line knobs for every script that runs the model,
+    # --device defaults to cuda when available and the thread counts only matter on CPU
+    parser.add_argument('--device', type=str, default=None)
+    parser.add_argument('--num_threads', type=int, default=None)
+    parser.add_argument('--num_interop_threads', type=int, default=None)
+    parser.add_argument('--channels_last', action='store_true')
+    parser.add_argument('--inference_mode', action='store_true')
+    return parser
+
+
+def select_device(device=None, num_threads=None, num_interop_threads=None):
+    if device is None:
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    device = torch.device(device)
+
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads:
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError:
+            # can only be set once, before any inter-op parallel work has started
+            print('Cannot change the number of inter-op threads, keeping %d' % torch.get_num_interop_threads())
+
+    return device
+
+
+def inference_context(inference_mode=False):
+    return torch.inference_mode() if inference_mode else torch.no_grad()
+
+
+def to_input_tensor(input_image, device, channels_last=False):
+    # pinned inputs (InputPreprocessor's, with CUDA) are copied asynchronously, the copy is queued
+    # on the current stream ahead of the forward pass that reads it
+    input_image = torch.as_tensor(input_image, dtype=torch.float32)
+    input_image = input_image.to(device, non_blocking=input_image.is_pinned())
+    if channels_last:
+        input_image = input_image.contiguous(memory_format=torch.channels_last)
+    return input_image
+
+
+def load_model(model_id, output_stride=16, model_dir=MODEL_DIR, device=None, channels_last=False,
+               quantize=None, calibration_dir=CALIBRATION_DIR, optimize=False):
     model_path = os.path.join(model_dir, MOBILENET_V1_CHECKPOINTS[model_id] + '.pth')
     if not os.path.exists(model_path):
         print('Cannot find models file %s, converting from tfjs...' % model_path)
@@ -17,7 +61,49 @@ def load_model(model_id, output_stride=16, model_dir=MODEL_DIR):
         assert os.path.exists(model_path)
 
     model = MobileNetV1(model_id, output_stride=output_stride)
-    load_dict = torch.load(model_path)
+    load_dict = torch.load(model_path, map_location='cpu')
     model.load_state_dict(load_dict)
 
+    if quantize is not None and optimize:
+        raise ValueError('optimize and quantize cannot be combined, quantization does its own fusion')
+
+    if optimize:
+        from posenet.models.optimize import optimize_model
+        model = optimize_model(model)
+
+    if quantize is not None:
+        # quantized kernels only exist for CPU
+        if device is not None and torch.device(device).type != 'cpu':
+            raise ValueError('Quantized models run on CPU only, got device %s' % device)
+        from posenet.models.quantization import load_quantized_model
+        model = load_quantized_model(model, model_path, quantize, calibration_dir)
+
+    if device is not None:
+        model = model.to(device)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+
     return model
+
+
+def load_backend(backend, model_id, output_stride=16, model_dir=MODEL_DIR, device=None, channels_last=False,
+                 image_size=513, optimize=False):
+    # 'eager' is the plain MobileNetV1 from load_model, the other backends run a graph exported by
+    # converter/export.py and export it first if it isn't in model_dir yet
+    if backend == 'eager':
+        return load_model(model_id, output_stride, model_dir, device=device, channels_last=channels_last,
+                          optimize=optimize)
+    # the exported graphs are plain fp32 NCHW, neither option would change what runs
+    if channels_last or optimize:
+        raise ValueError('channels_last and optimize only apply to the eager backend, not %s' % backend)
+
+    from posenet.converter.export import export, export_path
+    from posenet.models.backends import load_exported
+
+    path = export_path(model_id, model_dir, backend, output_stride, image_size)
+    if not os.path.exists(path):
+        print('Cannot find exported model %s, exporting...' % path)
+        export(model_id, model_dir, output_stride, image_size, formats=(backend,), check=True)
+        assert os.path.exists(path)
+
+    return load_exported(path, backend, output_stride, device)
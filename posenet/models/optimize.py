@@ -0,0 +1,66 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from collections import OrderedDict
+
+from posenet.models.mobilenet_v1 import InputConv, SeperableConv
+
+HEAD_NAMES = ('heatmap', 'offset', 'displacement_fwd', 'displacement_bwd')
+
+
+class ConvReLU6(nn.Module):
+    # conv followed by an in place clamp, the activation reuses the conv output buffer
+    # instead of allocating and writing a second feature map
+    def __init__(self, conv):
+        super(ConvReLU6, self).__init__()
+        self.conv = conv
+
+    def forward(self, x):
+        return F.hardtanh(self.conv(x), 0., 6., inplace=True)
+
+
+class OptimizedMobileNetV1(nn.Module):
+    """
+    Inference only rewrite of MobileNetV1.
+
+    Every conv is fused with its ReLU6 and the four 1x1 output heads, which all read the same
+    feature map, are merged into one 115 channel conv whose output is sliced afterwards.
+    Outputs are the same as the eager model, the offsets and displacements are channel slices
+    of the merged head output.
+    """
+
+    def __init__(self, model):
+        super(OptimizedMobileNetV1, self).__init__()
+        self.output_stride = model.output_stride
+
+        layers = []
+        for name, block in model.features.named_children():
+            if isinstance(block, InputConv):
+                layers.append((name, ConvReLU6(block.conv)))
+            elif isinstance(block, SeperableConv):
+                layers.append((name, nn.Sequential(ConvReLU6(block.depthwise), ConvReLU6(block.pointwise))))
+            else:
+                raise ValueError('Cannot fuse %s' % type(block).__name__)
+        self.features = nn.Sequential(OrderedDict(layers))
+
+        heads = [getattr(model, name) for name in HEAD_NAMES]
+        self.head_channels = [head.out_channels for head in heads]
+        self.heads = nn.Conv2d(heads[0].in_channels, sum(self.head_channels), 1, 1)
+        with torch.no_grad():
+            self.heads.weight.copy_(torch.cat([head.weight for head in heads]))
+            self.heads.bias.copy_(torch.cat([head.bias for head in heads]))
+
+    def forward(self, x):
+        x = self.features(x)
+        heatmap, offset, displacement_fwd, displacement_bwd = torch.split(self.heads(x), self.head_channels, dim=1)
+        return torch.sigmoid(heatmap), offset, displacement_fwd, displacement_bwd
+
+
+def optimize_model(model):
+    model.eval()
+    optimized = OptimizedMobileNetV1(model)
+    optimized.eval()
+    # the in place activations would break autograd, this model is for inference only
+    optimized.requires_grad_(False)
+    return optimized
@@ -0,0 +1,107 @@
+import hashlib
+import os
+
+import torch
+import torch.nn as nn
+from torch.ao.nn.intrinsic import ConvReLU2d
+from torch.ao.quantization import QConfig, MinMaxObserver, default_per_channel_weight_observer
+
+from posenet.models.mobilenet_v1 import InputConv, SeperableConv
+
+QUANTIZE_MODES = ('int8',)
+NUM_CALIBRATION_IMAGES = 100
+
+
+class ReLU6Observer(MinMaxObserver):
+    # the fused conv+relu modules only clamp at zero, capping the observed range at 6
+    # makes the int8 output saturate exactly where ReLU6 would
+    def calculate_qparams(self):
+        return self._calculate_qparams(self.min_val, torch.clamp(self.max_val, max=6.))
+
+
+def quantized_model_path(model_path, quantize, output_stride, calibration_files):
+    # calibration depends on the stride (dilations change the activation ranges), on the backend
+    # (x86 reduces the range by one bit) and on the images it saw, so all of them are part of the cache name
+    base, ext = os.path.splitext(model_path)
+    return '%s_%s_os%d_%s_%s%s' % (base, quantize, output_stride, torch.backends.quantized.engine,
+                                   calibration_key(calibration_files), ext)
+
+
+def calibration_files(calibration_dir, num_images=NUM_CALIBRATION_IMAGES):
+    filenames = sorted(
+        f.path for f in os.scandir(calibration_dir) if f.is_file() and f.path.endswith(('.png', '.jpg')))
+    if not filenames:
+        raise ValueError('No calibration images found in %s' % calibration_dir)
+    return filenames[:num_images]
+
+
+def calibration_key(filenames):
+    # names, sizes and modification times of the calibration images, a changed set means a new calibration
+    digest = hashlib.sha1()
+    for f in filenames:
+        stat = os.stat(f)
+        digest.update(('%s:%d:%d\n' % (os.path.basename(f), stat.st_size, stat.st_mtime_ns)).encode('utf-8'))
+    return digest.hexdigest()[:12]
+
+
+def _fuse(conv):
+    return ConvReLU2d(conv, nn.ReLU())
+
+
+def fuse_model(model):
+    for block in model.features:
+        if isinstance(block, InputConv):
+            block.conv, block.relu = _fuse(block.conv), nn.Identity()
+        elif isinstance(block, SeperableConv):
+            block.depthwise, block.depthwise_relu = _fuse(block.depthwise), nn.Identity()
+            block.pointwise, block.pointwise_relu = _fuse(block.pointwise), nn.Identity()
+    return model
+
+
+def prepare_model(model):
+    model.eval()
+    fuse_model(model)
+
+    engine = torch.backends.quantized.engine
+    model.qconfig = QConfig(
+        activation=ReLU6Observer.with_args(reduce_range=engine in ('x86', 'fbgemm')),
+        weight=default_per_channel_weight_observer)
+    # the output heads stay fp32, they are cheap 1x1 convs and the offsets and displacements
+    # need more range than 8 bits give at pixel resolution
+    for head in (model.heatmap, model.offset, model.displacement_fwd, model.displacement_bwd):
+        head.qconfig = None
+
+    return torch.ao.quantization.prepare(model)
+
+
+def calibrate(model, calibration_dir, num_images=NUM_CALIBRATION_IMAGES, scale_factor=1.0):
+    from posenet.utils import read_imgfile
+
+    with torch.no_grad():
+        for f in calibration_files(calibration_dir, num_images):
+            input_image, _, _ = read_imgfile(f, scale_factor=scale_factor, output_stride=model.output_stride)
+            model(torch.Tensor(input_image))
+    return model
+
+
+def quantize_model(model, calibration_dir, num_images=NUM_CALIBRATION_IMAGES):
+    model = prepare_model(model)
+    calibrate(model, calibration_dir, num_images)
+    return torch.ao.quantization.convert(model)
+
+
+def load_quantized_model(model, model_path, quantize, calibration_dir):
+    if quantize not in QUANTIZE_MODES:
+        raise ValueError('Unknown quantization mode %s, expected one of %s' % (quantize, QUANTIZE_MODES))
+
+    cache_path = quantized_model_path(model_path, quantize, model.output_stride, calibration_files(calibration_dir))
+    if os.path.exists(cache_path):
+        # converting an uncalibrated model gives the right module structure for the cached weights
+        model = torch.ao.quantization.convert(prepare_model(model))
+        model.load_state_dict(torch.load(cache_path, map_location='cpu'))
+        return model
+
+    print('Cannot find quantized model %s, calibrating on %s...' % (cache_path, calibration_dir))
+    model = quantize_model(model, calibration_dir)
+    torch.save(model.state_dict(), cache_path)
+    return model
@@ -0,0 +1,226 @@
+"""
+Packed ground truth: one file per split instead of the per image text files of
+ground_truth_dataloop.prepare_ground_truth_data. The file is memory mapped, opening it costs the same
+for any dataset size and reading an item only touches that item's bytes.
+
+Layout: 8 byte magic, little endian uint64 header length, JSON header, then every array at the 64 byte
+aligned offset the header gives for it, counted from the aligned end of the header. The poses and images
+of all items are stored back to back, item i owns rows pose_index[i]:pose_index[i + 1] and bytes
+image_index[i]:image_index[i + 1].
+
+    pose_index      (N + 1,) int64
+    keypoints       (num_poses, 17, 2) float64, scaled to the heatmap shape
+    offset_vectors  (num_poses, 17, 2) float64, keypoints minus the argmax of their heatmaps
+    heatmaps        (num_poses, 17, H, W) int8, as pad_ground_truth stores them
+    binary_heatmaps (num_poses, 17, ceil(H * W / 8)) uint8, create_binary_target_heatmaps, bit packed
+    offset_masks    (num_poses, 17, ceil(H * W / 8)) uint8, create_offset_masks, bit packed
+    image_index     (N + 1,) int64, only in packs written with --images
+    image_shapes    (N, 3) int64
+    image_scales    (N, 2) float64, read_imgfile's output_scale
+    images          (num_bytes,) uint8, BGR images already resized as read_imgfile resizes them
+
+Write one with:
+    python packed_dataset.py pack --images_dir images_train --keypoints_dir labels_train --output train.pack --images
+"""
+import argparse
+import json
+import os
+import shutil
+
+import cv2
+import numpy as np
+import torch
+
+MAGIC = b'POSEPACK'
+ALIGNMENT = 64
+
+
+class PackedDataset:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("%s is not a packed dataset" % path)
+            header_length = int.from_bytes(f.read(8), 'little')
+            self.header = json.loads(f.read(header_length).decode('utf-8'))
+        # array offsets in the header are relative to the aligned end of the header
+        data_start = _aligned(len(MAGIC) + 8 + header_length)
+        self.path = path
+        self.filenames = self.header['filenames']
+        self._buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        self.arrays = {name: np.ndarray(tuple(spec['shape']), dtype=spec['dtype'], buffer=self._buffer, offset=data_start + spec['offset'])
+                       for name, spec in self.header['arrays'].items()}
+
+    def __len__(self):
+        return len(self.filenames)
+
+    @property
+    def has_images(self):
+        return 'images' in self.arrays
+
+    def ground_truth(self, idx):
+        # views into the file, [num_poses, 17, 2] keypoints and offset vectors
+        start, end = self.arrays['pose_index'][idx:idx + 2]
+        return self.arrays['keypoints'][start:end], self.arrays['offset_vectors'][start:end]
+
+    def targets(self, idx):
+        # [num_poses, 17, H, W] heatmaps, binary target heatmaps and offset masks, built when packing
+        start, end = self.arrays['pose_index'][idx:idx + 2]
+        shape = (end - start, self.arrays['heatmaps'].shape[1]) + self.arrays['heatmaps'].shape[2:]
+        binary_heatmaps, offset_masks = [
+            np.unpackbits(self.arrays[name][start:end], axis=-1, count=shape[2] * shape[3]).reshape(shape).view(bool)
+            for name in ('binary_heatmaps', 'offset_masks')]
+        return self.arrays['heatmaps'][start:end], binary_heatmaps, offset_masks
+
+    def image(self, idx):
+        # view of the resized BGR image, and the scale back to the source image
+        start, end = self.arrays['image_index'][idx:idx + 2]
+        image = self.arrays['images'][start:end].reshape(self.arrays['image_shapes'][idx])
+        return image, self.arrays['image_scales'][idx]
+
+
+def write_pack(path, filenames, arrays, image_file=None, settings=None):
+    """
+    Args:
+        path: The pack to write
+        filenames: Image file names, one per item
+        arrays: name -> numpy array, written in this order
+        image_file: A raw file holding the concatenated images, copied in as the 'images' array
+        settings: Anything else to keep in the header, e.g. how the images were resized
+    """
+    specs = {}
+    offset = 0
+    for name, array in arrays.items():
+        specs[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset = _aligned(offset + array.nbytes)
+    if image_file is not None:
+        specs['images'] = {'dtype': '|u1', 'shape': [os.path.getsize(image_file)], 'offset': offset}
+    header = json.dumps({'filenames': list(filenames), 'settings': settings or {}, 'arrays': specs}).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + specs[name]['offset'])
+            f.write(np.ascontiguousarray(array).tobytes())
+        if image_file is not None:
+            f.seek(data_start + specs['images']['offset'])
+            with open(image_file, 'rb') as images:
+                shutil.copyfileobj(images, f)
+        f.truncate()
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def pack_ground_truth_data(images_dir, keypoints_dir, output_path, num_keypoints=17, heatmap_shape=[33,33],
+                           images=False, scale_factor=1.0, output_stride=16):
+    """
+    The keypoints and offset vectors prepare_ground_truth_data computes, for every image with a keypoint file,
+    written to one pack. With `images`, the images are stored resized for the given scale_factor and output_stride.
+    """
+    from ground_truth_dataloop import (keypoint_path_to_heatmap_keypoints, load_keypoints, pad_ground_truth,
+                                       generated_keypoints_from_heatmaps, generate_offset_vectors,
+                                       create_binary_target_heatmaps, create_offset_masks)
+    import posenet
+
+    filenames = []
+    keypoints_list = []
+    offset_vectors_list = []
+    heatmaps_list = []
+    binary_heatmaps_list = []
+    offset_masks_list = []
+    pose_index = [0]
+    image_index = [0]
+    image_shapes = []
+    image_scales = []
+    preprocessor = posenet.get_preprocessor(scale_factor, output_stride)
+    image_file = output_path + '.images'
+    heatmap_size = heatmap_shape[0] * heatmap_shape[1]
+    packed_size = (heatmap_size + 7) // 8
+
+    with open(image_file, 'wb') as image_out:
+        for image_file_name in sorted(os.listdir(images_dir)):
+            if not image_file_name.endswith((".jpg", ".png")):
+                continue
+            keypoint_path = os.path.join(keypoints_dir, os.path.splitext(image_file_name)[0] + ".json")
+            if not os.path.exists(keypoint_path):
+                print("Keypoint file does not exist for image:", image_file_name)
+                continue
+            if images:
+                # read first, so an unreadable image skips the whole item and the indexes stay in step
+                image = cv2.imread(os.path.join(images_dir, image_file_name))
+                if image is None:
+                    print("Image file could not be read:", image_file_name)
+                    continue
+
+            keypoints = keypoint_path_to_heatmap_keypoints(keypoint_path, num_keypoints, heatmap_shape)
+            if len(keypoints):
+                generated_keypoints = generated_keypoints_from_heatmaps(load_keypoints(keypoints, num_keypoints, heatmap_shape))
+                offset_vectors = generate_offset_vectors(keypoints, generated_keypoints.numpy())
+            else:
+                offset_vectors = keypoints.copy()
+            # the training targets, built here once instead of in every __getitem__
+            num_poses = len(keypoints)
+            padded_keypoints, heatmaps, _ = pad_ground_truth(keypoints, offset_vectors, num_keypoints, heatmap_shape, max_poses=num_poses)
+            binary_heatmaps = create_binary_target_heatmaps(torch.from_numpy(padded_keypoints), *heatmap_shape).numpy()
+            offset_masks = create_offset_masks(torch.from_numpy(heatmaps)).numpy()
+
+            filenames.append(image_file_name)
+            keypoints_list.append(keypoints)
+            offset_vectors_list.append(offset_vectors)
+            heatmaps_list.append(heatmaps.astype(np.int8))
+            binary_heatmaps_list.append(np.packbits(binary_heatmaps.reshape(num_poses, num_keypoints, heatmap_size), axis=-1))
+            offset_masks_list.append(np.packbits(offset_masks.reshape(num_poses, num_keypoints, heatmap_size), axis=-1))
+            pose_index.append(pose_index[-1] + len(keypoints))
+
+            if images:
+                target_width, target_height, scale = preprocessor.resolution(image.shape[:2])
+                resized = cv2.resize(image, (target_width, target_height), interpolation=cv2.INTER_LINEAR)
+                image_out.write(resized.tobytes())
+                image_index.append(image_index[-1] + resized.nbytes)
+                image_shapes.append(resized.shape)
+                image_scales.append(scale)
+
+    arrays = {
+        'pose_index': np.array(pose_index, dtype=np.int64),
+        'keypoints': np.concatenate([np.zeros((0, num_keypoints, 2))] + keypoints_list).astype(np.float64).reshape(-1, num_keypoints, 2),
+        'offset_vectors': np.concatenate([np.zeros((0, num_keypoints, 2))] + offset_vectors_list).astype(np.float64).reshape(-1, num_keypoints, 2),
+        'heatmaps': np.concatenate([np.zeros((0, num_keypoints) + tuple(heatmap_shape), dtype=np.int8)] + heatmaps_list),
+        'binary_heatmaps': np.concatenate([np.zeros((0, num_keypoints, packed_size), dtype=np.uint8)] + binary_heatmaps_list),
+        'offset_masks': np.concatenate([np.zeros((0, num_keypoints, packed_size), dtype=np.uint8)] + offset_masks_list),
+    }
+    settings = {'heatmap_shape': list(heatmap_shape)}
+    if images:
+        arrays['image_index'] = np.array(image_index, dtype=np.int64)
+        arrays['image_shapes'] = np.array(image_shapes, dtype=np.int64).reshape(-1, 3)
+        arrays['image_scales'] = np.array(image_scales, dtype=np.float64).reshape(-1, 2)
+        settings.update(scale_factor=scale_factor, output_stride=output_stride)
+    try:
+        write_pack(output_path, filenames, arrays, image_file if images else None, settings)
+    finally:
+        os.remove(image_file)
+    print("packed %d images, %d poses into %s" % (len(filenames), pose_index[-1], output_path))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+    pack = commands.add_parser('pack', help='pack the ground truth of a directory of images')
+    pack.add_argument('--images_dir', type=str, default='./images_train')
+    pack.add_argument('--keypoints_dir', type=str, default='./labels_train')
+    pack.add_argument('--output', type=str, default='./train.pack')
+    pack.add_argument('--images', action='store_true', help='also store the images, resized for the network input')
+    pack.add_argument('--scale_factor', type=float, default=1.0)
+    pack.add_argument('--output_stride', type=int, default=16)
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        pack_ground_truth_data(args.images_dir, args.keypoints_dir, args.output, images=args.images,
+                               scale_factor=args.scale_factor, output_stride=args.output_stride)
+
+
+if __name__ == "__main__":
+    main()
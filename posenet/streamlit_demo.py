@@ -32,8 +32,8 @@ def process_frame(frame, scale_factor, output_stride):
 @st.cache_data()
 
 def load_model(model):
-    model = posenet.load_model(model)
-    model = model.cuda()
+    device = posenet.select_device()
+    model = posenet.load_model(model, device=device)
     return model
 
 def main():
@@ -47,6 +47,8 @@ def main():
 
     min_part_score = st.sidebar.number_input("Minimum Part Score", min_value=0.000, max_value=1.000, value=0.010, step=0.001)
     st.sidebar.markdown(f'<p style="color:grey; font-size:12px">The current number is {min_part_score:.3f}</p>', unsafe_allow_html=True)
+    torch_decode = st.sidebar.checkbox('Decode on device (torch)', value=False,
+                                       help='About 8 ms/image on CPU vs 3-7 ms for the numpy decoder, worth it when the model runs on a GPU')
 
     model = load_model(model_number)
     output_stride = model.output_stride
@@ -69,7 +71,7 @@ def main():
     
             while success:
                 input_image, draw_image, output_scale = process_frame(image, scale_factor, output_stride)
-                pose_scores, keypoint_scores, keypoint_coords = run_model(input_image, model, output_stride, output_scale)
+                pose_scores, keypoint_scores, keypoint_coords = run_model(input_image, model, output_stride, output_scale, torch_decode=torch_decode)
 
                 result_image = posenet.draw_skel_and_kp(
                     draw_image, pose_scores, keypoint_scores, keypoint_coords,
@@ -133,7 +135,7 @@ def main():
             if frames:
                 frame_idx = st.slider('Choose a frame', 0, len(frames) - 1, 0)
                 input_image, draw_image, output_scale = process_frame(frames[frame_idx], scale_factor, output_stride)
-                pose_scores, keypoint_scores, keypoint_coords = run_model(input_image, model, output_stride, output_scale)
+                pose_scores, keypoint_scores, keypoint_coords = run_model(input_image, model, output_stride, output_scale, torch_decode=torch_decode)
 
                 pose_data = {
                     'pose_scores': pose_scores.tolist(),
@@ -162,7 +164,7 @@ def main():
             input_image, source_image, output_scale = process_input(
                 input_image, scale_factor, output_stride)
 
-            pose_scores, keypoint_scores, keypoint_coords = run_model(input_image, model, output_stride, output_scale)
+            pose_scores, keypoint_scores, keypoint_coords = run_model(input_image, model, output_stride, output_scale, torch_decode=torch_decode)
             print_frame(source_image, pose_scores, keypoint_scores, keypoint_coords, output_dir, filename=filename, min_part_score=min_part_score, min_pose_score=min_pose_score)
         else:
             st.sidebar.warning("Please upload an image.")
@@ -185,7 +187,7 @@ def main():
                 selected_image, scale_factor=scale_factor, output_stride=output_stride)
 
             filename = os.path.basename(selected_image)
-            result_image, pose_scores, keypoint_scores, keypoint_coords = run_model(input_image, draw_image, model, output_stride, output_scale)
+            result_image, pose_scores, keypoint_scores, keypoint_coords = run_model(input_image, draw_image, model, output_stride, output_scale, torch_decode=torch_decode)
             print_frame(result_image, pose_scores, keypoint_scores, keypoint_coords, output_dir, filename=selected_image, min_part_score=min_part_score, min_pose_score=min_pose_score)
 
         
@@ -203,17 +205,18 @@ def process_input(source_img, scale_factor=1.0, output_stride=16):
     input_img = input_img.transpose((2, 0, 1)).reshape(1, 3, target_height, target_width)
     return input_img, source_img, scale
 
-def run_model(input_image, model, output_stride, output_scale):
+def run_model(input_image, model, output_stride, output_scale, torch_decode=False):
 
     with torch.no_grad():
-        input_image = torch.Tensor(input_image).cuda()
+        input_image = posenet.to_input_tensor(input_image, next(model.parameters()).device)
 
         heatmaps_result, offsets_result, displacement_fwd_result, displacement_bwd_result = model(input_image)
             
         # st.text("model heatmaps_result shape: {}".format(heatmaps_result.shape))
         # st.text("model offsets_result shape: {}".format(offsets_result.shape))
 
-        pose_scores, keypoint_scores, keypoint_coords, pose_offsets = posenet.decode_multi.decode_multiple_poses(
+        decode = decode_multiple_poses_torch if torch_decode else decode_multiple_poses
+        pose_scores, keypoint_scores, keypoint_coords, pose_offsets = decode(
             heatmaps_result.squeeze(0),
             offsets_result.squeeze(0),
             displacement_fwd_result.squeeze(0),
@@ -29,7 +29,9 @@ import matplotlib.pyplot as plt
 from ground_truth_dataloop import *
 from posenet.decode_multi import *
 from visualizers import *
-from scipy.optimize import linear_sum_assignment
+from training_callbacks import BackgroundWorker, CallbackList, HeatmapDumpCallback, DecodeCallback
+from packed_dataset import PackedDataset
+from posenet.evaluation import PoseEvaluator, evaluate_keypoints
 import wandb
 import torch.optim as optim
 import numpy as np
@@ -47,6 +49,12 @@ parser.add_argument('--train_image_dir', type=str, default='./images_train')
 parser.add_argument('--test_image_dir', type=str, default= "./images_train")
 parser.add_argument('--output_dir', type=str, default='./output')
 parser.add_argument('--scale_factor', type=float, default=1.0)
+parser.add_argument('--callback_every', type=int, default=50, help='training steps between heatmap dumps, decodes and metrics')
+parser.add_argument('--train_pack', type=str, default=None, help='packed ground truth of the training images, see packed_dataset.py. '
+                    'With a pack written with --images, the decoded keypoint images are drawn on the resized network input '
+                    'instead of the full size image')
+parser.add_argument('--test_pack', type=str, default=None, help='packed ground truth of the test images, same as --train_pack')
+posenet.add_device_args(parser)
 
 
 args = parser.parse_args()
@@ -84,359 +92,98 @@ class MultiPersonHeatmapOffsetAggregationLoss(nn.Module):
 
 
     def create_mask(self, ground_truth, threshold=0.1):
-        # Threshold the ground truth heatmaps to create a binary mask
-        mask = (ground_truth > threshold).float()
-
-        # Apply dilation to create a disk-like region around each keypoint
-        padding = self.radius
-        kernel_size = 2 * self.radius + 1
-        mask = F.max_pool2d(mask, kernel_size, stride=1, padding=padding)
-
-        mask = mask.cuda()
-        
-        return mask
+        # Threshold the ground truth heatmaps and dilate them into a disk-like region around each keypoint
+        return create_offset_masks(ground_truth, self.radius, threshold).float()
 
 
     def create_binary_target_heatmap(self, target_heatmaps, target_keypoints, radius=3):
-        #TODO: check if binary target heatmaps is in the right shape and if it should be zeros_like
-        binary_target_heatmaps = torch.zeros_like(target_heatmaps)
-
-#         print("target_heatmaps shape: ", target_heatmaps.shape)
-#         print("target_keypoints shape: ", target_keypoints.shape)
-
-        for k in range(target_keypoints.shape[0]):
-
-            x, y = target_keypoints[k, 0], target_keypoints[k, 1]
-            # print("x: ", x)
-            # print("y: ", y)
-            
-            if (x != 0 and x != -1) or (y != 0 and y != -1):
-                x, y = int(x.item()), int(y.item())
-                y_min, y_max = max(0, y - radius), min(binary_target_heatmaps.shape[1], y + radius + 1)
-                x_min, x_max = max(0, x - radius), min(binary_target_heatmaps.shape[2], x + radius + 1)
-
-                y_indices, x_indices = np.mgrid[y_min:y_max, x_min:x_max]
-                y_indices, x_indices = torch.tensor(y_indices), torch.tensor(x_indices)
-                distances = torch.sqrt((y_indices - y)**2 + (x_indices - x)**2)
-
-                binary_target_heatmaps[k, y_min:y_max, x_min:x_max] = (distances <= radius).float()
+        height, width = target_heatmaps.shape[-2:]
+        return create_binary_target_heatmaps(target_keypoints, height, width, radius).to(target_heatmaps.dtype)
+
+    def forward(self, pred_heatmaps, target_heatmaps, target_keypoints, pred_offsets, target_offsets, max_num_poses = 15,
+                binary_target_heatmaps=None, masks=None, valid=None):
+        """
+        Loss of a whole batch in one pass, for any heatmap size, number of poses and device.
+
+        Args:
+            pred_heatmaps: Predicted heatmap logits, (B, 17, H, W)
+            target_heatmaps: Ground truth heatmaps, (B, P, 17, H, W)
+            target_keypoints: Ground truth keypoints, (B, P, 17, 2), -1 for the padding poses
+            pred_offsets: Predicted offsets, (B, 34, H, W)
+            binary_target_heatmaps, masks: Precomputed by PosenetDatasetImage, (B, P, 17, H, W), built here when None
+            valid: (B, P) mask of the poses that are people, by default the poses with any keypoint set
+            A single item without the batch dimension is accepted as well.
+
+        Returns:
+            loss, heatmap_loss, offset_loss averaged over the people of each item and over the batch,
+            and the binary target heatmaps
+        """
+        if pred_heatmaps.dim() == 3:
+            pred_heatmaps, target_heatmaps, target_keypoints, pred_offsets = (
+                pred_heatmaps[None], target_heatmaps[None], target_keypoints[None], pred_offsets[None])
+            binary_target_heatmaps = None if binary_target_heatmaps is None else binary_target_heatmaps[None]
+            masks = None if masks is None else masks[None]
+            valid = None if valid is None else valid[None]
+
+        batch_size, num_keypoints, height, width = pred_heatmaps.shape
+
+        # binary targets and masks are precomputed by PosenetDatasetImage, built here only when not passed in
+        if binary_target_heatmaps is None:
+            binary_target_heatmaps = self.create_binary_target_heatmap(target_heatmaps, target_keypoints, self.radius)
+        if masks is None:
+            masks = self.create_mask(target_heatmaps)
+        binary_target_heatmaps = binary_target_heatmaps.float()
+        masks = masks.float()
+
+        # People are weighted in by the valid mask rather than looped over, so the loss never syncs with the host
+        if valid is None:
+            valid = (target_keypoints != -1).flatten(2).any(dim=2)
+        valid = valid.float()
+        num_people = valid.sum(dim=1).clamp(min=1)
+
+        # Heatmap loss, the BCE of every pose of every item at once
+        pose_heatmap_loss = F.binary_cross_entropy_with_logits(
+            pred_heatmaps[:, None].expand_as(binary_target_heatmaps), binary_target_heatmaps, reduction='none').flatten(2).mean(dim=2)
+        heatmap_loss = ((pose_heatmap_loss * valid).sum(dim=1) / num_people).mean()
+
+        # Offset loss, only around the keypoints. Offsets turn to shape [B, 1, 17, H, W, 2] against [B, P, 17, H, W, 2]
+        pred_offsets = pred_offsets.view(batch_size, num_keypoints, 2, height, width).permute(0, 1, 3, 4, 2)[:, None]
+        ground_truth_offset_maps = create_ground_truth_offset_maps(target_keypoints, height=height, width=width)
+        mask = masks.unsqueeze(-1)
+        masked_true_offsets = ground_truth_offset_maps * mask
+        masked_pred_offsets = pred_offsets * mask
+        pose_offset_loss = self.smoothl1loss(masked_pred_offsets, masked_true_offsets).flatten(2).mean(dim=2)
+        offset_loss = ((pose_offset_loss * valid).sum(dim=1) / num_people).mean()
+
+        loss = (self.heatmap_weight * heatmap_loss + self.offset_weight * offset_loss) / (self.heatmap_weight + self.offset_weight)
 
-        return binary_target_heatmaps
-
-    def forward(self, pred_heatmaps, target_heatmaps, target_keypoints, pred_offsets, target_offsets, max_num_poses = 15):
-        device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-        
-        binary_target_heatmaps = torch.zeros_like(target_heatmaps)
-        # Heatmap loss
-        
-        
-        loss = 0.0
-        
-        #TODO update num_people logic
-        # print("--target keypoints --")
-        # print("target keypoints shape: ", target_keypoints.shape)
-        
-        num_people = count_people(target_keypoints)
-        print("**count_people num_people: *", num_people)
-        
-        heatmap_loss = torch.tensor(0.0).cuda()
-        offset_loss = torch.tensor(0.0).cuda()
-
-        pred_offsets = pred_offsets.view(1, 17, 2, 33, 33).permute(0, 1, 3, 4, 2)
-        # print("pred_offsets_shape: ", pred_offsets.shape)
-        ground_truth_offset_maps = create_ground_truth_offset_maps(target_keypoints, height=33, width=33, max_num_poses=max_num_poses)
-        
-        
-
-        for pose in range(num_people):
-            # Heatmap loss 
-                        
-            binary_target_heatmaps[pose, :, :, :] = self.create_binary_target_heatmap(target_heatmaps[pose], target_keypoints[pose], self.radius)
-            
-            pose_heatmap_loss = self.bceloss(pred_heatmaps, binary_target_heatmaps[pose].float())
-            
-            #             print("pred_heatmaps shape: ", pred_heatmaps.shape)
-#             print("binary_target_heatmaps shape: ", binary_target_heatmaps.shape)
-#             print("target_heatmaps shape: ", target_heatmaps.shape)
-            
-            heatmap_loss += pose_heatmap_loss.cuda()
-            print("in pose loop: heatmap_loss value: ", heatmap_loss)
-            
-            # Offset Loss
-            # Ground truth offsets will turn to shape [15, 17, 33, 33, 2]
-            # print("target_keypoints shape: ", target_keypoints.shape)
-            
-            mask = self.create_mask(target_heatmaps[pose])
-            
-            mask = mask.unsqueeze(-1)
-            
-            
-            
-            print("&&&&loss&&&&")
-            print("mask shape: ", mask.shape)
-            print("ground_truth_offset_maps[pose] shape: ", ground_truth_offset_maps[pose].shape)
-            print("pred_offsets shape: ", pred_offsets.shape)
-            
-            masked_true_offsets = ground_truth_offset_maps[pose] * mask
-            masked_pred_offsets = pred_offsets * mask
-            
-            
-            offset_loss += self.smoothl1loss(masked_pred_offsets, masked_true_offsets).mean()
-            print("in pose loop: offset_loss value: ", offset_loss)
-            
-        
-        
-        heatmap_loss /= num_people
-        offset_loss = offset_loss / num_people
-        
-        print("ground_truth_offset_maps shape: ", ground_truth_offset_maps.shape)    
-
-        loss += (self.heatmap_weight * heatmap_loss + self.offset_weight * offset_loss) / (self.heatmap_weight + self.offset_weight)
-            
         return loss, heatmap_loss, offset_loss, binary_target_heatmaps
 
 
-def match_poses(preds, gts):
-    """
-    Match predicted poses to ground truth poses based on Euclidean distance of keypoints.
-
-    Args:
-        preds: Predicted keypoints, a numpy array of size (num_preds, num_keypoints, 2)
-        gts: Ground truth keypoints, a numpy array of size (num_gts, num_keypoints, 2)
-
-    Returns:
-        matched_pairs: List of pairs of indices (pred_index, gt_index) for matched poses
-    """
-    preds_cpu = preds.cpu().numpy()
-    gts_cpu = gts.cpu().numpy()
-    
-    # Compute pairwise distance between all preds and gts
-    cost_matrix = np.zeros((len(preds_cpu), len(gts_cpu)))
-    for i, pred in enumerate(preds_cpu):
-        for j, gt in enumerate(gts_cpu):
-            cost_matrix[i, j] = np.linalg.norm(pred - gt)
-
-    # Use Hungarian Algorithm to find optimal match
-    row_ind, col_ind = linear_sum_assignment(cost_matrix)
-
-    # All pairs are considered as matched pairs
-    matched_pairs = list(zip(row_ind, col_ind))
-    
-    print("matched_pairs length: ", len(matched_pairs))
-    print(matched_pairs)
-
-    return matched_pairs
-
-def calculate_oks(matched_pairs, preds, gts, sigmas, variances, image_size):
-    """
-    Calculate Object Keypoint Similarity (OKS) for matched pairs.
-
-    Args:
-        matched_pairs: List of pairs of indices (pred_index, gt_index) for matched poses
-        preds: Predicted keypoints, a numpy array of size (num_preds, num_keypoints, 2)
-        gts: Ground truth keypoints, a numpy array of size (num_gts, num_keypoints, 2)
-        sigmas: A numpy array of standard deviations for the positions of each keypoint
-        vars: A numpy array of the variances for each keypoint (typically, this is just square of sigmas)
-        image_size: The size of the image (height, width)
-
-    Returns:
-        oks: The OKS score
-    """
-    oks = 0
-    
-    preds_cpu = preds.cpu().numpy()
-    gts_cpu = gts.cpu().numpy()
-    
-    image_size = float(image_size)
-    preds_cpu = preds_cpu.astype(np.float64)
-    gts_cpu = gts_cpu.astype(np.float64)
-    
-    
-    for i, j in matched_pairs:
-        print("sigmas: ", sigmas)
-        print("variances: ", variances)
-        # Euclidean distance between predicted and ground truth keypoints
-        d = np.linalg.norm(preds_cpu[i] - gts_cpu[j])
-        print("d: ", d)
-        
-        exp = np.exp(-d**2 / (2 * variances * (sigmas**2)))
-        print("exp: ", exp)
-        # Compute OKS for each keypoint and sum them up
-        oks += np.sum( exp / len(preds_cpu[i]))
-        
-    # Average OKS over all matched pairs
-    oks = len(matched_pairs) if len(matched_pairs) > 0 else 0
-    
-    print("oks: ", oks)
-
-    return oks
-
-
-def calculate_precision(preds, gts, threshold = 2):
-    
-    """
-    Calculate the precision of predicted keypoints compared to ground truth keypoints.
-    A predicted keypoint is considered correct (true positive) if it is within 'threshold'
-    distance of a ground truth keypoint. Any predicted keypoint not within 'threshold'
-    distance of any ground truth keypoint is considered a false positive.
-
-    Args:
-        preds: Predicted keypoints, a numpy array of size (num_preds, num_keypoints, 2)
-        gts: Ground truth keypoints, a numpy array of size (num_gts, num_keypoints, 2)
-        threshold: The maximum distance for a predicted keypoint to be considered correct
-
-    Returns:
-        precision: The precision of the predictions
-    """
-        
-    num_true_positives = 0
-    num_false_positives = 0
-    
-    matched_pairs = match_poses(preds, gts)
-    
-    for pair in matched_pairs:
-        pred_idx, gt_idx = pair
-        pred_pose = normalize_keypoints(preds[pred_idx]).cpu().numpy()
-        gt_pose = normalize_keypoints(gts[gt_idx]).cpu().numpy()
-
-        
-        for pred_keypoint, gt_keypoint in zip(pred_pose, gt_pose):
-            # Skip keypoints with values (0,0) or (-1,-1) in ground truth keypoints
-            if np.all(gt_keypoint == [0, 0]) or np.all(gt_keypoint == [-1, -1]):
-                if np.all(pred_keypoint != [0, 0]) and np.all(pred_keypoint != [-1, -1]):
-                    # This is a false positive - predicted but not in ground truth
-                    num_false_positives += 1
-                    print("false positive by gt no point detected")
-                continue
-
-            # For predicted keypoints, count true positives and false positives
-            if np.linalg.norm(pred_keypoint - gt_keypoint) <= threshold:
-                num_true_positives += 1
-                print("true positive")
-                print("np.linalg.norm(pred_keypoint - gt_keypoint):  ", np.linalg.norm(pred_keypoint - gt_keypoint))
-            else:
-                print("false positive")
-                print("np.linalg.norm(pred_keypoint - gt_keypoint):  ", np.linalg.norm(pred_keypoint - gt_keypoint))
-                num_false_positives += 1
-
-    precision = num_true_positives / (num_true_positives + num_false_positives) if num_false_positives + num_false_positives > 0 else 0
-    
-    
-    print("num_false_positives: ", num_false_positives)
-    print("num_true_positives: ", num_true_positives)
-    print("precision: ", precision)
-    
-    return precision
-
-
-def calculate_recall(preds, gts, threshold=2.0):
-    """
-    Calculate recall for predicted keypoints against ground truth keypoints.
-
-    Args:
-        preds: Predicted keypoints, a numpy array of size (num_preds, num_keypoints, 2)
-        gts: Ground truth keypoints, a numpy array of size (num_gts, num_keypoints, 2)
-        threshold: The maximum Euclidean distance between a predicted keypoint and a ground truth keypoint for the prediction to be considered correct.
-
-    Returns:
-        recall: The recall of the predicted keypoints.
-    """
-    matched_pairs = match_poses(preds, gts)
-    
-    num_true_positives = 0
-    num_false_negatives = 0
-
-    for pred_index, gt_index in matched_pairs:
-        pred_pose = normalize_keypoints(preds[pred_index]).cpu().numpy()
-        gt_pose = normalize_keypoints(gts[gt_index]).cpu().numpy()
-        
-
-        for pred_keypoint, gt_keypoint in zip(pred_pose, gt_pose):
-            
-            if (gt_keypoint == np.array([-1, -1])).all() or (gt_keypoint == np.array([0, 0])).all():
-                continue
-            elif (pred_keypoint == np.array([-1, -1])).all() or (pred_keypoint == np.array([0, 0])).all():
-                num_false_negatives += 1
-                print("false negative")
-            elif np.linalg.norm(pred_keypoint - gt_keypoint) <= threshold:
-                num_true_positives += 1
-                print("true positive")
-                print("np.linalg.norm(pred_keypoint - gt_keypoint): ", np.linalg.norm(pred_keypoint - gt_keypoint))
-            else:
-                num_false_negatives += 1
-                print("false negative")
-                print("np.linalg.norm(pred_keypoint - gt_keypoint): ", np.linalg.norm(pred_keypoint - gt_keypoint))
-
-    recall = num_true_positives / (num_true_positives + num_false_negatives)
-    print("num_true_positives: ", num_true_positives)
-    print("num_false_negatives: ", num_false_negatives)
-    print("recall: ", recall)
-    return recall
-
-
-
-def normalize_keypoints(keypoints):
-    """
-    Normalize keypoints by subtracting the mean and dividing by the standard deviation.
-
-    Args:
-        keypoints: Keypoints to normalize, a tensor of size (num_keypoints, 2)
-
-    Returns:
-        normalized_keypoints: Normalized keypoints
-    """
-    keypoints = keypoints.float()
-    mean = keypoints.mean(dim=0, keepdim=True)
-    std = keypoints.std(dim=0, keepdim=True)
-    normalized_keypoints = (keypoints - mean) / std
-
-    return normalized_keypoints
-
-def calculate_mAP(precisions, recalls):
-    """
-    Calculate the Mean Average Precision (mAP).
-
-    Args:
-        precisions: List of precision values
-        recalls: List of recall values
-
-    Returns:
-        mAP: The Mean Average Precision
-    """
-
-    # Sort by recall
-    sorted_indices = np.argsort(recalls)
-    sorted_precisions = precisions[sorted_indices]
-    sorted_recalls = recalls[sorted_indices]
-    
-    # Append sentinel values at the end
-    sorted_precisions = np.concatenate(([0], sorted_precisions, [0]))
-    sorted_recalls = np.concatenate(([0], sorted_recalls, [1]))
-
-    # Compute the precision envelope
-    for i in range(sorted_precisions.size - 1, 0, -1):
-        sorted_precisions[i - 1] = max(sorted_precisions[i - 1], sorted_precisions[i])
-
-    # Compute Average Precision (AP)
-    recall_change = np.diff(sorted_recalls)
-    precision_change = sorted_precisions[:-1]
-    AP = np.sum(recall_change * precision_change)
-
-    return AP
-
-
 class PosenetDatasetImage(Dataset):
-    def __init__(self, file_path, ground_truth_keypoints_dir=None, scale_factor=1.0, output_stride=16, train=True):
+    def __init__(self, file_path, ground_truth_keypoints_dir=None, scale_factor=1.0, output_stride=16, train=True, device=None, pack_path=None):
         self.file_path = file_path
+        self.device = device if device is not None else posenet.select_device()
         self.scale_factor = scale_factor
         self.output_stride = output_stride
-        self.filenames = os.listdir(file_path)
         self.train = train
         self.ground_truth_keypoints_dir = ground_truth_keypoints_dir
-        
-        if ground_truth_keypoints_dir:
+        self.pack = None
+        
+        if pack_path:
+            # nothing is loaded up front, __getitem__ reads its item from the memory mapped pack
+            self.pack = PackedDataset(pack_path)
+            if 'heatmaps' not in self.pack.arrays:
+                raise ValueError("%s has no training targets, pack it again with packed_dataset.py" % pack_path)
+            settings = self.pack.header['settings']
+            self.packed_images = self.pack.has_images and (settings['scale_factor'], settings['output_stride']) == (scale_factor, output_stride)
+            self.is_ground_truth = True
+            # so the whole dataset tensors below are not built
+            ground_truth_keypoints_dir = None
+        elif ground_truth_keypoints_dir:
+            self.filenames = os.listdir(file_path)
             image_file_names = [os.path.splitext(file)[0] for file in self.filenames if file.endswith((".jpg", ".png"))]
-            self.keypoints, self.heatmaps, self.offset_vectors = load_ground_truth_data(image_file_names, self.ground_truth_keypoints_dir)
+            self.keypoints, self.heatmaps, self.offset_vectors = load_ground_truth_data(image_file_names, self.ground_truth_keypoints_dir, device=self.device)
             # print("--inside dataset class init --")
             # print("keypoints shape: ", self.keypoints.shape)
             # print("heatmaps shape: ", self.heatmaps.shape)
@@ -452,8 +199,12 @@ class PosenetDatasetImage(Dataset):
             self.is_ground_truth = False
 
         
-        self.data = [f.path for f in os.scandir(file_path) if f.is_file() and f.path.endswith(('.png', '.jpg'))]
-        self.filenames = [os.path.basename(file_path) for file_path in self.data]
+        if self.pack is not None:
+            self.filenames = list(self.pack.filenames)
+            self.data = [os.path.join(file_path, filename) for filename in self.filenames]
+        else:
+            self.data = [f.path for f in os.scandir(file_path) if f.is_file() and f.path.endswith(('.png', '.jpg'))]
+            self.filenames = [os.path.basename(file_path) for file_path in self.data]
 
         if  self.train:
             self.transforms = transforms.Compose([
@@ -473,9 +224,9 @@ class PosenetDatasetImage(Dataset):
             ])
             
             if ground_truth_keypoints_dir:
-                self.keypoints = torch.Tensor(self.keypoints).cuda().requires_grad_(False)
-                self.heatmaps = torch.Tensor(self.heatmaps).cuda().requires_grad_(False)
-                self.offset_vectors = torch.Tensor(self.offset_vectors).cuda().requires_grad_(False)
+                self.keypoints = torch.Tensor(self.keypoints).to(self.device).requires_grad_(False)
+                self.heatmaps = torch.Tensor(self.heatmaps).to(self.device).requires_grad_(False)
+                self.offset_vectors = torch.Tensor(self.offset_vectors).to(self.device).requires_grad_(False)
             
         else:
             self.transforms = transforms.Compose([
@@ -484,6 +235,11 @@ class PosenetDatasetImage(Dataset):
                 transforms.Normalize(mean=[5.4476, 8.3573, 7.5377], std=[3.6566, 3.5510, 4.0362])
             ])
 
+        if ground_truth_keypoints_dir:
+            # Binary targets and offset masks never change between epochs, so they are built once for the whole dataset
+            self.binary_heatmaps = create_binary_target_heatmaps(self.keypoints, *self.heatmaps.shape[-2:])
+            self.offset_masks = create_offset_masks(self.heatmaps)
+
 
     def __len__(self):
         return len(self.filenames)
@@ -495,11 +251,18 @@ class PosenetDatasetImage(Dataset):
         # print("____getitem____ filename: ", filename)
         
         # print("get_item: ", filename)
-        input_image, draw_image, output_scale = posenet.read_imgfile(
-            os.path.join(self.file_path, filename),
-            scale_factor=self.scale_factor,
-            output_stride=self.output_stride
-        )
+        if self.pack is not None and self.packed_images:
+            # already resized when packed, only normalized here
+            image, output_scale = self.pack.image(idx)
+            input_image, _, _ = posenet.get_preprocessor(1.0, self.output_stride)(image, reuse=False)
+            # draw_image is the resized image here, not the full size one, see --train_pack
+            draw_image, output_scale = np.array(image), np.array(output_scale)
+        else:
+            input_image, draw_image, output_scale = posenet.read_imgfile(
+                os.path.join(self.file_path, filename),
+                scale_factor=self.scale_factor,
+                output_stride=self.output_stride
+            )
         
         # print("----input image: ----")
         # print(input_image)
@@ -507,30 +270,50 @@ class PosenetDatasetImage(Dataset):
         # print(filename)
         # print(input_image.shape)
         
-        input_image_tensor = torch.Tensor(input_image).cuda()
+        input_image_tensor = torch.Tensor(input_image).to(self.device)
         
         #print("Tensor shape: ", input_image_tensor.shape[-2:])
         if input_image_tensor.shape[-2:] != (513, 513):
             input_image_resized = nn.functional.interpolate(input_image_tensor, size=(513, 513), mode='bilinear', align_corners=True)
             # print(f"Resized image {filename}: ", input_image_resized.shape)
         
-        if self.is_ground_truth:
+        if self.pack is not None:
+            keypoints, heatmaps, offset_vectors, binary_heatmaps, offset_masks = self.packed_ground_truth(idx)
+            
+            return input_image_tensor, draw_image, output_scale, filename, keypoints, heatmaps, offset_vectors, binary_heatmaps, offset_masks
+        
+        elif self.is_ground_truth:
             # print("print length of keypoints: ", len(self.keypoints))
             keypoints = self.keypoints[idx]
             heatmaps = self.heatmaps[idx]
             offset_vectors = self.offset_vectors[idx]
+            binary_heatmaps = self.binary_heatmaps[idx]
+            offset_masks = self.offset_masks[idx]
             
-            return input_image_tensor, draw_image, output_scale, filename, keypoints, heatmaps, offset_vectors
+            return input_image_tensor, draw_image, output_scale, filename, keypoints, heatmaps, offset_vectors, binary_heatmaps, offset_masks
                 
         else:
             return input_image_tensor, draw_image, output_scale, filename
 
+    def packed_ground_truth(self, idx, max_poses=15):
+        # the tensors load_ground_truth_data and __init__ build for the whole dataset, for one item of the pack,
+        # the targets were built when packing and are only padded here
+        keypoints, offset_vectors = self.pack.ground_truth(idx)
+        heatmaps, binary_heatmaps, offset_masks = self.pack.targets(idx)
+        ground_truth = pad_ground_truth(keypoints, offset_vectors, heatmap_shape=heatmaps.shape[-2:], max_poses=max_poses, heatmaps=heatmaps)
+        masks = np.zeros((2, max_poses) + binary_heatmaps.shape[1:], dtype=bool)
+        masks[0, :len(keypoints)] = binary_heatmaps
+        masks[1, :len(keypoints)] = offset_masks
+        keypoints, heatmaps, offset_vectors, binary_heatmaps, offset_masks = [
+            torch.from_numpy(array).to(self.device) for array in ground_truth + (masks[0], masks[1])]
+        return keypoints, heatmaps, offset_vectors, binary_heatmaps, offset_masks
+
 def get_dataset_mean_std(dataset):
     # Calculate the mean and standard deviation for each channel
     mean = torch.zeros(3)
     std = torch.zeros(3)
     
-    for i, (input_image_tensor, draw_image, _, _, _, _, _) in enumerate(dataset):
+    for i, (input_image_tensor, draw_image, _, _, _, _, _, _, _) in enumerate(dataset):
         # print("number of outputs of dataset: ", len(next(iter(dataset))))
         # print("draw_image type: ", type(draw_image))
         # print("draw_image shape: ", draw_image.shape)
@@ -551,14 +334,13 @@ def get_dataset_mean_std(dataset):
 
 
 def create_ground_truth_offset_maps(ground_truth_keypoints, height, width, scale_factor=8, max_num_poses=15):
-    ground_truth_keypoints = ground_truth_keypoints.cuda()
+    # ground_truth_keypoints: (..., NUM_KEYPOINTS, 2) for any leading batch and pose dimensions
+    device = ground_truth_keypoints.device
 
-    ground_truth_offset_maps = torch.zeros((max_num_poses, NUM_KEYPOINTS, height, width, 2), dtype=torch.float32).cuda()
-    
-    y_coords, x_coords = torch.meshgrid(torch.arange(height), torch.arange(width))
-    y_coords, x_coords = (y_coords * scale_factor).cuda(), (x_coords * scale_factor).cuda()
+    y_coords, x_coords = torch.meshgrid(torch.arange(height, device=device), torch.arange(width, device=device))
+    y_coords, x_coords = y_coords * scale_factor, x_coords * scale_factor
 
-    ground_truth_keypoints_expanded = ground_truth_keypoints.view(max_num_poses, NUM_KEYPOINTS, 1, 1, 2)
+    ground_truth_keypoints_expanded = ground_truth_keypoints[..., None, None, :]
 
     ground_truth_offset_maps = ground_truth_keypoints_expanded - torch.stack((y_coords, x_coords), dim=-1)
     # print("--inside create ground truth offsets --")
@@ -575,7 +357,7 @@ def create_ground_truth_offset_maps(ground_truth_keypoints, height, width, scale
 #         f.write(f"pose score: {pose_scores[pose_idx]}")
 #         f.write("\n")  # Separate epochs with a new line
 
-def train(model, train_loader, test_loader, criterion, optimizer, num_epochs, output_stride, train_image_path, test_image_path, output_dir, scale_factor, is_train=True, max_num_poses=15):
+def train(model, train_loader, test_loader, criterion, optimizer, num_epochs, output_stride, train_image_path, test_image_path, output_dir, scale_factor, is_train=True, max_num_poses=15, callbacks=None):
     step = 0
     score_threshold = 0.25
     train_num_batches = len(train_loader)
@@ -585,12 +367,16 @@ def train(model, train_loader, test_loader, criterion, optimizer, num_epochs, ou
     patience = 10  # Number of epochs to wait for improvement before stopping
     no_improve_epochs = 0
     
-    # TODO : find the sigmas and variances of the dataset 
-    # typically it is given by COCO Dataset 
-    # sigmas = np.ones(17)
-    
-    sigmas = np.array([.26, .25, .25, .35, .35, .79, .79, .72, .72, .62,.62, 1.07, 1.07, .87, .87, .89, .89])
-    variances = sigmas**2
+    device = next(model.parameters()).device
+
+    # Heatmap dumps, decoding, drawing and metrics run in a background worker, every few steps
+    if callbacks is None:
+        callbacks = default_callbacks(output_stride, train_image_path, test_image_path, output_dir, scale_factor)
+    callbacks = CallbackList(callbacks)
+    worker = BackgroundWorker()
+    callbacks.on_train_begin(worker)
+    # metrics the worker sent back that were not logged yet
+    pending_results = []
     
     for epoch in range(num_epochs):
         
@@ -640,147 +426,39 @@ def train(model, train_loader, test_loader, criterion, optimizer, num_epochs, ou
         
             # print("train loader: ", next(iter(train_loader)))
 
-            for batch_idx, (data, draw_image, output_scale, filenames, ground_truth_keypoints, ground_truth_heatmaps, ground_truth_offsets) in enumerate(train_loader):
+            for batch_idx, (data, draw_image, output_scale, filenames, ground_truth_keypoints, ground_truth_heatmaps, ground_truth_offsets, ground_truth_binary_heatmaps, ground_truth_masks) in enumerate(train_loader):
                 # print("ENUMERATE")
                 
                 # Backward pass
                 optimizer.zero_grad()
                 # print("batch size: ", train_loader.batch_size)
             
-                data.cuda()
+                data = data.to(device)
                 # print("data shape: ", data.shape)
     
-                data_squeezed = data.squeeze()
+                data_squeezed = data.squeeze(1)
         
                 # print("data_squeezed shape: ", data_squeezed.shape)
                 output = model(data_squeezed)
-                
-                
-                batch_loss = 0
-                batch_mAP = 0
-                batch_oks = 0
-                
-                #heatmap tensor = output[0] 
-                #heatmap size is num of images x 17 keypoints x resolution x resolution 
-                #eg. if image size is 225 with output stride of 16, then resolution is 15 
-                #iterate through the batch size
-                print("--filenames--")
-                print(filenames)
-                print(output[0].shape)
-                
-                
-                for item_idx, item in enumerate(output[0]):
-                    
-                    
-                    offsets = output[1][item_idx]
-                    displacements_fwd = output[2][item_idx]
-                    displacements_bwd = output[2][item_idx]
 
-                    train_heatmaps = item
-                    
-                    filename = filenames[item_idx]
-                    heatmaps_dir = "pred_heatmaps_training"
-                    
-                    save_heatmaps(train_heatmaps.detach().cpu().numpy(), filename, 0, num_keypoints=17, heatmaps_dir=heatmaps_dir, epoch=epoch)
-                    
-                    
-                    
-                    # print("item (heatmap) type: ", type(item))
-                    
-                    height = train_heatmaps.shape[1]
-                    width = train_heatmaps.shape[2]
-                    
-                    # instance_keypoint_coords, instance_keypoint_scores , train_heatmaps, train_offsets = decode_pose_from_batch_item(epoch, train_image_path, filenames[item_idx], item, offsets, scale_factor, height, width, score_threshold, LOCAL_MAXIMUM_RADIUS, output_stride, displacements_fwd, displacements_bwd, is_train)
-                    pose_scores, keypoint_scores, keypoint_coords, decoded_offsets = decode_pose_from_batch_item(epoch, train_image_path, filenames[item_idx], item, offsets, scale_factor, height, width, score_threshold, LOCAL_MAXIMUM_RADIUS, output_stride, displacements_fwd, displacements_bwd, is_train)
-                    # print("---- keypoint_coords: ----")
-                    # print(keypoint_coords)         
-                    
-                    #turn epoch to text
-                    appended_text = "train_" + str(epoch) + "_"
-                    print("pose_scores shape: ", pose_scores.shape)
-                    print("keypoint_scores shape: ", keypoint_scores.shape)
-                    output_dir_epoch = "keypoints_output_" + str(epoch)
-                    
-                    print("draw_image")
-                    print(type(draw_image))
-                    print("draw_image[idx]: ", draw_image[item_idx].shape)
-                    print(draw_image.shape)
-                    draw_image_with_kp = posenet.draw_skel_and_kp(np.array(draw_image[item_idx]), pose_scores, keypoint_scores, keypoint_coords,
-                                                          min_pose_score=0.25, min_part_score=0.25)
-                    
-                    if not os.path.exists(os.path.join('./keypoint_output_training', filename, output_dir_epoch)):
-                        os.makedirs(os.path.join('./keypoint_output_training', filename, output_dir_epoch))
-                    
-                    keypoint_output_dir = os.path.join('./keypoint_output_training', filename, output_dir_epoch, filename + '_keypoints.jpg')
-                
-                    cv2.imwrite(keypoint_output_dir, draw_image_with_kp)
+                # Loss of the whole batch in one pass, scaled by the batch size so it stays the sum of the item losses
+                loss, heatmap_loss, offset_loss, binary_target_heatmaps = criterion(output[0], ground_truth_heatmaps, ground_truth_keypoints, output[1], ground_truth_offsets, max_num_poses=max_num_poses,
+                    binary_target_heatmaps=ground_truth_binary_heatmaps, masks=ground_truth_masks)
+                batch_size = output[0].shape[0]
+                batch_loss = loss * batch_size
 
-                    # write_keypoints_to_file(keypoint_coords, epoch, keypoint_output_dir, pose_scores, keypoint_scores)
+                print('[Train] Epoch [{}/{}], Batch [{}/{}], Loss: {:.4f}'
+                      .format(epoch+1, num_epochs, batch_idx+1, len(train_loader), loss.item()))
 
-                    # draw_coordinates_to_image_file(appended_text, train_image_path, output_dir_epoch, output_stride, scale_factor, pose_scores, keypoint_scores, keypoint_coords, filenames[item_idx], include_displacements=False)
-
-                    decoded_offsets = torch.from_numpy(decoded_offsets)
-                    decoded_offsets = decoded_offsets.to('cuda')
-                    
-                    # print("decoded_offsets: ", decoded_offsets)
-                    print("decoded_offsets shape: ", decoded_offsets.shape)
-
-                    keypoint_coords = torch.from_numpy(keypoint_coords)
-                    keypoint_coords = keypoint_coords.to('cuda')           
-                    
-                    print("offsets shape: ", offsets.shape)
-                    
-
-                    
-
-                    loss, heatmap_loss, offset_loss, binary_target_heatmaps = criterion(train_heatmaps, ground_truth_heatmaps[item_idx] , ground_truth_keypoints[item_idx],  offsets, ground_truth_offsets[item_idx], max_num_poses=max_num_poses)
-                    
-                    print(train_heatmaps.shape)
-                    print(binary_target_heatmaps.shape)
-                    
-                    
-                    print("loss shape: ", loss.shape)
+                running_loss_value += loss.item() * batch_size
+                heatmap_loss_value += heatmap_loss.item() * batch_size
+                offset_loss_value += offset_loss.item() * batch_size
 
-                    print("loss: ", loss)
-
-                    print('[Train] Epoch [{}/{}], Batch [{}/{}], Item [{}/{}], Loss: {:.4f}'
-                          .format(epoch+1, num_epochs, batch_idx+1, len(train_loader), item_idx+1, output[0].shape[0], loss.mean().item()))
-                    
-                    running_loss_value += loss.item()
-                    heatmap_loss_value += heatmap_loss.item()
-                    offset_loss_value += offset_loss.item()
-                    
-                    #todo change the loss
-                    batch_loss += loss
-
-                    # calculate accuracy 
-                    matched_pairs = match_poses(keypoint_coords, ground_truth_keypoints[item_idx])
-                    print("matched_pairs shape: ")
-                    print(matched_pairs)
-                
-                    image_size = draw_image.shape[1]
-                
-                    oks = calculate_oks(matched_pairs, keypoint_coords, ground_truth_keypoints[item_idx], sigmas, variances, image_size)
+                # Decoding, image dumps and metrics run in the callbacks' background worker
+                callbacks.on_batch_end('train', step, epoch, {
+                    "output": tuple(o.detach() for o in output), "draw_image": draw_image, "filenames": filenames,
+                    "ground_truth_keypoints": ground_truth_keypoints, "ground_truth_heatmaps": ground_truth_heatmaps})
                 
-                    thresholds = np.linspace(0.0, 10.0, num=50)
-                    precisions = []
-                    recalls = []
-                    for i, threshold in enumerate(thresholds):
-                        precision = calculate_precision(keypoint_coords, ground_truth_keypoints[item_idx], threshold)
-                        print("precision: ", precision)
-                        recall = calculate_recall(keypoint_coords, ground_truth_keypoints[item_idx], threshold)
-                        print("recall: ", recall)
-                        precisions.append(precision)
-                        recalls.append(recall)
-
-                    
-                    # wandb.log({"epoch": epoch, f"precision_{i}": precision, f"recall_{i}": recall})
-                
-                    mAP = calculate_mAP(np.array(precisions), np.array(recalls))                    
-                    batch_mAP += mAP
-                    batch_oks += oks
-            
-                    
                 batch_loss = batch_loss / len(train_loader)
                 running_loss_value = running_loss_value / len(train_loader)
                 offset_loss_value = offset_loss_value / len(train_loader)
@@ -793,24 +471,18 @@ def train(model, train_loader, test_loader, criterion, optimizer, num_epochs, ou
                     print("train_loss: ", running_loss_value / batch_checkpoint)
                     print("heatmap_loss: ", heatmap_loss_value / batch_checkpoint)
                     print("offset_loss: ", offset_loss_value / batch_checkpoint)
-                    print("mAP: ", batch_mAP / batch_checkpoint)
-                    print("oks: ", batch_oks / batch_checkpoint)
-                    wandb.log({"train_loss": running_loss_value / batch_checkpoint , "heatmap_loss": heatmap_loss_value / batch_checkpoint, "offset_loss": offset_loss_value / batch_checkpoint, "mAP": batch_mAP / batch_checkpoint, "oks": batch_oks/batch_checkpoint, "epoch": epoch + ((batch_idx + 1)/len(train_loader))}, step=step)
+                    logs = {"train_loss": running_loss_value / batch_checkpoint , "heatmap_loss": heatmap_loss_value / batch_checkpoint, "offset_loss": offset_loss_value / batch_checkpoint, "epoch": epoch + ((batch_idx + 1)/len(train_loader))}
+                    # metrics of the items the worker finished since the last checkpoint
+                    pending_results += worker.results()
+                    logs.update(average_metrics(pending_results, 'train'))
+                    print(logs)
+                    wandb.log(logs, step=step)
                     print('[%d, %5d] loss: %.3f' % (epoch + 1, batch_idx + 1, running_loss_value / batch_checkpoint))
                     running_loss_value = 0.0
                     heatmap_loss_value = 0.0
                     offset_loss_value = 0.0
                     
 
-                print(type(precisions)) # should be <class 'list'>
-                print(type(precisions[0])) # should be <class 'float'>
-                print(type(recalls)) # should be <class 'list'>
-                print(type(recalls[0])) # should be <class 'float'>
-                
-                
-                
-
-                
                 batch_loss.backward()
                 optimizer.step()
                 
@@ -825,11 +497,19 @@ def train(model, train_loader, test_loader, criterion, optimizer, num_epochs, ou
 
         with torch.no_grad():
             print("--- with torch no grad ----")
-            for batch_idx, (data, draw_image, output_scale, filenames, ground_truth_keypoints, ground_truth_heatmaps, ground_truth_offsets) in enumerate(test_loader):
-                data.cuda()
-                data_squeezed = data.squeeze()
+            for batch_idx, (data, draw_image, output_scale, filenames, ground_truth_keypoints, ground_truth_heatmaps, ground_truth_offsets, ground_truth_binary_heatmaps, ground_truth_masks) in enumerate(test_loader):
+                data = data.to(device)
+                data_squeezed = data.squeeze(1)
                 # data, target = torch.Tensor(data).cuda(), torch.Tensor(target).cuda()
                 output = model(data_squeezed)
+
+                loss, heatmap_loss, offset_loss, _ = criterion(output[0], ground_truth_heatmaps, ground_truth_keypoints, output[1], ground_truth_offsets, max_num_poses=max_num_poses,
+                    binary_target_heatmaps=ground_truth_binary_heatmaps, masks=ground_truth_masks)
+                test_loss += loss.item() * output[0].shape[0]
+                print("-inside test-")
+                print("heatmap_loss: ", heatmap_loss.item())
+                print("offset_loss: ", offset_loss.item())
+                print("inside batch loss: ", loss.item())
                 
                 # print("**output[0] device: ", output[0].device)
                 # print("**ground truth offsets device: ", ground_truth_offsets.device)
@@ -837,55 +517,18 @@ def train(model, train_loader, test_loader, criterion, optimizer, num_epochs, ou
                 # print("**output[0] shape: ", output[0].shape)
                 
                 
-                #iterate through the batch size
-                for item_idx, item in enumerate(output[0]):
-                                        
-                    offsets = output[1][item_idx]
-                    displacements_fwd = output[2][item_idx]
-                    displacements_bwd = output[3][item_idx]
-                    
-                    test_heatmaps = item
-                    height = test_heatmaps.shape[1]
-                    width = test_heatmaps.shape[2]
-                    
-                    # print("inside item_idx loop offsets shape: ", offsets.shape)
-                    # print("item (heatmap) type: ", type(item))
-                    
-                    pose_scores, keypoint_scores, keypoint_coords, decoded_offsets = decode_pose_from_batch_item(epoch, test_image_path, filenames[item_idx], item, offsets, scale_factor, height, width, score_threshold, LOCAL_MAXIMUM_RADIUS, output_stride, displacements_fwd, displacements_bwd, is_train)
-                    
-                    appended_text = "test_"
-                    
-
-                    draw_coordinates_to_image_file(appended_text, test_image_path, output_dir, output_stride, scale_factor, pose_scores,keypoint_scores, keypoint_coords, filenames[item_idx], include_displacements=False)
-
-                    
-                    decoded_offsets = torch.from_numpy(decoded_offsets)
-                    decoded_offsets = decoded_offsets.to('cuda')
-                    # print("decoded offsets device: ", decoded_offsets.device)
-                    # print("ground truth offsets device: ", ground_truth_offsets[item_idx].device)
-                    
-                    keypoint_coords = torch.from_numpy(keypoint_coords)
-                    keypoint_coords = keypoint_coords.to('cuda')
-                    
-                    # print("keypoint_coords device: ", keypoint_coords.device)
-                    # print("ground_truth_keypoints[item_idx] device: ", ground_truth_keypoints[item_idx].device)
-                    filename = filenames[item_idx]
-                    loss, heatmap_loss, offset_loss, _ = criterion(test_heatmaps, ground_truth_heatmaps[item_idx], ground_truth_keypoints[item_idx], offsets, ground_truth_offsets[item_idx], max_num_poses=max_num_poses)
-                    
-                    save_heatmaps(test_heatmaps.detach().cpu().numpy(), filename, 0, num_keypoints=17, heatmaps_dir="pred_heatmaps_test", epoch=epoch)
-                    
-                    
-                    
-                    test_loss += loss.item()
-                    print("-inside test-")
-                    print("heatmap_loss: ", heatmap_loss.item())
-                    print("offset_loss: ", offset_loss.item())
-                    print("inside batch loss: ", loss.item())
+                callbacks.on_batch_end('test', step, epoch, {
+                    "output": output, "draw_image": draw_image, "filenames": filenames,
+                    "ground_truth_keypoints": ground_truth_keypoints, "ground_truth_heatmaps": ground_truth_heatmaps})
                     
             test_loss /= len(test_loader.dataset)
             test_loss_value = test_loss.item()
             
-            wandb.log({"test_loss": float(test_loss_value)}, step=step)
+            callbacks.on_epoch_end(epoch)
+            # every test item of the epoch is evaluated before its metrics are logged
+            pending_results += worker.results(wait=True)
+            wandb.log({"test_loss": float(test_loss_value), "callback_jobs_dropped": worker.dropped,
+                       **average_metrics(pending_results, 'test', PoseEvaluator())}, step=step)
             print("test_loss_value: ", test_loss_value)
             print("step: ", step)
             
@@ -913,67 +556,47 @@ def train(model, train_loader, test_loader, criterion, optimizer, num_epochs, ou
     avg_epoch_runtime = sum(epoch_durations) / len(epoch_durations)
     wandb.log({"avg epoch runtime (seconds)": avg_epoch_runtime})
     
+    # the test results were all logged with their epoch, what is left are the last training checkpoints' metrics
+    pending_results += worker.close()
+    final_logs = average_metrics(pending_results, 'train')
+    if final_logs:
+        wandb.log(final_logs, step=step)
+    if worker.dropped:
+        print("callback jobs dropped while the worker was busy: ", worker.dropped)
     print('Training Finished')
 
-# Count number of people from ground truth keypoints)
-def count_people(target_keypoints):
-    """
-    Given target keypoints of shape (num_people, num_keypoints, 2), returns the number of people.
-    A person is considered to exist if at least one of their keypoints has a value other than -1.
-    """
-    num_people = 0
-    for i in range(target_keypoints.shape[0]):
-        if torch.any(target_keypoints[i] != -1):
-            num_people += 1
-    return num_people
-
-
-def decode_pose_from_batch_item(epoch, image_path, filename, item, offsets, scale_factor, height, width, score_threshold, LOCAL_MAXIMUM_RADIUS, output_stride, displacements_fwd, displacements_bwd, is_train):
-    heatmaps = item
-    
-
-    # offsets_reshaped = offsets.detach().cpu().numpy().reshape(2, -1, height, width).transpose((1, 2, 3, 0))
-    
-    if is_train:
-        heatmaps = heatmaps.detach()
-        offsets = offsets.detach()
-        displacements_fwd = displacements_fwd.detach()
-        displacements_bwd = displacements_bwd.detach()
-        
-    else:
-        heatmaps = torch.tensor(heatmaps, requires_grad=is_train)
-        
-    # print("---- in decode pose from batch item --- ") 
-    pose_scores, keypoint_scores, keypoint_coords, decoded_offsets = posenet.decode_multi.decode_multiple_poses(
-                heatmaps,
-                offsets,
-                displacements_fwd,
-                displacements_bwd,
-                output_stride=output_stride,
-                max_pose_detections=10,
-                min_pose_score=score_threshold)
-
-    
-    # print("decoded offsets: ", decoded_offsets)
-    
-    # Find the indices of poses with scores above the threshold
-    valid_indices = np.where(pose_scores >= score_threshold)[0]
-
-    # Filter the pose_scores, keypoint_scores, and keypoint_coords using valid_indices
-    pose_scores = pose_scores[valid_indices]
-    keypoint_scores = keypoint_scores[valid_indices]
-    keypoint_coords = keypoint_coords[valid_indices]
-    decoded_offsets = decoded_offsets[valid_indices]
-    
-    # instance_keypoint_scores, instance_keypoint_coords, displacement_vectors = posenet.decode.decode_pose(root_score, root_id, root_image_coord, heatmaps, offsets_reshaped, output_stride, displacements_fwd_reshaped, displacements_bwd_reshaped)
-    
-    appended_text = "after_decode_"
-    output_dir = "output_after_decode"
-
-    draw_coordinates_to_image_file(appended_text, image_path, output_dir, output_stride, scale_factor, pose_scores, keypoint_scores, keypoint_coords, filename, displacements_fwd, displacements_bwd, include_displacements=True)
-                    
-    return pose_scores, keypoint_scores, keypoint_coords, decoded_offsets
-
+# Average the metrics the worker sent back for one split, keyed as they are logged, and take them out of
+# `results`. With `evaluator`, a PoseEvaluator, the counts are merged into it as well and the metrics over all
+# of its images are logged, e.g. over a whole test epoch once the worker was drained
+def average_metrics(results, split, evaluator=None):
+    values = [(epoch, value) for (result_split, _, epoch), value in results if result_split == split]
+    results[:] = [result for result in results if result[0][0] != split]
+    if not values:
+        return {}
+    prefix = "" if split == 'train' else split + "_"
+    logs = {prefix + key: float(np.mean([value[key] for _, value in values])) for key in ("mAP", "oks")}
+    if evaluator is not None:
+        for _, value in values:
+            evaluator.merge(value["counts"])
+        dataset_metrics = evaluator.compute()
+        logs[prefix + "dataset_mAP"] = dataset_metrics["mAP"]
+        logs[prefix + "dataset_oks"] = dataset_metrics["oks"]
+    return logs
+
+
+def default_callbacks(output_stride, train_image_path, test_image_path, output_dir, scale_factor=1.0, every=None):
+    # the artifacts the training loop used to write for every item: heatmap dumps, the training keypoint images,
+    # the "after_decode_" images of both splits and the "test_" images in output_dir
+    every = args.callback_every if every is None else every
+    return [
+        HeatmapDumpCallback(heatmaps_dir="pred_heatmaps", every=every, test_every=every),
+        DecodeCallback(output_stride,
+                       output_dirs={'train': './keypoint_output_training'},
+                       image_files={'train': [("output_after_decode", "after_decode_")],
+                                    'test': [("output_after_decode", "after_decode_"), (output_dir, "test_")]},
+                       image_dirs={'train': train_image_path, 'test': test_image_path},
+                       scale_factor=scale_factor, metrics_fn=evaluate_keypoints, every=every),
+    ]
 
 
 def main():
@@ -993,8 +616,8 @@ def main():
     with wandb.init(project="posenet", config=config, name='PoseNet 101'):
 
         #instatiate model 
-        model = posenet.load_model(args.model)
-        model = model.cuda()
+        device = posenet.select_device(args.device, args.num_threads, args.num_interop_threads)
+        model = posenet.load_model(args.model, device=device)
     
         for param in model.parameters():
             param.requires_grad = True
@@ -1019,8 +642,8 @@ def main():
     
         is_train = True
     
-        train_dataset = PosenetDatasetImage(train_image_path, ground_truth_keypoints_dir, scale_factor=1.0, output_stride=output_stride, train=True)
-        test_dataset = PosenetDatasetImage(test_image_path, ground_truth_keypoints_dir, scale_factor=1.0, output_stride=output_stride, train=True)
+        train_dataset = PosenetDatasetImage(train_image_path, ground_truth_keypoints_dir, scale_factor=1.0, output_stride=output_stride, train=True, device=device, pack_path=args.train_pack)
+        test_dataset = PosenetDatasetImage(test_image_path, ground_truth_keypoints_dir, scale_factor=1.0, output_stride=output_stride, train=True, device=device, pack_path=args.test_pack)
         
         # when you have updated your dataset, print the mean and std and 
         # replace the Dataset normalization transforms  in class PosenetDatasetImage(Dataset) 
@@ -0,0 +1,256 @@
+"""
+Callbacks run by train.py::train, with the slow work (heatmap dumps, decoding, drawing, metrics)
+done in a background worker process so the optimizer step never waits on disk or matplotlib.
+
+A callback picks what it needs from a batch every `every` steps, copies it to numpy and submits a
+job to the worker. Jobs are module level functions so they can be pickled to the worker process.
+"""
+import abc
+import multiprocessing
+import os
+import queue
+import traceback
+
+import cv2
+import numpy as np
+import torch
+
+
+class BackgroundWorker:
+    """
+    One worker process fed through a bounded queue. By default submit() never blocks: when
+    `max_pending` jobs are already waiting the job is dropped and counted, training speed wins over
+    artifacts. Jobs whose results are needed are submitted with block=True and wait for a free slot.
+    Jobs returning something other than None send (tag, value) back, collected by results().
+    """
+
+    def __init__(self, max_pending=32, start_method='spawn'):
+        context = multiprocessing.get_context(start_method)
+        self.jobs = context.Queue(max_pending)
+        self._results = context.Queue()
+        self.dropped = 0
+        self.submitted = 0
+        self.finished = 0
+        self.process = context.Process(target=_worker_loop, args=(self.jobs, self._results), daemon=True)
+        self.process.start()
+
+    def submit(self, tag, function, *args, block=False):
+        while True:
+            try:
+                self.jobs.put((tag, function, args), block=block, timeout=1.0)
+                break
+            except queue.Full:
+                # a blocking submit only gives up if the worker is gone
+                if not block or not self.process.is_alive():
+                    self.dropped += 1
+                    return False
+        self.submitted += 1
+        return True
+
+    def results(self, wait=False):
+        # with wait, returns only once every submitted job has finished (or the worker died)
+        results = []
+        while True:
+            waiting = wait and self.finished < self.submitted
+            try:
+                tag, value = self._results.get(timeout=0.1) if waiting else self._results.get_nowait()
+            except queue.Empty:
+                if waiting and self.process.is_alive():
+                    continue
+                return results
+            self.finished += 1
+            if value is not None:
+                results.append((tag, value))
+
+    def close(self):
+        # waits for the pending jobs, the results they send are kept for a last results() call
+        results = self.results(wait=True)
+        self.jobs.put(None)
+        self.process.join()
+        return results
+
+
+def _worker_loop(jobs, results):
+    # every job reports back, with None when it has no result or failed, so results(wait=True) can count them
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        tag, function, args = job
+        value = None
+        try:
+            value = function(*args)
+        except Exception:
+            traceback.print_exc()
+        results.put((tag, value))
+
+
+class Callback:
+    """
+    Base class, every hook is a no-op. `batch` is a dict with the model `output` tuple and the
+    loader fields: draw_image, filenames, ground_truth_keypoints and ground_truth_heatmaps.
+    """
+
+    def on_train_begin(self, worker):
+        self.worker = worker
+
+    def on_batch_end(self, split, step, epoch, batch):
+        pass
+
+    def on_epoch_end(self, epoch):
+        pass
+
+
+class CallbackList(Callback):
+    def __init__(self, callbacks):
+        self.callbacks = list(callbacks)
+
+    def on_train_begin(self, worker):
+        for callback in self.callbacks:
+            callback.on_train_begin(worker)
+
+    def on_batch_end(self, split, step, epoch, batch):
+        for callback in self.callbacks:
+            callback.on_batch_end(split, step, epoch, batch)
+
+    def on_epoch_end(self, epoch):
+        for callback in self.callbacks:
+            callback.on_epoch_end(epoch)
+
+
+class PeriodicCallback(Callback, metaclass=abc.ABCMeta):
+    """
+    Calls run() on every `every`-th training batch and every `test_every`-th test batch, and on the
+    last training batch of each epoch when `at_epoch_end` is set. 0 disables a split.
+    """
+
+    def __init__(self, every=50, test_every=1, at_epoch_end=True):
+        self.every = every
+        self.test_every = test_every
+        self.at_epoch_end = at_epoch_end
+        self.counts = {}
+        self.last_batch = None
+
+    def on_batch_end(self, split, step, epoch, batch):
+        interval = self.every if split == 'train' else self.test_every
+        count = self.counts.get(split, 0)
+        self.counts[split] = count + 1
+        if interval and count % interval == 0:
+            self.run(split, step, epoch, batch)
+            if split == 'train':
+                self.last_batch = None
+        elif split == 'train' and self.at_epoch_end:
+            # only the reference is kept, the tensors are copied if the epoch ends on this batch
+            self.last_batch = (step, batch)
+
+    def on_epoch_end(self, epoch):
+        if self.last_batch is not None:
+            step, batch = self.last_batch
+            self.run('train', step, epoch, batch)
+        self.last_batch = None
+        self.counts = {}
+
+    @abc.abstractmethod
+    def run(self, split, step, epoch, batch):
+        pass
+
+
+def _numpy(tensor):
+    return tensor.detach().cpu().numpy()
+
+
+class HeatmapDumpCallback(PeriodicCallback):
+    """
+    Saves the predicted heatmaps as .npy and .png files, what save_heatmaps did for every item.
+    """
+
+    def __init__(self, heatmaps_dir='pred_heatmaps', **periodic_args):
+        super(HeatmapDumpCallback, self).__init__(**periodic_args)
+        self.heatmaps_dir = heatmaps_dir
+
+    def run(self, split, step, epoch, batch):
+        heatmaps = _numpy(batch['output'][0])
+        heatmaps_dir = self.heatmaps_dir + ('_training' if split == 'train' else '_test')
+        for item_idx, filename in enumerate(batch['filenames']):
+            self.worker.submit(None, save_heatmaps_job, heatmaps[item_idx], filename, heatmaps_dir, epoch)
+
+
+def save_heatmaps_job(heatmaps, filename, heatmaps_dir, epoch):
+    from ground_truth_dataloop import save_heatmaps
+    save_heatmaps(heatmaps, filename, 0, num_keypoints=heatmaps.shape[0], heatmaps_dir=heatmaps_dir, epoch=epoch)
+
+
+class DecodeCallback(PeriodicCallback):
+    """
+    Decodes the poses of every item of a batch in the worker, then draws and/or evaluates them:
+
+    - output_dirs: split -> directory, the poses are drawn on the loader's draw image into
+      <directory>/<filename>/keypoints_output_<epoch>/<filename>_keypoints.jpg
+    - image_files: split -> list of (output_dir, appended_text), the poses are drawn by
+      visualizers.draw_coordinates_to_image_file on the image read from image_dirs[split]
+    - metrics_fn(keypoint_coords, ground_truth_keypoints, image_size) runs in the worker and returns a
+      dict of metrics, which comes back through BackgroundWorker.results() tagged with (split, step, epoch)
+    """
+
+    def __init__(self, output_stride, output_dirs=None, image_files=None, image_dirs=None, scale_factor=1.0,
+                 metrics_fn=None, score_threshold=0.25, **periodic_args):
+        super(DecodeCallback, self).__init__(**periodic_args)
+        self.output_stride = output_stride
+        self.output_dirs = output_dirs or {}
+        self.image_files = image_files or {}
+        self.image_dirs = image_dirs or {}
+        self.scale_factor = scale_factor
+        self.metrics_fn = metrics_fn
+        self.score_threshold = score_threshold
+
+    def run(self, split, step, epoch, batch):
+        heatmaps, offsets, displacements_fwd, displacements_bwd = [_numpy(o) for o in batch['output'][:4]]
+        draw_images = np.asarray(batch['draw_image'])
+        ground_truth_keypoints = _numpy(batch['ground_truth_keypoints'])
+        image_files = [(output_dir, appended_text, self.image_dirs.get(split), self.scale_factor)
+                       for output_dir, appended_text in self.image_files.get(split, ())]
+        for item_idx, filename in enumerate(batch['filenames']):
+            self.worker.submit(
+                (split, step, epoch), decode_job,
+                heatmaps[item_idx], offsets[item_idx], displacements_fwd[item_idx], displacements_bwd[item_idx],
+                self.output_stride, self.score_threshold, draw_images[item_idx], filename,
+                ground_truth_keypoints[item_idx], self.output_dirs.get(split), image_files, epoch, self.metrics_fn,
+                # the metrics only cover the evaluated items if none of them is dropped
+                block=self.metrics_fn is not None)
+
+
+def decode_job(heatmaps, offsets, displacements_fwd, displacements_bwd, output_stride, score_threshold, draw_image,
+               filename, ground_truth_keypoints, output_dir, image_files, epoch, metrics_fn):
+    import posenet
+    from posenet.decode_multi import decode_multiple_poses
+
+    pose_scores, keypoint_scores, keypoint_coords, _ = decode_multiple_poses(
+        torch.from_numpy(heatmaps),
+        torch.from_numpy(offsets),
+        torch.from_numpy(displacements_fwd),
+        torch.from_numpy(displacements_bwd),
+        output_stride=output_stride,
+        max_pose_detections=10,
+        min_pose_score=score_threshold)
+    valid_indices = np.where(pose_scores >= score_threshold)[0]
+    pose_scores = pose_scores[valid_indices]
+    keypoint_scores = keypoint_scores[valid_indices]
+    keypoint_coords = keypoint_coords[valid_indices]
+
+    if output_dir:
+        # drawn on the image the loader already decoded, the file is not read again
+        image = posenet.draw_skel_and_kp(np.array(draw_image), pose_scores, keypoint_scores, keypoint_coords,
+                                         min_pose_score=score_threshold, min_part_score=score_threshold)
+        image_dir = os.path.join(output_dir, filename, 'keypoints_output_' + str(epoch))
+        os.makedirs(image_dir, exist_ok=True)
+        cv2.imwrite(os.path.join(image_dir, filename + '_keypoints.jpg'), image)
+
+    for image_output_dir, appended_text, image_path, scale_factor in image_files:
+        from visualizers import draw_coordinates_to_image_file
+        os.makedirs(image_output_dir, exist_ok=True)
+        draw_coordinates_to_image_file(appended_text, image_path, image_output_dir, output_stride, scale_factor,
+                                       pose_scores, keypoint_scores, keypoint_coords, filename)
+
+    if metrics_fn is not None:
+        return metrics_fn(torch.from_numpy(keypoint_coords), torch.from_numpy(ground_truth_keypoints), draw_image.shape[0])
+    return None
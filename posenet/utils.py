@@ -1,5 +1,7 @@
 import cv2
+import threading
 import numpy as np
+import torch
 
 import posenet.constants
 
@@ -26,16 +28,88 @@ def _process_input(source_img, scale_factor=1.0, output_stride=16):
     return input_img, source_img, scale
 
 
+class InputPreprocessor(object):
+    """
+    Same output as _process_input, without the per frame allocations.
+
+    The target resolution and scale are computed once per source shape, the resize writes into a
+    reused uint8 buffer and the normalized CHW result is written straight into a reused float
+    tensor (pinned when CUDA is available, so to_input_tensor can copy it to the device
+    asynchronously). The returned input image is that tensor and is overwritten by the next call
+    unless reuse=False is passed.
+    """
+
+    def __init__(self, scale_factor=1.0, output_stride=16, pin_memory=None):
+        self.scale_factor = scale_factor
+        self.output_stride = output_stride
+        self.pin_memory = torch.cuda.is_available() if pin_memory is None else pin_memory
+        self._resolutions = {}
+        self._buffers = {}
+
+    def resolution(self, source_shape):
+        resolution = self._resolutions.get(source_shape)
+        if resolution is None:
+            target_width, target_height = valid_resolution(
+                source_shape[1] * self.scale_factor, source_shape[0] * self.scale_factor,
+                output_stride=self.output_stride)
+            scale = np.array([source_shape[0] / target_height, source_shape[1] / target_width])
+            resolution = self._resolutions[source_shape] = (target_width, target_height, scale)
+        return resolution
+
+    def _new_tensor(self, target_height, target_width):
+        return torch.empty((1, 3, target_height, target_width), dtype=torch.float32, pin_memory=self.pin_memory)
+
+    def buffers(self, target_height, target_width):
+        buffers = self._buffers.get((target_height, target_width))
+        if buffers is None:
+            resized = np.empty((target_height, target_width, 3), dtype=np.uint8)
+            buffers = self._buffers[(target_height, target_width)] = (
+                resized, self._new_tensor(target_height, target_width))
+        return buffers
+
+    def __call__(self, source_img, reuse=True):
+        target_width, target_height, scale = self.resolution(source_img.shape[:2])
+        resized, input_tensor = self.buffers(target_height, target_width)
+        if not reuse:
+            input_tensor = self._new_tensor(target_height, target_width)
+
+        cv2.resize(source_img, (target_width, target_height), dst=resized, interpolation=cv2.INTER_LINEAR)
+
+        # BGR -> RGB, HWC -> CHW and scaling to [-1, 1] in one pass per channel
+        input_img = input_tensor.numpy()[0]
+        for channel in range(3):
+            np.multiply(resized[:, :, 2 - channel], np.float32(2.0 / 255.0), out=input_img[channel])
+            np.subtract(input_img[channel], np.float32(1.0), out=input_img[channel])
+        return input_tensor, source_img, scale
+
+
+_preprocessors = threading.local()
+
+
+def get_preprocessor(scale_factor=1.0, output_stride=16):
+    # one preprocessor per thread, the reader threads of posenet_inference.py must not share buffers
+    cache = getattr(_preprocessors, 'cache', None)
+    if cache is None:
+        cache = _preprocessors.cache = {}
+    key = (scale_factor, output_stride)
+    if key not in cache:
+        cache[key] = InputPreprocessor(scale_factor, output_stride)
+    return cache[key]
+
+
 def read_cap(cap, scale_factor=1.0, output_stride=16):
+    # frames are consumed before the next read (decoding waits for the device, so an asynchronous
+    # copy out of the pinned buffer has finished), so the input buffer is reused
     res, img = cap.read()
     if not res:
         raise IOError("webcam failure")
-    return _process_input(img, scale_factor, output_stride)
+    return get_preprocessor(scale_factor, output_stride)(img)
 
 
 def read_imgfile(path, scale_factor=1.0, output_stride=16):
+    # callers keep image inputs around (batching, prefetching, caching), so each gets its own tensor
     img = cv2.imread(path)
-    return _process_input(img, scale_factor, output_stride)
+    return get_preprocessor(scale_factor, output_stride)(img, reuse=False)
 
 
 def draw_keypoints(
@@ -4,6 +4,7 @@ import time
 import argparse
 
 import posenet
+from posenet.decode_multi import *
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--model', type=int, default=101)
@@ -11,13 +12,18 @@ parser.add_argument('--cam_id', type=int, default=0)
 parser.add_argument('--cam_width', type=int, default=1280)
 parser.add_argument('--cam_height', type=int, default=720)
 parser.add_argument('--scale_factor', type=float, default=0.7125)
+parser.add_argument('--torch_decode', action='store_true', help='decode on the model device, about 8 ms/image on CPU vs 3-7 ms for the numpy decoder, for GPUs see benchmark_decode.py --device cuda')
+parser.add_argument('--single_pose', action='store_true')
+parser.add_argument('--backend', type=str, default='eager', choices=posenet.BACKENDS)
+posenet.add_device_args(parser)
 args = parser.parse_args()
 
 
 def main():
-    model = posenet.load_model(args.model)
-    model = model.cuda()
+    device = posenet.select_device(args.device, args.num_threads, args.num_interop_threads)
+    model = posenet.load_backend(args.backend, args.model, device=device, channels_last=args.channels_last)
     output_stride = model.output_stride
+    decode = decode_multiple_poses_torch if args.torch_decode else decode_multiple_poses
 
     cap = cv2.VideoCapture(args.cam_id)
     cap.set(3, args.cam_width)
@@ -29,19 +35,26 @@ def main():
         input_image, display_image, output_scale = posenet.read_cap(
             cap, scale_factor=args.scale_factor, output_stride=output_stride)
 
-        with torch.no_grad():
-            input_image = torch.Tensor(input_image).cuda()
+        with posenet.inference_context(args.inference_mode):
+            input_image = posenet.to_input_tensor(input_image, device, args.channels_last)
 
             heatmaps_result, offsets_result, displacement_fwd_result, displacement_bwd_result = model(input_image)
 
-            pose_scores, keypoint_scores, keypoint_coords = posenet.decode_multiple_poses(
-                heatmaps_result.squeeze(0),
-                offsets_result.squeeze(0),
-                displacement_fwd_result.squeeze(0),
-                displacement_bwd_result.squeeze(0),
-                output_stride=output_stride,
-                max_pose_detections=10,
-                min_pose_score=0.15)
+            if args.single_pose:
+                pose_scores, keypoint_scores, keypoint_coords, pose_offsets = posenet.decode.decode_single_pose(
+                    heatmaps_result.squeeze(0),
+                    offsets_result.squeeze(0),
+                    output_stride=output_stride,
+                    min_pose_score=0.15)
+            else:
+                pose_scores, keypoint_scores, keypoint_coords, pose_offsets = decode(
+                    heatmaps_result.squeeze(0),
+                    offsets_result.squeeze(0),
+                    displacement_fwd_result.squeeze(0),
+                    displacement_bwd_result.squeeze(0),
+                    output_stride=output_stride,
+                    max_pose_detections=10,
+                    min_pose_score=0.15)
 
         keypoint_coords *= output_scale
 
@@ -5,31 +5,36 @@ Authors: Harsh Benahalkar, Devika Gumaste
 
 # Import statements
 import time
+from utils.startup import StartupReport
+startup = StartupReport()
+
 import os
 import tkinter as tk
+import threading
 import cv2
 import sys
 
-# Import mediapipe library for pose estimation
-import mediapipe as mp
-from mediapipe.tasks import python
-from mediapipe.tasks.python import vision
-from mediapipe.framework.formats import landmark_pb2
+# mediapipe takes most of the startup time to import, it is imported by load_pipeline once the window is up
+mp = None
+vision = None
 
-from utils.helper_functions import *
 from correction_algorithm.main import *
 from correction_algorithm.correction import *
+from correction_algorithm.tracking import PoseTracker
+from correction_algorithm.streaming import NO_POSE_MESSAGE
+from correction_algorithm.classifier import PoseClassifier
 from utils.constants import *
-from PIL import Image, ImageTk
-
-# Setting up mediapipe pose detection objects
-mp_pose = mp.solutions.pose
-mp_drawing = mp.solutions.drawing_utils
-mp_drawing_styles = mp.solutions.drawing_styles
+from utils.pipeline import LatestFrameQueue, ResultSlot, LatencyCounters, CaptureThread
+from utils.rendering import draw_pose_landmarks, CanvasImage
+from utils.assets import ReferenceImages
+startup.mark("modules imported")
 
 # Getting the current working directory
 curr_path = os.getcwd()
 
+# Print the import and startup stage timings once the first frame is rendered
+STARTUP_REPORT = "--startup_report" in sys.argv
+
 # Initializing a tkinter window
 window = tk.Tk()
 
@@ -39,114 +44,211 @@ height = 1000
 camera_width = 640
 camera_height = 480
 
-# Constants for iteration count and loop count
-ITERATIONS = 50
-loop_count = 0
+# Maximum number of people detected and corrected per frame
+NUM_POSES = 4
+
+# Feedback smoothing ("ema" or "one_euro") and the number of consistent frames before a message flips
+SMOOTHING = "one_euro"
+HYSTERESIS_FRAMES = 5
+
+# Delay between two renders on the Tk thread, in milliseconds
+RENDER_INTERVAL = 10
 
-camera_result = None
+# Pipeline state shared between the capture thread, the detector callback and the Tk thread
+frames = LatestFrameQueue()
+results = ResultSlot()
+latencies = LatencyCounters(["capture", "inference", "render"])
+frame_timestamp = 0
+last_timestamp = None
+feedback_text = None
+person_labels = []
 yoga_options = ["Downward Facing Dog", "Chair Pose", "Revolved Triangle", "Half Moon", "Tree Pose"]
+# Menu entry picking each person's pose from their joint angles
+AUTO_OPTION = "Auto Detect"
 # Function to convert yoga pose names to lowercase and replace spaces with underscores
 uglify = lambda x : x.lower().replace(" ", "_")
+prettify = {uglify(option): option for option in yoga_options}
 
 # Callback function to handle camera results
-def print_result(result: vision.PoseLandmarkerResult, output_image: mp.Image, timestamp_ms: int):
-    global camera_result 
-    camera_result = result
-
-# Setting up options for mediapipe pose detection
-base_options = python.BaseOptions(model_asset_path=os.path.join(curr_path, 'models/pose_landmarker.task'))
-options = vision.PoseLandmarkerOptions(
-    num_poses = 1,
-    min_pose_detection_confidence = 0.5,
-    min_pose_presence_confidence = 0.5,
-    min_tracking_confidence = 0.5,
-    base_options=base_options,
-    running_mode = vision.RunningMode.LIVE_STREAM,
-    result_callback = print_result,
-    output_segmentation_masks=False)
-detector = vision.PoseLandmarker.create_from_options(options)
+def print_result(result: "vision.PoseLandmarkerResult", output_image: "mp.Image", timestamp_ms: int):
+    # runs on the detector thread, timestamps are wall clock ms so their age is the inference latency
+    latencies.add("inference", (time.time_ns() // 1_000_000 - timestamp_ms) / 1000.0)
+    results.set(result, timestamp_ms)
+
+# Landmarker, camera and capture thread, created by load_pipeline after the window is shown
+detector = None
+cap = None
+capture_thread = None
+first_frame_rendered = False
+# Loader progress, written by the loader thread and shown by poll_loading on the Tk thread
+loading_message = "Starting..."
+pipeline_ready = threading.Event()
+
+# Function to import mediapipe, create the landmarker and open the camera, runs on a background thread
+def load_pipeline():
+    global mp, vision, detector, cap, loading_message
+    try:
+        loading_message = "Loading pose landmarker..."
+        mp = startup.import_module("mediapipe")
+        python = startup.import_module("mediapipe.tasks.python")
+        vision = startup.import_module("mediapipe.tasks.python.vision")
+        startup.mark("mediapipe imported")
+
+        # Setting up options for mediapipe pose detection
+        base_options = python.BaseOptions(model_asset_path=os.path.join(curr_path, 'models/pose_landmarker.task'))
+        options = vision.PoseLandmarkerOptions(
+            num_poses = NUM_POSES,
+            min_pose_detection_confidence = 0.5,
+            min_pose_presence_confidence = 0.5,
+            min_tracking_confidence = 0.5,
+            base_options=base_options,
+            running_mode = vision.RunningMode.LIVE_STREAM,
+            result_callback = print_result,
+            output_segmentation_masks=False)
+        detector = vision.PoseLandmarker.create_from_options(options)
+        startup.mark("landmarker created")
+
+        # Initializing the camera capture object
+        loading_message = "Opening camera..."
+        cap = cv2.VideoCapture(0)
+        startup.mark("camera opened")
+        if not cap.isOpened():
+            loading_message = "No camera found"
+    except Exception as e:
+        loading_message = f"Startup failed: {e}"
+        return
+    pipeline_ready.set()
+
+# Function to show the loader progress on the camera canvas and, once everything is loaded,
+# start capturing on its own thread and rendering on the Tk thread
+def poll_loading():
+    global capture_thread
+    canvas.itemconfig(loading_item, text=loading_message)
+    if not pipeline_ready.is_set():
+        window.after(50, poll_loading)
+        return
+    capture_thread = CaptureThread(cap, prepare_frame, frames, latencies)
+    capture_thread.start()
+    update_camera()
 
 # Setting the current option to the first yoga pose option
 curr_option = yoga_options[0]
 
-# Default image path based on the current option
-default_image_path = os.path.join(curr_path, "images", 
-                                  f"{uglify(curr_option)}.png")
-default_image = Image.open(default_image_path)
-default_photo = ImageTk.PhotoImage(default_image)
+# Reference images of every option, decoded in the background starting with the current option
+reference_images = ReferenceImages(window, {
+    uglify(option): os.path.join(curr_path, "images", f"{uglify(option)}.png") for option in yoga_options})
 
-# Initializing the camera capture object
-cap = cv2.VideoCapture(0)
+# Per person streaming feedback for the selected pose, updated on every new detection result
+tracker = PoseTracker(uglify(curr_option), smoothing=SMOOTHING, hysteresis_frames=HYSTERESIS_FRAMES)
+classifier = PoseClassifier()
 
-# Function to update the camera feed
+# Function to prepare a captured frame and submit it for detection, runs on the capture thread
+def prepare_frame(frame):
+    global frame_timestamp
+    frame = cv2.flip(frame, 1)
+    # detect_async needs strictly increasing timestamps
+    frame_timestamp = max(frame_timestamp + 1, time.time_ns() // 1_000_000)
+    detector.detect_async(mp.Image(image_format=mp.ImageFormat.SRGB, data=frame), frame_timestamp)
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+# Function to render the newest frame with the newest result, the only work left on the Tk thread
 def update_camera():
-    global photo
-    global loop_count
-    global ITERATIONS
-    ret, frame = cap.read()
-    if ret:
-        frame = cv2.flip(frame, 1)
-        image = mp.Image(image_format=mp.ImageFormat.SRGB, data=frame)
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        detector.detect_async(image, time.time_ns() // 1_000_000)
+    global last_timestamp
+    global feedback_text
+    global person_labels
+    global first_frame_rendered
+    frame = frames.get()
+    if frame is not None:
+        start = time.perf_counter()
+        if not first_frame_rendered:
+            first_frame_rendered = True
+            canvas.delete(loading_item)
+        camera_result, camera_timestamp = results.get()
 
         if camera_result:
-            for pose_landmarks in camera_result.pose_landmarks:
-                # Drawing detected pose landmarks on the camera frame
-                pose_landmarks_proto = landmark_pb2.NormalizedLandmarkList()
-                pose_landmarks_proto.landmark.extend([
-                    landmark_pb2.NormalizedLandmark(x=landmark.x, 
-                                                    y=landmark.y,
-                                                    z=landmark.z) for landmark in pose_landmarks
-                ])
-                mp_drawing.draw_landmarks(
-                    frame,
-                    pose_landmarks_proto,
-                    mp_pose.POSE_CONNECTIONS,
-                    mp_drawing_styles.get_default_pose_landmarks_style())
-
-            # feedback
-            col_names = []
-            for i in range(len(Constants.BODY_KP.value.keys())):
-                name = list(Constants.BODY_KP.value.keys())[i]
-                col_names.append(name + "_x")
-                col_names.append(name + "_y")
-                col_names.append(name + "_z")
-            
-            pose_cols = col_names.copy()
-            pose_cols.append("pose")
-            
-            # Generating feedback based on detected pose angles
-            if loop_count == ITERATIONS:
-                angles_dict = create_angles_dict(camera_result, pose_cols)
-                if angles_dict is not None:
-                    feedback = check_pose_angle(angles_dict[0])
-                    feedback_final = format_feedback(feedback[uglify(curr_option)])
-                    text1.delete("1.0", tk.END)
-                    text1.insert(tk.END, feedback_final)
+            # Drawing detected pose landmarks on the camera frame
+            poses = all_landmarks_to_array(camera_result)
+            for landmarks in poses:
+                draw_pose_landmarks(frame, landmarks)
+
+            # Generating feedback once per detection result for everyone in it, angles of all people
+            # come from one array op and the tracker keeps each person's feedback state
+            if camera_timestamp != last_timestamp:
+                last_timestamp = camera_timestamp
+                people = tracker.update(poses, compute_angles(poses), camera_timestamp / 1000.0)
+                person_labels = [(track.id, poses[d, :, :2].min(axis=0)) for track, d in people]
+
+                # nobody detected: the previous feedback stays until every track has missed the hysteresis frames
+                shown = [track for track, _ in people] or tracker.recent_tracks()
+                if not shown:
+                    text = NO_POSE_MESSAGE
+                elif len(shown) == 1 and tracker.classifier is None:
+                    text = shown[0].corrector.text
                 else:
+                    text = "\n".join(f"Person {track.id}{person_pose(track)}: {track.corrector.text}" for track in shown)
+                if text != feedback_text:
+                    feedback_text = text
                     text1.delete("1.0", tk.END)
-                    text1.insert(tk.END, "No pose detected!")
-                loop_count = 0
-        
-            loop_count = loop_count + 1
-
-        # Displaying the camera frame on the tkinter canvas
-        photo = ImageTk.PhotoImage(image=Image.fromarray(frame))
-        canvas.create_image(0, 0, anchor=tk.NW, image=photo)
-        window.after(1, update_camera)
+                    text1.insert(tk.END, feedback_text)
+
+            # Labelling people with their tracked id when there is more than one
+            if len(person_labels) > 1:
+                for person_id, (x, y) in person_labels:
+                    position = (int(x * frame.shape[1]), max(int(y * frame.shape[0]) - 10, 15))
+                    cv2.putText(frame, str(person_id), position, cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 0), 2)
+
+        # Displaying the camera frame in the canvas image item
+        canvas_image.show(frame)
+        latencies.add("render", time.perf_counter() - start)
+        label3.config(text=f"{latencies.summary()}  dropped {frames.dropped}")
+        if startup is not None:
+            report_startup()
+    window.after(RENDER_INTERVAL, update_camera)
+
+# Function to mark the first rendered frame and print the startup report once
+def report_startup():
+    global startup
+    startup.mark("first frame rendered")
+    if STARTUP_REPORT:
+        startup.print()
+    startup = None
+
+# Function to describe the pose a person is corrected against, only when it is detected automatically
+def person_pose(track):
+    if tracker.classifier is None:
+        return ""
+    return f" ({prettify[track.corrector.pose_name]} {track.confidence:.0%})"
+
+# Function to stop the capture thread and the detector before closing the window
+def on_close():
+    # the landmarker and camera may still be loading, the loader thread is a daemon and dies with the app
+    if capture_thread is not None:
+        capture_thread.stop()
+    if cap is not None:
+        cap.release()
+    if detector is not None:
+        detector.close()
+    window.destroy()
 
 # Function to handle selection of yoga pose options
 def on_option_selected(value):
     global curr_option
     curr_option = value
     label1.config(text=f"Posture selected: {curr_option}")
-
-    image_path = os.path.join(curr_path, "images", f"{uglify(value)}.png")
-    image = Image.open(image_path)
-    photo = ImageTk.PhotoImage(image=image)
-    label2.config(image=photo)
-    label2.image = photo
+    if value == AUTO_OPTION:
+        # the reference image of the previous pose stays up, people are corrected against their detected pose
+        tracker.set_pose(tracker.pose_name, classifier)
+        return
+    tracker.set_pose(uglify(value))
+    reference_images.when_ready(uglify(value), show_reference_image(value))
+
+# Function making the callback that shows a reference image, unless another pose was picked meanwhile
+def show_reference_image(option):
+    def show(photo):
+        if option == curr_option:
+            label2.config(image=photo)
+            label2.image = photo
+    return show
 
 # Setting up tkinter window and components
 window.geometry("%dx%d" % (1000, camera_height))
@@ -155,26 +257,36 @@ window.title("DGHB EECS6692 S24 final project")
 
 canvas = tk.Canvas(window, width=camera_width, height=camera_height, bg="white")
 canvas.pack(side=tk.LEFT)
+canvas_image = CanvasImage(canvas)
+loading_item = canvas.create_text(camera_width // 2, camera_height // 2, text="Starting...", font=("Arial", 14), fill="gray")
 
 label1 = tk.Label(window, text=f"Posture selected: {curr_option}", font=("Arial", 12), bg="white", fg="black")
 label1.place(x=650, y=50)
 
-label2 = tk.Label(window, image=default_photo, bg="white")
+label2 = tk.Label(window, bg="white")
 label2.place(x=750, y=100)
 
 selected_option = tk.StringVar(window)
 selected_option.set(yoga_options[0])
-menu = tk.OptionMenu(window, selected_option, *yoga_options, command=on_option_selected)
+menu = tk.OptionMenu(window, selected_option, *yoga_options, AUTO_OPTION, command=on_option_selected)
 menu.config(bg="#ffffff", fg="black", font=("Arial", 12), width=28, height=1)
 menu.pack(side=tk.RIGHT)
 menu.place(x=650, y=280)
 
-text1 = tk.Text(window, wrap="word", width=36, height=5)
+text1 = tk.Text(window, wrap="word", width=36, height=NUM_POSES + 1)
 text1.pack(fill="both", expand=True)
 text1.place(x=650, y=330)
 
-# Start updating the camera feed
-update_camera()
+label3 = tk.Label(window, text="", font=("Arial", 9), bg="white", fg="gray")
+label3.place(x=650, y=440)
+
+# Start decoding the reference images and loading the pipeline, both in the background so the window shows right away
+reference_images.start()
+reference_images.when_ready(uglify(curr_option), show_reference_image(curr_option))
+threading.Thread(target=load_pipeline, name="loader", daemon=True).start()
+window.protocol("WM_DELETE_WINDOW", on_close)
+window.after(0, lambda: startup.mark("window shown"))
+poll_loading()
 
 window.mainloop()
 
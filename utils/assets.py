@@ -0,0 +1,70 @@
+"""
+EECS 6692: Deep Learning on the Edge
+File contains the cache of the reference pose images shown next to the live view
+"""
+import queue
+import threading
+from PIL import Image, ImageTk
+
+# Largest size a reference image is shown at
+REFERENCE_SIZE = (150, 150)
+
+class ReferenceImages:
+    """
+    Decodes and downsizes every reference image once, on a background thread, so neither startup
+    nor a pose switch waits on a PNG decode. PhotoImages can only be created on the Tk thread, so
+    the decoded images are handed over through a queue that the Tk thread polls with window.after.
+    """
+
+    def __init__(self, window, paths, size=REFERENCE_SIZE, poll_interval=20):
+        # paths: pose name -> image path, decoded in order so the first one shows up first
+        self.window = window
+        self.paths = dict(paths)
+        self.size = size
+        self.poll_interval = poll_interval
+        self.photos = {}
+        self.callbacks = {}
+        self.decoded = queue.Queue()
+        self.thread = threading.Thread(target=self._decode_all, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        self.window.after(self.poll_interval, self._poll)
+
+    def _decode(self, path):
+        image = Image.open(path)
+        image.draft("RGB", self.size)
+        image = image.convert("RGB")
+        image.thumbnail(self.size)
+        return image
+
+    def _decode_all(self):
+        for name, path in self.paths.items():
+            try:
+                self.decoded.put((name, self._decode(path)))
+            except OSError as e:
+                print(f"Cannot load reference image {path}: {e}")
+
+    def _add(self, name, image):
+        self.photos[name] = ImageTk.PhotoImage(image)
+        for callback in self.callbacks.pop(name, []):
+            callback(self.photos[name])
+
+    def _poll(self):
+        while True:
+            try:
+                name, image = self.decoded.get_nowait()
+            except queue.Empty:
+                break
+            self._add(name, image)
+        if self.thread.is_alive() or not self.decoded.empty():
+            self.window.after(self.poll_interval, self._poll)
+
+    def when_ready(self, name, callback):
+        """
+        Calls callback(photo) on the Tk thread, right away if the image is already decoded.
+        """
+        if name in self.photos:
+            callback(self.photos[name])
+        else:
+            self.callbacks.setdefault(name, []).append(callback)
@@ -0,0 +1,85 @@
+"""
+EECS 6692: Deep Learning on the Edge
+File measures the per frame render time of the live view, old path against the new one
+"""
+import argparse
+import time
+import numpy as np
+import tkinter as tk
+from PIL import Image, ImageTk
+from mediapipe import solutions
+from mediapipe.framework.formats import landmark_pb2
+
+from utils.rendering import draw_pose_landmarks, CanvasImage
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--width', type=int, default=640)
+parser.add_argument('--height', type=int, default=480)
+parser.add_argument('--num_frames', type=int, default=300)
+parser.add_argument('--seed', type=int, default=0)
+args = parser.parse_args()
+
+landmark_style = solutions.drawing_styles.get_default_pose_landmarks_style()
+
+# Function with the drawing run.py did before, a protobuf per pose and mp_drawing.draw_landmarks
+def draw_old(frame, landmarks):
+    pose_landmarks_proto = landmark_pb2.NormalizedLandmarkList()
+    pose_landmarks_proto.landmark.extend([
+        landmark_pb2.NormalizedLandmark(x=x, y=y, z=z) for x, y, z in landmarks
+    ])
+    solutions.drawing_utils.draw_landmarks(
+        frame, pose_landmarks_proto, solutions.pose.POSE_CONNECTIONS, landmark_style)
+
+# Function to time `render` over all frames, in ms per frame
+def measure(frames, landmarks, render):
+    start = time.perf_counter()
+    for frame, pose in zip(frames, landmarks):
+        render(frame.copy(), pose)
+    return 1000.0 * (time.perf_counter() - start) / len(frames)
+
+def main():
+    rng = np.random.default_rng(args.seed)
+    frames = rng.integers(0, 256, (8, args.height, args.width, 3), dtype=np.uint8)
+    frames = [frames[i % len(frames)] for i in range(args.num_frames)]
+    landmarks = rng.uniform(0.05, 0.95, (args.num_frames, 33, 3))
+
+    results = {
+        "draw (protobuf + mp_drawing)": measure(frames, landmarks, draw_old),
+        "draw (landmark array)": measure(frames, landmarks, draw_pose_landmarks),
+    }
+
+    try:
+        window = tk.Tk()
+    except tk.TclError:
+        window = None
+        print("No display, only the drawing step is measured")
+
+    if window is not None:
+        canvas = tk.Canvas(window, width=args.width, height=args.height)
+        canvas.pack()
+        photos = []
+
+        def show_old(frame, pose):
+            draw_old(frame, pose)
+            photo = ImageTk.PhotoImage(image=Image.fromarray(frame))
+            canvas.create_image(0, 0, anchor=tk.NW, image=photo)
+            photos.append(photo)
+            window.update()
+
+        canvas_image = CanvasImage(canvas)
+
+        def show_new(frame, pose):
+            draw_pose_landmarks(frame, pose)
+            canvas_image.show(frame)
+            window.update()
+
+        results["frame (old)"] = measure(frames, landmarks, show_old)
+        canvas.delete("all")
+        results["frame (new)"] = measure(frames, landmarks, show_new)
+        window.destroy()
+
+    for name, value in results.items():
+        print("%-32s %8.3f ms" % (name, value))
+
+if __name__ == "__main__":
+    main()
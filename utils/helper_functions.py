@@ -3,7 +3,6 @@ EECS 6692: Deep Learning on the Edge
 File contains functions to display images and annotations
 """
 import cv2
-import matplotlib.pyplot as plt
 import numpy as np
 from mediapipe import solutions
 from mediapipe.framework.formats import landmark_pb2
@@ -21,7 +20,8 @@ def display_image(image_path):
     # Convert the image from BGR to RGB (OpenCV uses BGR by default)
     image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 
-    # Display the image using Matplotlib
+    # Display the image using Matplotlib, imported here as it is slow to import and only needed for display
+    import matplotlib.pyplot as plt
     plt.imshow(image_rgb)
     plt.axis('off')  # Hide axis
     plt.show()
@@ -36,6 +36,7 @@ def display_annotated_image(image):
     # image_rgb = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
 
     # Display the image using Matplotlib
+    import matplotlib.pyplot as plt
     plt.imshow(image)
     plt.axis('off')  # Hide axis
     plt.show()
@@ -0,0 +1,85 @@
+"""
+EECS 6692: Deep Learning on the Edge
+File contains the threading helpers for the live capture, inference and rendering pipeline
+"""
+import threading
+import time
+
+# Single slot queue, a new frame replaces the one that was not picked up yet
+class LatestFrameQueue:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._item = None
+        self.dropped = 0
+
+    def put(self, item):
+        with self._lock:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = item
+
+    def get(self):
+        # returns None when there is no new frame since the last get
+        with self._lock:
+            item, self._item = self._item, None
+        return item
+
+# Latest inference result, written by the detector callback thread and read by the Tk thread
+class ResultSlot:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._result = None
+        self._timestamp = None
+
+    def set(self, result, timestamp):
+        with self._lock:
+            self._result = result
+            self._timestamp = timestamp
+
+    def get(self):
+        with self._lock:
+            return self._result, self._timestamp
+
+# Smoothed per stage latencies in milliseconds
+class LatencyCounters:
+    def __init__(self, stages, alpha=0.1):
+        self._lock = threading.Lock()
+        self.alpha = alpha
+        self.stages = stages
+        self.values = {stage: None for stage in stages}
+
+    def add(self, stage, seconds):
+        ms = seconds * 1000.0
+        with self._lock:
+            value = self.values[stage]
+            self.values[stage] = ms if value is None else value + self.alpha * (ms - value)
+
+    def summary(self):
+        with self._lock:
+            return "  ".join(
+                "%s %s ms" % (stage, "-" if self.values[stage] is None else "%.1f" % self.values[stage])
+                for stage in self.stages)
+
+# Thread reading the camera, each frame is handed to `process` and its output to the frame queue
+class CaptureThread(threading.Thread):
+    def __init__(self, cap, process, frames, latencies):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.process = process
+        self.frames = frames
+        self.latencies = latencies
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            start = time.perf_counter()
+            ret, frame = self.cap.read()
+            if not ret:
+                time.sleep(0.01)
+                continue
+            self.frames.put(self.process(frame))
+            self.latencies.add("capture", time.perf_counter() - start)
+
+    def stop(self):
+        self.stopped.set()
+        self.join(timeout=1.0)
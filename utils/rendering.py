@@ -0,0 +1,69 @@
+"""
+EECS 6692: Deep Learning on the Edge
+File contains the drawing and display helpers of the live view
+"""
+import cv2
+import numpy as np
+import tkinter as tk
+from PIL import Image, ImageTk
+
+WHITE_COLOR = (224, 224, 224)
+CONNECTION_COLOR = WHITE_COLOR
+CONNECTION_THICKNESS = 2
+
+# mediapipe's pose connections and default pose style, cached as arrays so drawing needs no protobuf.
+# Built on the first draw, importing mediapipe.solutions takes most of a second at startup
+_pose_style = None
+
+# Function to return the (num connections, 2) connection array and the per landmark
+# (color, thickness, radius, border radius) style
+def pose_style():
+    global _pose_style
+    if _pose_style is None:
+        from mediapipe import solutions
+
+        style = solutions.drawing_styles.get_default_pose_landmarks_style()
+        _pose_style = (
+            np.array(sorted(solutions.pose.POSE_CONNECTIONS), dtype=np.int32),
+            [(style[i].color, style[i].thickness, style[i].circle_radius,
+              max(style[i].circle_radius + 1, int(style[i].circle_radius * 1.2)))
+             for i in range(len(style))],
+        )
+    return _pose_style
+
+# Function to draw one pose from a (33, 3) normalized landmark array, same output as
+# mp_drawing.draw_landmarks with the default pose style
+def draw_pose_landmarks(image, landmarks):
+    connections, landmark_style = pose_style()
+    rows, cols = image.shape[:2]
+    xy = landmarks[:, :2]
+    # landmarks outside the image are not drawn, nor are their connections
+    visible = np.all((xy >= 0) & (xy <= 1), axis=1)
+    pixels = np.minimum(np.floor(xy * (cols, rows)), (cols - 1, rows - 1)).astype(np.int32)
+
+    segments = pixels[connections[visible[connections].all(axis=1)]]
+    cv2.polylines(image, segments, False, CONNECTION_COLOR, CONNECTION_THICKNESS)
+
+    for idx in np.flatnonzero(visible):
+        color, thickness, radius, border_radius = landmark_style[idx]
+        center = (int(pixels[idx, 0]), int(pixels[idx, 1]))
+        cv2.circle(image, center, border_radius, WHITE_COLOR, thickness)
+        cv2.circle(image, center, radius, color, thickness)
+    return image
+
+# One canvas image item updated in place, instead of a new PhotoImage and canvas item per frame
+class CanvasImage:
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.photo = None
+        self.item = None
+
+    def show(self, frame):
+        height, width = frame.shape[:2]
+        if self.photo is None or (self.photo.width(), self.photo.height()) != (width, height):
+            self.photo = ImageTk.PhotoImage("RGB", (width, height))
+            if self.item is None:
+                self.item = self.canvas.create_image(0, 0, anchor=tk.NW, image=self.photo)
+            else:
+                self.canvas.itemconfig(self.item, image=self.photo)
+        self.photo.paste(Image.fromarray(frame))
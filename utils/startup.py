@@ -0,0 +1,43 @@
+"""
+EECS 6692: Deep Learning on the Edge
+File contains the startup timing report of the live app
+"""
+import importlib
+import sys
+import threading
+import time
+
+class StartupReport:
+    """
+    Records how long each startup stage and each lazily imported module took, measured from the
+    creation of the report. print() lays the imports out like `python -X importtime`, in
+    microseconds, followed by the stages in the order they finished.
+    """
+
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self._lock = threading.Lock()
+        self.imports = []
+        self.stages = []
+
+    def import_module(self, name):
+        # modules already loaded (e.g. by another stage) cost nothing and are reported as such
+        already_loaded = name in sys.modules
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        with self._lock:
+            self.imports.append((name, 0.0 if already_loaded else time.perf_counter() - start))
+        return module
+
+    def mark(self, stage):
+        with self._lock:
+            self.stages.append((stage, time.perf_counter() - self.start, threading.current_thread().name))
+
+    def print(self, file=sys.stderr):
+        with self._lock:
+            print("import time: cumulative [us] | imported package", file=file)
+            for name, seconds in self.imports:
+                print("import time: %16d | %s" % (seconds * 1e6, name), file=file)
+            print("startup: %10s | stage (thread)" % "since [ms]", file=file)
+            for stage, seconds, thread in self.stages:
+                print("startup: %10.1f | %s (%s)" % (seconds * 1000, stage, thread), file=file)